@@ -279,6 +279,21 @@ class TextEmbedder private constructor(private val context: Context) {
         return results
     }
 
+    /**
+     * Embeddings of all labels as one row-major FloatArray (labels.size * dim),
+     * so Python can take the whole batch in a single transfer. Labels that
+     * could not be embedded get a zero row.
+     */
+    fun encodeBatchFlat(labels: Array<String>): FloatArray {
+        val embeddings = encodeBatch(labels.asList())
+        val dim = embeddings.firstOrNull { it != null }?.size ?: 0
+        val flat = FloatArray(labels.size * dim)
+        embeddings.forEachIndexed { i, embedding ->
+            embedding?.copyInto(flat, i * dim)
+        }
+        return flat
+    }
+
     fun release() {
         try {
             session?.close()
@@ -3,7 +3,6 @@ import struct
 import time
 import logging
 
-from encryption import Encryption
 from tenseal import CKKSVector
 import tenseal as ts
 
@@ -11,18 +10,20 @@ import json
 
 from graph import Vertex, Graph, Entity, Edge
 import pickle
-from embedding_helper import EmbeddingHelper
+import numpy as np
 from typing import List, Tuple, Optional
 
 # from graph_example_client import get_graph
-from mock_predictor import MockLLMPredictor
-# from predictor import LLMPredictor
-from util import get_random_mask, merge_graphs, append_subgraph_at_uri, sum_values, remove_duplicate_vertices_by_label_and_edge_label, get_graph
+from metrics import Metrics
+from resources import resources
+from util import get_random_mask, merge_graphs, append_subgraph_at_uri, remove_duplicate_vertices_by_label_and_edge_label, get_graph, MergeIndex, receive_exactly, send_message, MSG_UPLOAD, MSG_NAMES, get_files_dir
 
 # 配置日志
 logging.basicConfig(level=logging.DEBUG, format='[%(levelname)s] %(asctime)s %(message)s')
 logger = logging.getLogger("Client")
 
+metrics = Metrics()
+
 def decrypt_vector(encrypted_vector_bytes):
     """Decrypts an encrypted CKKS vector."""
     encrypted_vector = ts.ckks_vector_from(context, encrypted_vector_bytes)
@@ -30,29 +31,25 @@ def decrypt_vector(encrypted_vector_bytes):
 
 def receive_full_message(conn):
     """Receives a message with a fixed-length header."""
-    msg_len_data = conn.recv(4)  # Get the first 4 bytes (message length)
-    if not msg_len_data:
+    msg_len_data = receive_exactly(conn, 4)  # Get the first 4 bytes (message length)
+    if msg_len_data is None:
         logger.warning("No message length data received.")
         return (None, None)
     msg_len = struct.unpack("!I", msg_len_data)[0]  # Unpack message length
 
-    msg_type_data = conn.recv(4)
-    if not msg_type_data:
+    msg_type_data = receive_exactly(conn, 4)
+    if msg_type_data is None:
         logger.warning("No message type data received.")
         return (None, None)
     msg_type = struct.unpack("!I", msg_type_data)[0]
 
     # Receive the full message
-    msg = b""
-    while len(msg) < msg_len:
-        msg_packet = conn.recv(msg_len - len(msg))
-        if not msg_packet:
-            logger.warning("Message packet incomplete.")
-            return (None, None)
-        msg += msg_packet
+    msg = receive_exactly(conn, msg_len)
+    if msg is None:
+        logger.warning("Message packet incomplete.")
+        return (None, None)
 
-    total_bytes_rec = 8 + msg_len
-    bytes_rec_list.append(total_bytes_rec)
+    metrics.received(MSG_NAMES.get(msg_type, str(msg_type)), 8 + msg_len)
 
     # logger.debug(f"Received message of type {msg_type} and length {msg_len}")
     return msg_type, msg
@@ -61,10 +58,10 @@ def request_handler(conn):
     while True:
         msg_type, msg = receive_full_message(conn)
         if not msg:
-            break  # Connection closed
+            break  # MSG_END or connection closed
 
         if msg_type == 1: #Vertex Similarity
-            vertex_similarity_start_time = time.time()
+            vertex_similarity_start_time = time.perf_counter_ns()
             encrypted_vector_bytes = pickle.loads(msg)
             decrypted_values = decrypt_vector(encrypted_vector_bytes)
             logger.info(f"Vertex Similarity Decrypted values: {decrypted_values}")
@@ -75,17 +72,9 @@ def request_handler(conn):
                 response = 1
             # Send back the decrypted values
             response_bytes = struct.pack("!I", response)
-            if "Vertex Similarity" in bytes_sent_dict:
-                bytes_sent_dict["Vertex Similarity"].append(len(response_bytes))
-            else:
-                bytes_sent_dict["Vertex Similarity"] = [len(response_bytes)]
+            metrics.sent("Vertex Similarity", len(response_bytes))
             conn.sendall(response_bytes)
-            vertex_similarity_end_time = time.time()
-            vertex_similarity_total_time = vertex_similarity_end_time - vertex_similarity_start_time
-            if "Vertex Similarity" in times_dict:
-                times_dict["Vertex Similarity"].append(vertex_similarity_total_time)
-            else:
-                times_dict["Vertex Similarity"] = [vertex_similarity_total_time]
+            metrics.add_time("Vertex Similarity", time.perf_counter_ns() - vertex_similarity_start_time)
         elif msg_type == 2:
             try:
                 encrypted_vector_map = pickle.loads(msg)
@@ -95,39 +84,34 @@ def request_handler(conn):
             client_vec_uri = encrypted_vector_map["Vector"]
             k = struct.unpack("!I", encrypted_vector_map["K"])[0]
             
-            try:
-                client_vec = encrypt_map_client[client_vec_uri]
-            except KeyError as e:
-                raise
+            if client_vec_uri not in embedding_map:
+                raise KeyError(client_vec_uri)
 
             try:
-                paths, edges = h_r(client_vec, k)
+                paths, edges = h_r(client_vec_uri, k)
             except Exception as e:
                 print(f"[request_handler] Error in h_r: {e}")
                 raise
 
-            edges_vectors = [model.encode_path(edge) for edge in edges]
+            edges_vectors = model.encode_paths(edges)
 
-            paths_vectors_encrypted = [[encrypt_map_client[x.uri] for x in path] for path in paths]
-            path_length_encrypted = [ts.ckks_vector(context, [1/len(path)]) for path in paths]
-            edges_vectors_encrypted = [model.encrypt_path(context, edge_vec) for edge_vec in edges_vectors]
+            # each path's length is folded into its vector (see encryption.path_with_length)
+            edges_vectors_encrypted = [model.encrypt_path(context, edge_vec, length=len(path))
+                                       for edge_vec, path in zip(edges_vectors, paths)]
 
             uris = [path[1].uri for path in paths]
 
-            paths_serialized = [path[1].serialize() for path in paths_vectors_encrypted]
+            # only the vertex after the start of each path is sent
+            paths_serialized = [encrypted_vertex(path[1].uri).serialize() for path in paths]
             edges_serialized = [edge.serialize() for edge in edges_vectors_encrypted]
-            path_length_serialized = [length.serialize() for length in path_length_encrypted]
 
-            paths_uris_edges_map_serialized = pickle.dumps({"URIs": uris, "Vectors": paths_serialized, "Edges": edges_serialized, "Length": path_length_serialized})
+            paths_uris_edges_map_serialized = pickle.dumps({"URIs": uris, "Vectors": paths_serialized, "Edges": edges_serialized})
             client_top_k_paths_bytes = struct.pack("!I", len(paths_uris_edges_map_serialized)) + paths_uris_edges_map_serialized
-            if "Top-K Paths" in bytes_sent_dict:    
-                bytes_sent_dict["Top-K Paths"].append(len(client_top_k_paths_bytes))
-            else:
-                bytes_sent_dict["Top-K Paths"] = [len(client_top_k_paths_bytes)]
+            metrics.sent("Top-K Paths", len(client_top_k_paths_bytes))
 
             conn.sendall(client_top_k_paths_bytes)
         elif msg_type == 3: #Path Similarity
-            path_similarity_start_time = time.time()
+            path_similarity_start_time = time.perf_counter_ns()
             encrypted_vector_bytes = pickle.loads(msg)
             decrypted_values = decrypt_vector(encrypted_vector_bytes)
             
@@ -139,68 +123,30 @@ def request_handler(conn):
                 response = abs(decrypted_values) * mask
             response_bytes = struct.pack('d', response)
 
-            if "Path Similarity" in bytes_sent_dict:
-                bytes_sent_dict["Path Similarity"].append(len(response_bytes))
-            else:
-                bytes_sent_dict["Path Similarity"] = [len(response_bytes)]
+            metrics.sent("Path Similarity", len(response_bytes))
 
             conn.sendall(response_bytes)
-            path_similarity_end_time = time.time()
-            path_similarity_total_time = path_similarity_end_time - path_similarity_start_time
-
-            if "Path Similarity" in times_dict:
-                times_dict["Path Similarity"].append(path_similarity_total_time)
-            else:
-                times_dict["Path Similarity"] = [path_similarity_total_time]
+            metrics.add_time("Path Similarity", time.perf_counter_ns() - path_similarity_start_time)
 
         elif msg_type == 4:
             uri = msg.decode()
-            sub_graph = user_profile.extract_lineage_set(user_profile.lookup(uri))
+            sub_graph = user_profile.extract_lineage(merge_index.lookup(uri), merge_index.out_edges())
             sub_graph_bytes = pickle.dumps(sub_graph)
             response_bytes = struct.pack("!I", len(sub_graph_bytes)) + sub_graph_bytes
 
-            if "Sub Graph" in bytes_sent_dict:
-                bytes_sent_dict["Sub Graph"].append(len(response_bytes))
-            else:
-                bytes_sent_dict["Sub Graph"] = [len(response_bytes)]
+            metrics.sent("Sub Graph", len(response_bytes))
 
             conn.sendall(response_bytes)
         elif msg_type == 5: #Enrichment
-            enrichment_start_time = time.time()
+            enrichment_start_time = time.perf_counter_ns()
             server_sub_graph_uri_map = pickle.loads(msg)
             uri = server_sub_graph_uri_map['URI']
             server_sub_graph = server_sub_graph_uri_map['Subgraph']
-            client_sub_graph = user_profile.extract_lineage_set(user_profile.lookup(uri))
+            client_sub_graph = user_profile.extract_lineage_set(merge_index.lookup(uri), merge_index.out_edges())
 
             merged_graph = merge_graphs(server_sub_graph, client_sub_graph)
-            append_subgraph_at_uri(user_profile, merged_graph, uri)
-            enrichment_end_time = time.time()
-            enrichment_total_time = enrichment_end_time - enrichment_start_time
-
-            if "Enrichment" in times_dict:
-                times_dict["Enrichment"].append(enrichment_total_time)
-            else:
-                times_dict["Enrichment"] = [enrichment_total_time]
-
-def start_decryption_server():
-    DECRYPTION_HOST = "0.0.0.0"
-    PORT = 65432
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((DECRYPTION_HOST, PORT + 10))
-    server_socket.listen(1)
-
-    conn, addr = server_socket.accept()
-    # logger.info(f"Connected to server: {addr}")
-
-    try:
-        request_handler(conn)
-    except Exception as e:
-        logger.error(f"Error in request_handler: {e}")
-    finally:
-        conn.close()
-        logger.info("Decryption server connection closed.")
-        server_socket.close()
-        logger.info("Decryption server socket closed.")
+            append_subgraph_at_uri(user_profile, merged_graph, uri, merge_index)
+            metrics.add_time("Enrichment", time.perf_counter_ns() - enrichment_start_time)
 
 def get_vertex_object(v_uri: str) -> Optional[Vertex]:
     for v in vertices:
@@ -216,12 +162,24 @@ def r_p(path: List[Vertex]) -> float:
 
     return product
 
-def h_r(vec1: CKKSVector, k: int) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
-    start = time.time()
+def encrypted_vertex(uri: str) -> CKKSVector:
+    """
+    The vertex's own ciphertext for Top-K Paths replies. The upload is
+    packed, so only vertices that appear in a reply are encrypted on their
+    own, on first use.
+    """
+    vec = encrypt_map_client.get(uri)
+    if vec is None:
+        with metrics.timer("Encryption"):
+            embedding = embedding_map[uri]
+            vec = encrypt_map_client[uri] = ts.ckks_vector(context, embedding / np.linalg.norm(embedding))
+    return vec
+
+def h_r(vec1_uri: str, k: int) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
+    start = time.perf_counter_ns()
     P = []
     scores = []
     edges = []
-    vec1_uri = list(encrypt_map_client.keys())[list(encrypt_map_client.values()).index(vec1)]
     list_edges = user_profile.get_edges(get_vertex_object(vec1_uri))
     
     for edge in list_edges:
@@ -253,62 +211,50 @@ def h_r(vec1: CKKSVector, k: int) -> Tuple[List[List[Vertex]], List[List[Edge]]]
 
     sorted_paths = [k for _, k in sorted(zip(scores, P), reverse=True, key=lambda pair: pair[0])]
     sorted_edges = [k for _, k in sorted(zip(scores, edges), reverse=True, key=lambda pair: pair[0])]
-    end = time.time()
-    total_time = end - start
-    if "Top-K Paths" in times_dict:
-        times_dict["Top-K Paths"].append(total_time)
-    else:
-        times_dict["Top-K Paths"] = [total_time]
+    metrics.add_time("Top-K Paths", time.perf_counter_ns() - start)
 
     return sorted_paths[:k], sorted_edges[:k]
 
 def start_client_communication_and_processing(server_ip, port=65432, dataset_path=None, java_context=None):
-    global user_profile, times_dict, bytes_sent_dict, bytes_rec_list, model, predictor, encryption_helper, vertices, embedding_map, encrypt_map_client, epsilon, context, mask
-    user_profile = get_graph(dataset_path, "g2")  # Use g1 as client graph prefix
+    global user_profile, metrics, model, predictor, encryption_helper, vertices, embedding_map, encrypt_map_client, epsilon, context, mask, merge_index
+    user_profile = get_graph(dataset_path, "g2", use_snapshot=True)  # Use g1 as client graph prefix
+    merge_index = MergeIndex(user_profile)
     original_vertex_uris = set(v.uri for v in user_profile.vertices)
 
-    times_dict = {}
-    bytes_sent_dict = {}
-    bytes_rec_list = []
+    metrics = Metrics()
 
-    start = time.time()
+    with metrics.timer("Initialize Sentence Transformer"):
+        model = resources.embedding_helper(java_context)
 
-    model = EmbeddingHelper(java_context)
-    end = time.time()
-    times_dict["Initialize Sentence Transformer"] = end-start
+    with metrics.timer("Initialize LLM"):
+        predictor = resources.predictor(java_context)
 
-    start = time.time()
-    # predictor = LLMPredictor(context)
-    predictor = MockLLMPredictor(java_context)
-    end = time.time()
-    times_dict["Initialize LLM"] = end - start
-
-    encryption_helper = Encryption()
+    # a fresh key pair per session (see ResourceManager.encryption)
+    with metrics.timer("Key Generation"):
+        encryption_helper = resources.encryption()
     context = encryption_helper.get_context()
     vertices = user_profile.vertices
 
-    start = time.time()
-    embedding_map = model.encode_embedding(vertices)
-    end = time.time()
-    times_dict["Compute Embeddings"] = end - start
+    with metrics.timer("Compute Embeddings"):
+        embedding_map = model.encode_embedding(vertices)
 
-    start = time.time()
-    encrypt_map_client = model.encrypt_embeddings(context, normalize = True)
-    end = time.time()
-    times_dict["Encryption"] = end - start
+    # per-vertex ciphertexts, for Top-K Paths replies only (see encrypted_vertex)
+    encrypt_map_client = {}
+    with metrics.timer("Encryption"):
+        # the upload packs several vertices per ciphertext
+        packed_vectors, packed_offsets = model.encrypt_embeddings_packed(context, encryption_helper.parameters.slots)
 
     serialized_map = {}
     global epsilon, mask
     epsilon = 0.01
     mask = get_random_mask(1, 2, False)
 
-    serialized_encrypt_map_client = {}
-    for uri, vec in encrypt_map_client.items():
-        serialized_encrypt_map_client[uri] = vec.serialize()
-
     serialized_context = encryption_helper.serialize_context()
     serialized_map['Context'] = serialized_context
-    serialized_map['Vertices'] = serialized_encrypt_map_client
+    serialized_map['Packed'] = {
+        "Vectors": [vec.serialize() for vec in packed_vectors],
+        "Offsets": packed_offsets,
+    }
 
     data = pickle.dumps(serialized_map)
 
@@ -316,41 +262,24 @@ def start_client_communication_and_processing(server_ip, port=65432, dataset_pat
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((server_ip, port))
 
-            bytes_sent_dict["Context and Vertices"] = len(data)
-
             # logger.info(f"Sending context and vertex embeddings, total bytes: {len(data)}")
             try:
-                s.sendall(data) 
-                # logger.info(f"client: s.sendall() completed.")
+                metrics.sent("Context and Vertices", send_message(s, MSG_UPLOAD, data))
+                # logger.info(f"client: upload completed.")
             except Exception as e:
                 logger.info(f"client: ERROR DURING SENDALL: {e}")
-            s.shutdown(socket.SHUT_WR)
 
+            # the server's requests come back on this connection until MSG_END
             try:
-                start_decryption_server()
-            except Exception as e:
-                logger.error(f"Error in decryption server: {e}")
-                # even if there is an error, continue and ensure return result
-                pass
-
-            try:
-                s.settimeout(500)
-                data_recv = s.recv(4)
-                if data_recv:
-                    bytes_rec_list.append(4)
-                    msg_type = struct.unpack("!I", data_recv)[0]
-            except socket.error as e:
-                logger.error(f"Socket error while receiving response: {e}")
-                # even if there is an error, continue and ensure return result
-                pass
+                request_handler(s)
             except Exception as e:
-                logger.error(f"Unexpected error while receiving response: {e}")
+                logger.error(f"Error in request_handler: {e}")
                 # even if there is an error, continue and ensure return result
                 pass
 
-            print(f"Total Time: {sum_values(times_dict)}")
-            print(f"Total Bytes Sent: {sum_values(bytes_sent_dict)}")
-            print(f"Total Bytes Received: {sum(bytes_rec_list)}")
+            print(f"Total Time: {metrics.time_s()}")
+            print(f"Total Bytes Sent: {metrics.bytes_sent()}")
+            print(f"Total Bytes Received: {metrics.bytes_received()}")
     except Exception as e:
         logger.error(f"Error in client communication: {e}")
         # even if there is an error, continue and ensure return result
@@ -361,7 +290,7 @@ def start_client_communication_and_processing(server_ip, port=65432, dataset_pat
 
 
 def main(dataset_path, context, server_ip, port=65432):
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     enriched_node_count = start_client_communication_and_processing(
         server_ip=server_ip, port=port, dataset_path=dataset_path, java_context=context
@@ -370,15 +299,17 @@ def main(dataset_path, context, server_ip, port=65432):
     # remove duplicate vertices before saving
     remove_duplicate_vertices_by_label_and_edge_label(user_profile)
     
-    end_time = time.time()
+    end_time = time.perf_counter()
     import os
-    output_file = os.path.join(context.getFilesDir().getAbsolutePath(), "graph.json")
+    output_file = os.path.join(get_files_dir(context), "graph.json")
     user_profile.save_cytoscape_json(output_file)
+    user_profile.save_snapshot(os.path.splitext(output_file)[0] + ".pkgs")
+    metrics.save_trace(get_files_dir(context), "client")
     total_time = end_time - start_time
-    total_bytes_received = sum(bytes_rec_list)
     return {
         "total_time": total_time,
-        "total_bytes_received": total_bytes_received,
+        "total_bytes_received": metrics.bytes_received(),
         "enriched_node_count": enriched_node_count,
         "graph_path": output_file,
+        "metrics": metrics.summary(),
     }
\ No newline at end of file
@@ -3,25 +3,25 @@ import struct
 import time
 import logging
 
-from encryption import Encryption
 import numpy as np
 
 import json
 
 from graph import Vertex, Graph, Entity, Edge
 import pickle
-from embedding_helper import EmbeddingHelper
 from typing import List, Tuple, Optional
 
 # from graph_example_client import get_graph
-from mock_predictor import MockLLMPredictor
-# from predictor import LLMPredictor
-from util import get_random_mask, merge_graphs, append_subgraph_at_uri, sum_values, remove_duplicate_vertices_by_label_and_edge_label, get_graph
+from metrics import Metrics
+from resources import resources
+from util import get_random_mask, merge_graphs, append_subgraph_at_uri, remove_duplicate_vertices_by_label_and_edge_label, get_graph, MergeIndex, receive_exactly, send_message, MSG_UPLOAD, MSG_NAMES, get_files_dir
 
 # configure logging
 logging.basicConfig(level=logging.DEBUG, format='[%(levelname)s] %(asctime)s %(message)s')
 logger = logging.getLogger("Client")
 
+metrics = Metrics()
+
 # def decrypt_vector(encrypted_vector_bytes):
 #     """Decrypts an encrypted CKKS vector."""
 #     encrypted_vector = ts.ckks_vector_from(context, encrypted_vector_bytes)
@@ -36,29 +36,25 @@ def find_key_by_value(dictionary, target_array):
 
 def receive_full_message(conn):
     """Receives a message with a fixed-length header."""
-    msg_len_data = conn.recv(4)  # Get the first 4 bytes (message length)
-    if not msg_len_data:
+    msg_len_data = receive_exactly(conn, 4)  # Get the first 4 bytes (message length)
+    if msg_len_data is None:
         logger.warning("No message length data received.")
         return (None, None)
     msg_len = struct.unpack("!I", msg_len_data)[0]  # Unpack message length
 
-    msg_type_data = conn.recv(4)
-    if not msg_type_data:
+    msg_type_data = receive_exactly(conn, 4)
+    if msg_type_data is None:
         logger.warning("No message type data received.")
         return (None, None)
     msg_type = struct.unpack("!I", msg_type_data)[0]
 
     # Receive the full message
-    msg = b""
-    while len(msg) < msg_len:
-        msg_packet = conn.recv(msg_len - len(msg))
-        if not msg_packet:
-            logger.warning("Message packet incomplete.")
-            return (None, None)
-        msg += msg_packet
+    msg = receive_exactly(conn, msg_len)
+    if msg is None:
+        logger.warning("Message packet incomplete.")
+        return (None, None)
 
-    total_bytes_rec = 8 + msg_len
-    bytes_rec_list.append(total_bytes_rec)
+    metrics.received(MSG_NAMES.get(msg_type, str(msg_type)), 8 + msg_len)
 
     # logger.debug(f"Received message of type {msg_type} and length {msg_len}")
     return msg_type, msg
@@ -67,7 +63,7 @@ def request_handler(conn):
     while True:
         msg_type, msg = receive_full_message(conn)
         if not msg:
-            break  # Connection closed
+            break  # MSG_END or connection closed
         elif msg_type == 2:
             try:
                 encrypted_vector_map = pickle.loads(msg)
@@ -92,7 +88,7 @@ def request_handler(conn):
 
             paths_vectors_embeddings = [[embedding_map[x.uri] for x in path] for path in paths]
             path_lengths = [len(path) for path in paths]
-            edges_vectors_embedding = [model.encode_path(edge) for edge in edges]
+            edges_vectors_embedding = list(model.encode_paths(edges))
 
             uris = [path[1].uri for path in paths]
 
@@ -102,61 +98,29 @@ def request_handler(conn):
 
             paths_uris_edges_map_serialized = pickle.dumps({"URIs": uris, "Vectors": paths_serialized, "Edges": edges_vectors_embedding, "Length": path_lengths})
             client_top_k_paths_bytes = struct.pack("!I", len(paths_uris_edges_map_serialized)) + paths_uris_edges_map_serialized
-            if "Top-K Paths" in bytes_sent_dict:    
-                bytes_sent_dict["Top-K Paths"].append(len(client_top_k_paths_bytes))
-            else:
-                bytes_sent_dict["Top-K Paths"] = [len(client_top_k_paths_bytes)]
+            metrics.sent("Top-K Paths", len(client_top_k_paths_bytes))
 
             conn.sendall(client_top_k_paths_bytes)
 
         elif msg_type == 4:
             uri = msg.decode()
-            sub_graph = user_profile.extract_lineage_set(user_profile.lookup(uri))
+            sub_graph = user_profile.extract_lineage(merge_index.lookup(uri), merge_index.out_edges())
             sub_graph_bytes = pickle.dumps(sub_graph)
             response_bytes = struct.pack("!I", len(sub_graph_bytes)) + sub_graph_bytes
 
-            if "Sub Graph" in bytes_sent_dict:
-                bytes_sent_dict["Sub Graph"].append(len(response_bytes))
-            else:
-                bytes_sent_dict["Sub Graph"] = [len(response_bytes)]
+            metrics.sent("Sub Graph", len(response_bytes))
 
             conn.sendall(response_bytes)
         elif msg_type == 5: #Enrichment
-            enrichment_start_time = time.time()
+            enrichment_start_time = time.perf_counter_ns()
             server_sub_graph_uri_map = pickle.loads(msg)
             uri = server_sub_graph_uri_map['URI']
             server_sub_graph = server_sub_graph_uri_map['Subgraph']
-            client_sub_graph = user_profile.extract_lineage_set(user_profile.lookup(uri))
+            client_sub_graph = user_profile.extract_lineage_set(merge_index.lookup(uri), merge_index.out_edges())
 
             merged_graph = merge_graphs(server_sub_graph, client_sub_graph)
-            append_subgraph_at_uri(user_profile, merged_graph, uri)
-            enrichment_end_time = time.time()
-            enrichment_total_time = enrichment_end_time - enrichment_start_time
-
-            if "Enrichment" in times_dict:
-                times_dict["Enrichment"].append(enrichment_total_time)
-            else:
-                times_dict["Enrichment"] = [enrichment_total_time]
-
-def start_decryption_server():
-    DECRYPTION_HOST = "0.0.0.0"
-    PORT = 65432
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((DECRYPTION_HOST, PORT + 10))
-    server_socket.listen(1)
-
-    conn, addr = server_socket.accept()
-    # logger.info(f"Connected to server: {addr}")
-
-    try:
-        request_handler(conn)
-    except Exception as e:
-        logger.error(f"Error in request_handler: {e}")
-    finally:
-        conn.close()
-        logger.info("Decryption server connection closed.")
-        server_socket.close()
-        logger.info("Decryption server socket closed.")
+            append_subgraph_at_uri(user_profile, merged_graph, uri, merge_index)
+            metrics.add_time("Enrichment", time.perf_counter_ns() - enrichment_start_time)
 
 def get_vertex_object(v_uri: str) -> Optional[Vertex]:
     for v in vertices:
@@ -173,7 +137,7 @@ def r_p(path: List[Vertex]) -> float:
     return product
 
 def h_r(vec1: np.ndarray, k: int) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
-    start = time.time()
+    start = time.perf_counter_ns()
     P = []
     scores = []
     edges = []
@@ -209,44 +173,31 @@ def h_r(vec1: np.ndarray, k: int) -> Tuple[List[List[Vertex]], List[List[Edge]]]
 
     sorted_paths = [k for _, k in sorted(zip(scores, P), reverse=True, key=lambda pair: pair[0])]
     sorted_edges = [k for _, k in sorted(zip(scores, edges), reverse=True, key=lambda pair: pair[0])]
-    end = time.time()
-    total_time = end - start
-    if "Top-K Paths" in times_dict:
-        times_dict["Top-K Paths"].append(total_time)
-    else:
-        times_dict["Top-K Paths"] = [total_time]
+    metrics.add_time("Top-K Paths", time.perf_counter_ns() - start)
 
     return sorted_paths[:k], sorted_edges[:k]
 
 
-def start_client_communication_and_processing(server_ip, port=65432, dataset_path=None, java_context=None):
-    global user_profile, times_dict, bytes_sent_dict, bytes_rec_list, model, predictor, encryption_helper, vertices, embedding_map, encrypt_map_client, epsilon, mask
-    user_profile = get_graph(dataset_path, "g2")
+def start_client_communication_and_processing(server_ip, port=65432, dataset_path=None, java_context=None,
+                                              embedding_dtype="float32"):
+    global user_profile, metrics, model, predictor, vertices, embedding_map, encrypt_map_client, epsilon, mask, merge_index
+    user_profile = get_graph(dataset_path, "g2", use_snapshot=True)
+    merge_index = MergeIndex(user_profile)
     original_vertex_uris = set(v.uri for v in user_profile.vertices)
 
-    times_dict = {}
-    bytes_sent_dict = {}
-    bytes_rec_list = []
-
-    start = time.time()
+    metrics = Metrics()
 
-    model = EmbeddingHelper(java_context)
-    end = time.time()
-    times_dict["Initialize Sentence Transformer"] = end-start
+    # the uploaded vertex embeddings are sent in this storage type
+    with metrics.timer("Initialize Sentence Transformer"):
+        model = resources.embedding_helper(java_context, embedding_dtype)
 
-    start = time.time()
-    # predictor = LLMPredictor(context)
-    predictor = MockLLMPredictor(java_context)
-    end = time.time()
-    times_dict["Initialize LLM"] = end - start
+    with metrics.timer("Initialize LLM"):
+        predictor = resources.predictor(java_context)
 
-    encryption_helper = Encryption()
     vertices = user_profile.vertices
 
-    start = time.time()
-    embedding_map = model.encode_embedding(vertices)
-    end = time.time()
-    times_dict["Compute Embeddings"] = end - start
+    with metrics.timer("Compute Embeddings"):
+        embedding_map = model.encode_embedding(vertices)
 
     # start = time.time()
     # encrypt_map_client = model.encrypt_embeddings(context, normalize = True)
@@ -266,41 +217,24 @@ def start_client_communication_and_processing(server_ip, port=65432, dataset_pat
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((server_ip, port))
 
-            bytes_sent_dict["Context and Vertices"] = len(data)
-
             # logger.info(f"Sending context and vertex embeddings, total bytes: {len(data)}")
             try:
-                s.sendall(data) 
-                # logger.info(f"client: s.sendall() completed.")
+                metrics.sent("Context and Vertices", send_message(s, MSG_UPLOAD, data))
+                # logger.info(f"client: upload completed.")
             except Exception as e:
                 logger.info(f"client: ERROR DURING SENDALL: {e}")
-            s.shutdown(socket.SHUT_WR)
-
-            try:
-                start_decryption_server()
-            except Exception as e:
-                logger.error(f"Error in decryption server: {e}")
-                # continue even if there is an error, ensure return result
-                pass
 
+            # the server's requests come back on this connection until MSG_END
             try:
-                s.settimeout(500)
-                data_recv = s.recv(4)
-                if data_recv:
-                    bytes_rec_list.append(4)
-                    msg_type = struct.unpack("!I", data_recv)[0]
-            except socket.error as e:
-                logger.error(f"Socket error while receiving response: {e}")
-                # continue even if there is an error, ensure return result
-                pass
+                request_handler(s)
             except Exception as e:
-                logger.error(f"Unexpected error while receiving response: {e}")
+                logger.error(f"Error in request_handler: {e}")
                 # continue even if there is an error, ensure return result
                 pass
 
-            print(f"Total Time: {sum_values(times_dict)}")
-            print(f"Total Bytes Sent: {sum_values(bytes_sent_dict)}")
-            print(f"Total Bytes Received: {sum(bytes_rec_list)}")
+            print(f"Total Time: {metrics.time_s()}")
+            print(f"Total Bytes Sent: {metrics.bytes_sent()}")
+            print(f"Total Bytes Received: {metrics.bytes_received()}")
     except Exception as e:
         logger.error(f"Error in client communication: {e}")
         # continue even if there is an error, ensure return result
@@ -310,25 +244,28 @@ def start_client_communication_and_processing(server_ip, port=65432, dataset_pat
     return enriched_node_count
 
 
-def main(dataset_path, context, server_ip, port=65432):
-    start_time = time.time()
+def main(dataset_path, context, server_ip, port=65432, embedding_dtype="float32"):
+    start_time = time.perf_counter()
 
     enriched_node_count = start_client_communication_and_processing(
-        server_ip=server_ip, port=port, dataset_path=dataset_path, java_context=context
+        server_ip=server_ip, port=port, dataset_path=dataset_path, java_context=context,
+        embedding_dtype=embedding_dtype
     )
     
     # remove duplicate vertices before saving
     remove_duplicate_vertices_by_label_and_edge_label(user_profile)
     
-    end_time = time.time()
+    end_time = time.perf_counter()
     import os
-    output_file = os.path.join(context.getFilesDir().getAbsolutePath(), "graph.json")
+    output_file = os.path.join(get_files_dir(context), "graph.json")
     user_profile.save_cytoscape_json(output_file)
+    user_profile.save_snapshot(os.path.splitext(output_file)[0] + ".pkgs")
+    metrics.save_trace(get_files_dir(context), "client")
     total_time = end_time - start_time
-    total_bytes_received = sum(bytes_rec_list)
     return {
         "total_time": total_time,
-        "total_bytes_received": total_bytes_received,
+        "total_bytes_received": metrics.bytes_received(),
         "enriched_node_count": enriched_node_count,
         "graph_path": output_file,
+        "metrics": metrics.summary(),
     }
\ No newline at end of file
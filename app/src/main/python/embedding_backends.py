@@ -0,0 +1,251 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Embedding backends for EmbeddingHelper. On-device the helper uses
+# EmbeddingBridge (the Java TextEmbedder); on a host it uses one of the
+# backends below, usually behind BatchingBackend. All of them return
+# L2-normalized float32 embeddings, like TextEmbedder.
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+MAX_SEQUENCE_LENGTH = 128
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "assets", "models", MODEL_NAME)
+
+
+class EmbeddingBackend:
+    """
+    Interface of an embedding backend. Subclasses implement
+    encode_batch_matrix; the other methods are built on it. thread_safe
+    backends may be called from several threads at once.
+    """
+    thread_safe = False
+
+    def encode_batch_matrix(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into a (len(texts), dim) float32 matrix."""
+        raise NotImplementedError
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_batch_matrix([text])[0]
+
+    def encode_batch(self, texts: List[str]) -> List[np.ndarray]:
+        return list(self.encode_batch_matrix(texts))
+
+    def close(self):
+        pass
+
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    The same model, tokenizer and pooling as TextEmbedder (mean pooling over
+    the attention mask, then L2 normalization), run with ONNX Runtime.
+    Needs the onnxruntime and tokenizers packages.
+    """
+
+    def __init__(self, model_dir: str = MODEL_DIR, batch_size: int = 64, threads: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_SEQUENCE_LENGTH)
+        self.tokenizer.enable_padding(length=None)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+    def _encode_chunk(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {"input_ids": ids}
+        if "attention_mask" in self.input_names:
+            inputs["attention_mask"] = mask
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(ids)
+        output = self.session.run(None, inputs)[0]
+        if output.ndim == 3:
+            # [batch, seq, hidden] -> mean over real tokens
+            weights = mask[:, :, None].astype(np.float32)
+            output = (output * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return _l2_normalize(output)
+
+    def encode_batch_matrix(self, texts: List[str]) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        chunks = [self._encode_chunk(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(chunks)
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """
+    sentence-transformers implementation, e.g. for GPU hosts. Needs the
+    sentence_transformers package; the model is downloaded on first use.
+    """
+
+    def __init__(self, model_name: str = f"sentence-transformers/{MODEL_NAME}", device: Optional[str] = None,
+                 batch_size: int = 64):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+        self.model.max_seq_length = MAX_SEQUENCE_LENGTH
+        self.batch_size = batch_size
+
+    def encode_batch_matrix(self, texts: List[str]) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                       normalize_embeddings=True, show_progress_bar=False)
+        return embeddings.astype(np.float32, copy=False)
+
+
+class StandInBackend(EmbeddingBackend):
+    """embedding_bridge.StandInTextEmbedder as a backend (no model needed)."""
+
+    def __init__(self, dim: int = 384):
+        from embedding_bridge import EmbeddingBridge, StandInTextEmbedder
+
+        self.bridge = EmbeddingBridge(None, StandInTextEmbedder(dim))
+
+    def encode_batch_matrix(self, texts: List[str]) -> np.ndarray:
+        return np.array(self.bridge.encode_batch_matrix(texts))
+
+
+class BatchingBackend(EmbeddingBackend):
+    """
+    Dynamic micro-batching in front of another backend.
+
+    Requests from any thread (single texts from encode_path, whole batches
+    from encode_embedding) are queued and embedded together. A flush
+    happens as soon as no other request is queued or being queued, so a
+    lone caller never waits; while more are on their way it takes them
+    until max_batch_size texts are pending or max_wait seconds after the
+    first request. Identical
+    texts in a flush are embedded once.
+    """
+    thread_safe = True
+
+    def __init__(self, backend: EmbeddingBackend, max_batch_size: int = 64, max_wait: float = 0.005):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.flushes = 0
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # a forked child (fragment workers, see server_unencrypted) inherits
+            # the queue with the parent's worker registered as its waiter, so
+            # it would never wake its own worker; give it fresh state instead
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset())
+
+    def _reset(self):
+        self._queue: "queue.Queue[Optional[Tuple[List[str], Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        # requests announced by encode_batch_matrix and not yet taken by the worker
+        self._arriving = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def encode_batch_matrix(self, texts: List[str]) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        future = Future()
+        self._ensure_worker()
+        with self._lock:
+            self._arriving += 1
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def _take(self, request):
+        if request is not None:
+            with self._lock:
+                self._arriving -= 1
+        return request
+
+    def _run(self):
+        while True:
+            request = self._take(self._queue.get())
+            if request is None:
+                return
+            pending = [request]
+            count = len(request[0])
+            wait_until = time.monotonic() + self.max_wait
+            stop = False
+            # no other caller on its way: flush right away
+            while count < self.max_batch_size and self._arriving > 0:
+                remaining = wait_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._take(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                pending.append(request)
+                count += len(request[0])
+            self._flush(pending)
+            if stop:
+                return
+
+    def _flush(self, pending: List[Tuple[List[str], Future]]):
+        self.flushes += 1
+        unique: Dict[str, int] = {}
+        for texts, _ in pending:
+            for text in texts:
+                unique.setdefault(text, len(unique))
+        try:
+            matrix = self.backend.encode_batch_matrix(list(unique))
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for texts, future in pending:
+            future.set_result(matrix[[unique[text] for text in texts]])
+
+    def close(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                self._queue.put(None)
+                self._worker.join()
+            self._worker = None
+        self.backend.close()
+
+
+def create_host_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Backend for running off-device, chosen by name or by the
+    PKGEM_EMBEDDING_BACKEND environment variable: "onnx" (default),
+    "sentence-transformers" or "standin". It is wrapped in BatchingBackend.
+    """
+    name = name or os.environ.get("PKGEM_EMBEDDING_BACKEND", "onnx")
+    if name == "onnx":
+        backend = OnnxBackend(os.environ.get("PKGEM_MODEL_DIR", MODEL_DIR))
+    elif name == "sentence-transformers":
+        backend = SentenceTransformerBackend()
+    elif name == "standin":
+        backend = StandInBackend()
+    else:
+        raise ValueError(f"Unknown embedding backend '{name}'")
+    return BatchingBackend(backend)
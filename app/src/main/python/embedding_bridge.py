@@ -1,12 +1,70 @@
-from com.example.pkgenrich.utils import TextEmbedder
+import math
+import zlib
+from array import array
 from typing import List
+
 import numpy as np
-from java.util import ArrayList
+
+try:
+    from com.example.pkgenrich.utils import TextEmbedder
+    from java import jarray, jclass
+except ImportError:
+    # off-device (benchmarks): pass an embedder such as StandInTextEmbedder
+    TextEmbedder = None
+
+
+class StandInTextEmbedder:
+    """
+    Pure-Python stand-in for the Java TextEmbedder with the same methods,
+    used to run and benchmark EmbeddingBridge off-device. Embeddings are
+    L2-normalized hashed character-trigram counts, so labels that share
+    words get similar vectors. Vectors come back as array('f'), which like
+    a Java float[] exposes the buffer protocol.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        # like TextEmbedder, every label is embedded once
+        self.embedding_cache = {}
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        text = f"  {str(text).lower()}  "
+        for j in range(len(text) - 2):
+            h = zlib.crc32(text[j:j + 3].encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else vector
+
+    def encode(self, text: str) -> array:
+        if text not in self.embedding_cache:
+            self.embedding_cache[text] = array("f", self.embed(text))
+        return self.embedding_cache[text]
+
+    def encodeBatch(self, labels) -> List[array]:
+        return [self.encode(label) for label in labels]
+
+    def encodeBatchFlat(self, labels) -> array:
+        flat = array("f")
+        for label in labels:
+            flat.extend(self.encode(label))
+        return flat
+
 
 class EmbeddingBridge:
-    def __init__(self, context):
-        self.embedder = TextEmbedder.getInstance(context)
-    
+    def __init__(self, context, embedder=None):
+        """
+        Args:
+            context: Android context used to get the TextEmbedder instance
+            embedder: Object with TextEmbedder's methods to use instead
+                (e.g. StandInTextEmbedder off-device)
+        """
+        if embedder is None:
+            if TextEmbedder is None:
+                raise RuntimeError("TextEmbedder is only available on-device; pass an embedder")
+            embedder = TextEmbedder.getInstance(context)
+        self.embedder = embedder
+
     def encode(self, text: str) -> np.ndarray:
         """
         Encode a single text using TextEmbedder
@@ -15,13 +73,34 @@ class EmbeddingBridge:
         if embedding is None:
             raise ValueError(f"Failed to encode text: {text}")
         return np.array(embedding)
-    
+
+    def _to_java_labels(self, texts: List[str]):
+        # one String[] conversion instead of an ArrayList.add() call per label
+        if TextEmbedder is not None and not isinstance(self.embedder, StandInTextEmbedder):
+            return jarray(jclass("java.lang.String"))(texts)
+        return list(texts)
+
+    def encode_batch_matrix(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode a batch of texts into a (len(texts), dim) float32 matrix.
+
+        TextEmbedder.encodeBatchFlat returns the whole batch as one float[],
+        which is wrapped with np.frombuffer instead of being copied row by
+        row. encodeBatchFlat leaves the rows of texts it could not encode
+        zero; like encode, this raises ValueError for them rather than pass
+        on vectors that cannot be normalized.
+        """
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        flat = self.embedder.encodeBatchFlat(self._to_java_labels(texts))
+        matrix = np.frombuffer(flat, dtype=np.float32).reshape(len(texts), -1)
+        failed = np.flatnonzero(~matrix.any(axis=1))
+        if len(failed):
+            raise ValueError(f"Failed to encode {len(failed)} of {len(texts)} texts, e.g.: {texts[failed[0]]}")
+        return matrix
+
     def encode_batch(self, texts: List[str]) -> List[np.ndarray]:
         """
         Encode a batch of texts using TextEmbedder
         """
-        java_list = ArrayList()
-        for t in texts:
-            java_list.add(t)
-        result = self.embedder.encodeBatch(java_list)
-        return [np.array(result.get(i)) for i in range(result.size())] 
\ No newline at end of file
+        return list(self.encode_batch_matrix(texts))
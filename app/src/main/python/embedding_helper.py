@@ -1,71 +1,331 @@
-import tenseal as ts
+from __future__ import annotations
+
 import numpy as np
-from scipy.spatial.distance import cosine
-from typing import List, Dict
+from typing import TYPE_CHECKING, Iterator, List, Dict, Mapping, Optional, Sequence, Tuple
 import gc
+import threading
+from contextlib import nullcontext
 
 from graph import Entity
-from embedding_bridge import EmbeddingBridge
+
+# tenseal is only needed in security mode and is imported on first use, so
+# the plaintext path never loads it
+if TYPE_CHECKING:
+    import tenseal as ts
+    from tenseal import CKKSVector
+
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+class EmbeddingStore(Mapping):
+    """
+    Read-only URI -> embedding mapping backed by one contiguous matrix and a
+    URI -> row index, used as EmbeddingHelper.embed_map.
+
+    Rows are stored as float32, float16 or int8 (symmetric, one float32
+    scale per row) and are returned as float32 vectors, so the store can be
+    used wherever a Dict[str, np.ndarray] of embeddings was. float32 rows are
+    returned as views into the matrix; quantized rows are decoded on access.
+    """
+
+    def __init__(self, uris: Sequence[str], embeddings, dtype: str = "float32"):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {EMBEDDING_DTYPES}")
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(uris), -1) if len(uris) else matrix.reshape(0, 0)
+        self.dtype = dtype
+        self.index: Dict[str, int] = {}
+        for i, uri in enumerate(uris):
+            self.index.setdefault(uri, i)
+        self.uris = list(uris)
+        self.scales: Optional[np.ndarray] = None
+        if dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales[scales == 0] = 1
+            self.scales = scales.astype(np.float32)
+            self.matrix = np.ascontiguousarray(np.rint(matrix / self.scales[:, None]).astype(np.int8))
+        else:
+            self.matrix = np.ascontiguousarray(matrix.astype(dtype, copy=False))
+
+    def __getitem__(self, uri: str) -> np.ndarray:
+        return self.row(self.index[uri])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, uri) -> bool:
+        return uri in self.index
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def row(self, i: int) -> np.ndarray:
+        if self.dtype == "float32":
+            return self.matrix[i]
+        if self.dtype == "float16":
+            return self.matrix[i].astype(np.float32)
+        return self.matrix[i].astype(np.float32) * self.scales[i]
+
+    def rows(self, uris: Optional[Sequence[str]] = None) -> np.ndarray:
+        """float32 matrix of the given rows (all rows, in store order, if None)."""
+        if uris is None:
+            matrix, scales = self.matrix, self.scales
+        else:
+            idx = np.fromiter((self.index[uri] for uri in uris), dtype=np.intp, count=len(uris))
+            matrix = self.matrix[idx]
+            scales = self.scales[idx] if self.scales is not None else None
+        matrix = matrix.astype(np.float32)
+        if scales is not None:
+            matrix *= scales[:, None]
+        return matrix
+
+    def astype(self, dtype: str) -> "EmbeddingStore":
+        return EmbeddingStore(self.uris, self.rows(), dtype)
 
 
 class EmbeddingHelper:
-    def __init__(self, context=None):
+    def __init__(self, context=None, dtype: str = "float32", embedder=None, backend=None):
         """
         Initialize the EmbeddingHelper with context.
         Args:
             context: Android context object, must be passed from Kotlin/Java side
+            dtype: Storage type of the embedding map, "float32", or "float16"
+                / "int8" to quantize it (plaintext mode only)
+            embedder: TextEmbedder replacement for off-device use, see
+                embedding_bridge.StandInTextEmbedder (context is then optional)
+            backend: Embedding backend to use instead of the Java TextEmbedder,
+                e.g. embedding_backends.create_host_backend() off-device
         """
-        if context is None:
+        if context is None and embedder is None and backend is None:
             raise ValueError("Context must be provided from Android side")
-        self.embedding_bridge = EmbeddingBridge(context)
-        self.embed_map: Dict[str, np.ndarray] = {}
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {EMBEDDING_DTYPES}")
+        if backend is None:
+            from embedding_bridge import EmbeddingBridge
+
+            backend = EmbeddingBridge(context, embedder)
+        self.embedding_bridge = backend
+        # TextEmbedder (and its embedding cache) is not thread-safe, and
+        # Chaquopy releases the GIL during Java calls, so calls from
+        # concurrent sessions (server.serve) are serialized unless the
+        # backend handles concurrency itself (BatchingBackend)
+        self._encode_lock = nullcontext() if getattr(backend, "thread_safe", False) else threading.Lock()
+        self.dtype = dtype
+        self.embed_map: Mapping[str, np.ndarray] = EmbeddingStore([], [], dtype)
         self.encrypt_map: Dict[str, CKKSVector] = {}
+        # context encrypt_map was encrypted under
+        self.encrypt_context: Optional[ts.Context] = None
+        # path sentence -> embedding, see encode_paths
+        self.path_cache: Dict[str, np.ndarray] = {}
     
-    def encode_embedding(self, entities: List[Entity]) -> Dict[str, np.ndarray]:
+    def encode_embedding(self, entities: List[Entity]) -> EmbeddingStore:
         """
         Compute embeddings for each entity using TextEmbedder and store the results in a map,
         with the entity URI as the key.
         """
         labels = [e.get_label() for e in entities]
-        embeddings = self.embedding_bridge.encode_batch(labels)
-        embed_map: Dict[str, np.ndarray] = {}
-        for e, emb in zip(entities, embeddings):
-            embed_map[e.uri] = emb
+        embeddings = self._encode(labels)
+        embed_map = EmbeddingStore([e.uri for e in entities], embeddings, self.dtype)
         self.embed_map = embed_map  # save the embedding map for later use
+        self.encrypt_map = {}  # encryptions of the previous map are stale
+        self.path_cache = {}
         return embed_map
 
-    def encode_path(self, p1: List[Entity]):
-        try:
-            p1_sentence = ' '.join([e.label for e in p1])
-            return self.embedding_bridge.encode(p1_sentence)
-        finally:
-            # clean up the intermediate results
-            gc.collect()
+    def update_embeddings(self, entities: List[Entity]) -> EmbeddingStore:
+        """
+        Bring the embedding map in line with entities after the graph changed:
+        only entities without an embedding are encoded, and URIs that are no
+        longer present are dropped.
+        """
+        uris = [e.uri for e in entities]
+        kept = [uri for uri in dict.fromkeys(uris) if uri in self.embed_map]
+        for uri in set(self.embed_map) - set(kept):
+            self.encrypt_map.pop(uri, None)
+        missing = [e for e in entities if e.uri not in self.embed_map]
+        rows = [self.embed_map.rows(kept)] if kept else []
+        if missing:
+            rows.append(self._encode([e.get_label() for e in missing]))
+        if len(kept) != len(self.embed_map) or missing:
+            matrix = np.concatenate(rows) if rows else []
+            self.embed_map = EmbeddingStore(kept + [e.uri for e in missing], matrix, self.dtype)
+        return self.embed_map
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        with self._encode_lock:
+            return self.embedding_bridge.encode_batch_matrix(texts)
+
+    @staticmethod
+    def path_sentence(p1: List[Entity]) -> str:
+        return ' '.join([e.label for e in p1])
+
+    def encode_path(self, p1: List[Entity]) -> np.ndarray:
+        return self.encode_paths([p1])[0]
+
+    def encode_paths(self, paths: List[List[Entity]]) -> np.ndarray:
+        """
+        Embed the sentences of several paths into a (len(paths), dim) matrix.
+        Identical sentences are embedded once, and sentences embedded since
+        the last encode_embedding call are reused, so the paths of one vertex
+        (or of all vertices) cost a single encode_batch call. Rows a backend
+        returns as zero (failed) are not cached, so the next call tries them
+        again.
+        """
+        sentences = [self.path_sentence(p) for p in paths]
+        missing = [s for s in dict.fromkeys(sentences) if s not in self.path_cache]
+        embedded = {}
+        if missing:
+            embeddings = self._encode(missing)
+            for sentence, embedding in zip(missing, embeddings):
+                embedded[sentence] = embedding
+                if embedding.any():
+                    self.path_cache[sentence] = embedding
+        if not sentences:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([self.path_cache.get(s, embedded.get(s)) for s in sentences])
+
+    def encrypt_path(self, context: ts.Context, p1_embedding: np.ndarray, normalize: bool = True,
+                     length: Optional[int] = None) -> CKKSVector:
+        """
+        Encrypt a path embedding; with length, as encryption.path_with_length
+        of the (normalized) embedding, the form h_p expects from the client.
+        """
+        import tenseal as ts
 
-    def encrypt_path(self, context: ts.Context, p1_embedding: np.ndarray, normalize: bool = True) -> CKKSVector:
         if normalize:
             p1_embedding = p1_embedding / np.linalg.norm(p1_embedding)
+        if length is not None:
+            from encryption import path_with_length
+
+            p1_embedding = path_with_length(p1_embedding, length)
         return ts.ckks_vector(context, p1_embedding)
 
-    def encrypt_embeddings(self, context: ts.Context, normalize: bool = True) -> Dict[str, CKKSVector]:
+    def encrypt_embeddings(self, context: ts.Context, normalize: bool = True,
+                           embed_map: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, CKKSVector]:
+        """
+        Encrypt the stored embeddings under context, reusing earlier
+        encryptions under the same context (a new context, e.g. fresh keys
+        for a new session, starts over). If embed_map is given, encrypt that
+        map into a new dict instead, for callers that hold several contexts
+        at once (one per peer).
+        """
+        import tenseal as ts
+
+        if embed_map is None:
+            if context is not self.encrypt_context:
+                self.encrypt_map = {}
+                self.encrypt_context = context
+            encrypt_map = self.encrypt_map
+            embed_map = self.embed_map
+        else:
+            encrypt_map = {}
         try:
-            for (uri, embedding) in self.embed_map.items():
-                if uri not in self.encrypt_map:
+            for (uri, embedding) in embed_map.items():
+                if uri not in encrypt_map:
                     if normalize:
                         embedding = embedding / np.linalg.norm(embedding)
                     encryption = ts.ckks_vector(context, embedding)
-                    self.encrypt_map[uri] = encryption
-            return self.encrypt_map
+                    encrypt_map[uri] = encryption
+            return encrypt_map
         finally:
             # clean up the intermediate results
             gc.collect()
 
+    def encrypt_embeddings_packed(self, context: ts.Context,
+                                  slots: int) -> Tuple[List[CKKSVector], Dict[str, Tuple[int, int]]]:
+        """
+        Encrypt the stored embeddings, normalized, with as many embeddings
+        per ciphertext as fit in slots (see encryption.pack_offsets).
+
+        Returns:
+            (ciphertexts, URI -> (ciphertext index, first slot))
+        """
+        import tenseal as ts
+        from encryption import pack_offsets
+
+        uris, matrix = self.embedding_matrix()
+        if not uris:
+            return [], {}
+        per_vector = max(1, slots // matrix.shape[1])
+        try:
+            vectors = [ts.ckks_vector(context, matrix[start:start + per_vector].ravel().tolist())
+                       for start in range(0, len(uris), per_vector)]
+            return vectors, dict(zip(uris, pack_offsets(len(uris), matrix.shape[1], slots)))
+        finally:
+            gc.collect()
+
     def _cosine_similarity_pltxt(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
         Compute the cosine similarity between two plaintext embeddings.
         """
-        similarity = 1.0 - cosine(embedding1, embedding2)
-        return similarity
+        similarity = np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2))
+        return float(similarity)
+
+    @staticmethod
+    def normalized_matrix(embeddings: List[np.ndarray]) -> np.ndarray:
+        """
+        Stack embeddings into a contiguous float32 matrix with L2-normalized
+        rows, the input of the batched similarity methods below.
+        """
+        if len(embeddings) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        matrix = np.array(embeddings, dtype=np.float32)  # always a copy
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        matrix /= norms
+        return matrix
+
+    def embedding_matrix(self, uris: Optional[List[str]] = None) -> Tuple[List[str], np.ndarray]:
+        """
+        Normalized float32 matrix of the stored embeddings.
+
+        Args:
+            uris: Rows to include, in this order (default: every stored URI)
+        Returns:
+            (uris, matrix) where row i of matrix belongs to uris[i]
+        """
+        if uris is None:
+            uris = list(self.embed_map)
+        if isinstance(self.embed_map, EmbeddingStore):
+            matrix = self.embed_map.rows(uris)
+        else:
+            matrix = [self.embed_map[uri] for uri in uris]
+        return uris, self.normalized_matrix(matrix)
+
+    @staticmethod
+    def cosine_similarities(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """
+        One-vs-many: cosine similarity of query with every row of a
+        normalized matrix. query does not need to be normalized.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return np.zeros(len(matrix), dtype=np.float32)
+        return matrix @ (query / norm)
+
+    @staticmethod
+    def cosine_similarity_matrix(matrix1: np.ndarray, matrix2: np.ndarray) -> np.ndarray:
+        """
+        Many-vs-many: entry (i, j) is the cosine similarity of row i of
+        matrix1 and row j of matrix2 (both normalized).
+        """
+        return matrix1 @ matrix2.T
+
+    def plntxt_vertex_similarity_check_many(self, uri: str, uris: List[str], sigma: float) -> List[str]:
+        """
+        Batched plntxt_vertex_similarity_check: the URIs in uris whose
+        plaintext embedding has cosine similarity at least sigma with uri's.
+        """
+        assert uri in self.embed_map, "Embedding not found for URI."
+        uris, matrix = self.embedding_matrix(uris)
+        similarities = self.cosine_similarities(self.embed_map[uri], matrix)
+        return [uris[i] for i in np.flatnonzero(similarities >= sigma)]
 
     def _cosine_similarity_secure(self, normalized_v1: CKKSVector, normalized_v2: CKKSVector) -> CKKSVector:
         """
@@ -1,15 +1,146 @@
-import tenseal as ts
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# tenseal is imported on first use, so parameters can be selected (and
+# benchmarked) without it
+if TYPE_CHECKING:
+    import tenseal as ts
+    from tenseal import CKKSVector
+
+# Largest total coefficient modulus, in bits, per poly_modulus_degree for
+# 128-bit classical security (HomomorphicEncryption.org security standard,
+# as enforced by SEAL).
+MAX_COEFF_MODULUS_BITS: Dict[int, int] = {1024: 27, 2048: 54, 4096: 109, 8192: 218, 16384: 438, 32768: 881}
+MAX_PRIME_BITS = 60
+
+# all-MiniLM-L6-v2
+EMBEDDING_DIM = 384
+
+# Rescales (levels) used by the encrypted comparisons in server.py. Every
+# ciphertext multiplication and every multiplication by a plain scalar
+# consumes one.
+# h_v: vec1.dot(vec2) - sigma, then * mask
+H_V_DEPTH = 2
+# h_p: one dot product of the client's path_with_length ciphertext with the
+# server's plaintext length_weighted_path, 0.25 and mask folded in
+H_P_DEPTH = 1
+
+
+class CkksParameters(NamedTuple):
+    poly_modulus_degree: int
+    coeff_mod_bit_sizes: List[int]
+    scale_bits: int
+
+    @property
+    def slots(self) -> int:
+        return self.poly_modulus_degree // 2
+
+    @property
+    def depth(self) -> int:
+        # the first prime holds the decrypted value, the last one is the special prime
+        return len(self.coeff_mod_bit_sizes) - 2
+
+    @property
+    def total_bits(self) -> int:
+        return sum(self.coeff_mod_bit_sizes)
+
+    def __str__(self):
+        return f"N={self.poly_modulus_degree} {self.coeff_mod_bit_sizes} scale=2^{self.scale_bits}"
+
+
+def select_parameters(dim: int = EMBEDDING_DIM, depth: int = max(H_V_DEPTH, H_P_DEPTH), scale_bits: int = 30,
+                      integer_bits: int = 30) -> CkksParameters:
+    """
+    Smallest 128-bit secure CKKS parameter set for vectors of dim values
+    and depth rescales.
+
+    The modulus chain is one prime of scale_bits + integer_bits bits
+    (integer_bits of headroom for the decrypted value), depth primes of scale_bits
+    bits, and a special prime as large as the first. poly_modulus_degree is
+    the smallest one with at least dim slots whose security bound fits the
+    chain. The defaults give N=8192, [60, 30, 30, 60], scale 2^30 (the
+    parameters used before had one more 30-bit prime for h_p's length
+    multiplication).
+    """
+    if scale_bits > MAX_PRIME_BITS:
+        raise ValueError(f"scale of 2^{scale_bits} does not fit a {MAX_PRIME_BITS}-bit prime chain")
+    outer = min(scale_bits + integer_bits, MAX_PRIME_BITS)
+    chain = [outer] + [scale_bits] * depth + [outer]
+    for degree, max_bits in sorted(MAX_COEFF_MODULUS_BITS.items()):
+        if degree // 2 >= dim and sum(chain) <= max_bits:
+            return CkksParameters(degree, chain, scale_bits)
+    raise ValueError(f"no 128-bit secure parameters for dim {dim}, depth {depth} and scale 2^{scale_bits}")
+
+
+def path_with_length(embedding: np.ndarray, length: int) -> np.ndarray:
+    """
+    The client's path vector for h_p, [e, e / length]. Its dot product
+    with the server's length_weighted_path(e', length') is
+    e.e' * (1 / length + 1 / length'), so the path lengths never need a
+    ciphertext of their own.
+    """
+    return np.concatenate([embedding, embedding / length])
+
+
+def length_weighted_path(embedding: np.ndarray, length: int) -> np.ndarray:
+    """The server's plaintext counterpart of path_with_length, [e / length, e]."""
+    return np.concatenate([embedding / length, embedding])
+
+
+def pack_offsets(count: int, dim: int, slots: int) -> List[Tuple[int, int]]:
+    """
+    (ciphertext index, first slot) of each of count vectors of dim values
+    when as many vectors as fit in slots share a ciphertext.
+    """
+    per_vector = max(1, slots // dim)
+    return [(i // per_vector, (i % per_vector) * dim) for i in range(count)]
+
+
+class PackedVertex:
+    """
+    A client vertex embedding stored in slots [offset, offset + size) of a
+    ciphertext it shares with other vertices of the upload (see
+    EmbeddingHelper.encrypt_embeddings_packed). Used in place of the
+    vertex's own CKKSVector on the server.
+    """
+    __slots__ = ("vector", "offset", "size")
+
+    def __init__(self, vector: CKKSVector, offset: int, size: int):
+        self.vector = vector
+        self.offset = offset
+        self.size = size
+
+    def dot(self, embedding: np.ndarray) -> CKKSVector:
+        """
+        Encrypted dot product with a plaintext embedding: the embedding is
+        placed at this vertex's slots and zero elsewhere, so the other
+        vertices in the ciphertext do not contribute. Like a ciphertext dot
+        product, this consumes one level.
+        """
+        plain = np.zeros(self.vector.size())
+        plain[self.offset:self.offset + self.size] = embedding
+        return self.vector.dot(plain.tolist())
 
 
 class Encryption:
-    def __init__(self):
+    def __init__(self, parameters: Optional[CkksParameters] = None):
+        """
+        Args:
+            parameters: CKKS parameters; select_parameters() if not given
+        """
+        import tenseal as ts
+
+        self.parameters = parameters or select_parameters()
         self.context = ts.context(
             ts.SCHEME_TYPE.CKKS,
-            poly_modulus_degree=8192,
-            coeff_mod_bit_sizes= [60, 30, 30, 30, 60]
+            poly_modulus_degree=self.parameters.poly_modulus_degree,
+            coeff_mod_bit_sizes=list(self.parameters.coeff_mod_bit_sizes)
         )
         self.context.generate_galois_keys()
-        self.context.global_scale = 2 ** 30
+        self.context.global_scale = 2 ** self.parameters.scale_bits
 
     def get_context(self) -> ts.Context:
         return self.context
@@ -20,4 +151,4 @@ class Encryption:
                 save_secret_key=False,   # or False, if you don't want to share it
                 save_galois_keys=True,
                 save_relin_keys=True
-                )
\ No newline at end of file
+                )
@@ -1,4 +1,5 @@
-from typing import List, Tuple, Set
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple, Set
 
 class Entity:
     def __init__(self, uri, label):
@@ -33,6 +34,60 @@ class Edge(Entity):
             self.uri == other.uri
         )
 
+class LineageView:
+    """
+    The vertices and edges reachable from a root vertex, as returned by
+    Graph.extract_lineage. It shares the source graph's objects and exposes
+    the same vertices/edges lists as a Graph, so it can be merged or
+    serialized without copying.
+
+    Pickling stores only (uri, label) pairs and (source, target, label)
+    index triples; unpickling rebuilds standalone Vertex and Edge objects.
+    """
+
+    def __init__(self, root: Vertex, vertices: List[Vertex], edges: List[Edge]):
+        self.root = root
+        self.vertices = vertices
+        self.edges = edges
+
+    @property
+    def vertex_uris(self) -> Set[str]:
+        return {v.uri for v in self.vertices}
+
+    def lookup(self, uri):
+        for vertex in self.vertices:
+            if vertex.uri == uri:
+                return vertex
+        return None
+
+    def to_graph(self) -> 'Graph':
+        graph = Graph()
+        graph.vertices = list(self.vertices)
+        graph.edges = list(self.edges)
+        return graph
+
+    def __getstate__(self):
+        index = {}
+        for i, v in enumerate(self.vertices):
+            index.setdefault(v.uri, i)
+        return {
+            "vertices": [(v.uri, v.label, v.outward_degree) for v in self.vertices],
+            "edges": [(index[e.v1.uri], index[e.v2.uri], e.label) for e in self.edges],
+        }
+
+    def __setstate__(self, state):
+        self.vertices = []
+        for uri, label, outward_degree in state["vertices"]:
+            v = Vertex(uri, label)
+            v.outward_degree = outward_degree
+            self.vertices.append(v)
+        self.edges = []
+        for src, dst, label in state["edges"]:
+            v1, v2 = self.vertices[src], self.vertices[dst]
+            self.edges.append(Edge(f"{v1.uri}->{v2.uri}", v1, v2, label))
+        self.root = self.vertices[0] if self.vertices else None
+
+
 class Graph:
     def __init__(self):
         self.edges = []
@@ -80,26 +135,88 @@ class Graph:
     def is_leaf_node(self, v: Vertex):
         return not any(edge for edge in self.edges if edge.v1 == v)
 
-    def extract_lineage_set(self, v: Vertex):
-        lineage_graph = Graph()
-        visited = set()
+    def copy(self) -> 'Graph':
+        """
+        Copy the graph with its own Vertex and Edge objects, so the copy can
+        be read while the original is modified (and the other way round).
+        Endpoints of edges that are not in the vertex list (e.g. left behind
+        by remove_duplicate_vertices_by_label_and_edge_label) are cloned
+        too but, as in the original, not listed.
+        """
+        graph = Graph()
+        clones = {}
+
+        def clone_vertex(v: Vertex) -> Vertex:
+            clone = Vertex(v.uri, v.label)
+            clone.status = v.status
+            clone.outward_degree = v.outward_degree
+            return clone
+
+        for v in self.vertices:
+            clone = clone_vertex(v)
+            clones.setdefault(v.uri, clone)
+            graph.vertices.append(clone)
+        for e in self.edges:
+            for v in (e.v1, e.v2):
+                if v.uri not in clones:
+                    clones[v.uri] = clone_vertex(v)
+        graph.edges = [Edge(e.uri, clones[e.v1.uri], clones[e.v2.uri], e.label) for e in self.edges]
+        return graph
+
+    def out_edge_map(self) -> Dict[str, List[Edge]]:
+        """
+        Group the edges by source vertex URI, in edge order, so that repeated
+        get_edges calls can be answered without rescanning the edge list.
+        """
+        out_edges = {}
+        for edge in self.edges:
+            out_edges.setdefault(edge.v1.uri, []).append(edge)
+        return out_edges
+
+    def extract_lineage(self, v: Vertex, out_edges: Optional[Dict[str, List[Edge]]] = None) -> 'LineageView':
+        """
+        Collect the vertices and edges reachable from v, in depth-first order.
+
+        The traversal is iterative, so deep chains do not hit the recursion
+        limit, and returns a view sharing this graph's Vertex and Edge objects.
+
+        Args:
+            v: Root of the lineage
+            out_edges: Precomputed out_edge_map() of this graph, if available
+        """
+        if out_edges is None:
+            out_edges = self.out_edge_map()
 
-        def dfs(current_vertex):
-            if current_vertex in visited:
-                return
-            visited.add(current_vertex)
+        visited = {v.uri}
+        vertices = [v]
+        edges = []
+        stack = [iter(out_edges.get(v.uri, ()))]
+        while stack:
+            edge = next(stack[-1], None)
+            if edge is None:
+                stack.pop()
+                continue
+            edges.append(edge)
+            next_vertex = edge.v2
+            if next_vertex.uri in visited:
+                continue
+            visited.add(next_vertex.uri)
+            vertices.append(next_vertex)
+            stack.append(iter(out_edges.get(next_vertex.uri, ())))
 
-            # Add current vertex to lineage graph
-            lineage_graph.add_vertex(current_vertex)
+        return LineageView(v, vertices, edges)
 
-            # Get outward edges
-            for edge in self.get_edges(current_vertex):
-                next_vertex = edge.v2
-                # lineage_graph.add_vertex(next_vertex)
-                lineage_graph.add_edge(current_vertex, next_vertex, edge.label)
-                dfs(next_vertex)
+    def extract_lineage_set(self, v: Vertex, out_edges: Optional[Dict[str, List[Edge]]] = None):
+        """
+        Copy the lineage of v (see extract_lineage) into a new Graph.
 
-        dfs(v)
+        The copy has its own Edge objects; vertices are shared and their
+        outward_degree is left untouched.
+        """
+        lineage = self.extract_lineage(v, out_edges)
+        lineage_graph = Graph()
+        lineage_graph.vertices = lineage.vertices
+        lineage_graph.edges = [Edge(edge.uri, edge.v1, edge.v2, edge.label) for edge in lineage.edges]
         return lineage_graph
 
     def get_edges(self, v: Vertex) -> List[Edge]:
@@ -122,16 +239,26 @@ class Graph:
                 print(f"  {vertex.label} ({vertex.uri}) -> ∅")
 
     
-    def edge_cut_partition(self, n: int) -> List[Tuple['Graph', Set[Vertex]]]:
+    def edge_cut_partition(self, n: int, strategy: str = "greedy", slack: float = 0.1) -> List[Tuple['Graph', Set[Vertex]]]:
         """
         Partition the graph into n fragments using edge-cut strategy.
         Each fragment FiD is defined as (ViD ∪ OiD, EiD, LiD), where:
         - (V1, ..., Vn) is a partition of V
         - OiD is the set of border nodes that are not in ViD but have incoming edges from vertices in ViD
         - FiD is the subgraph induced by ViD ∪ OiD
+
+        The "greedy" strategy streams the vertices in depth-first order from
+        the roots, so each lineage arrives contiguously, and places each one
+        in the fragment holding most of its neighbours, discounted by how
+        full that fragment is (linear deterministic greedy). Both that
+        assignment and the contiguous one then get a few label-propagation
+        refinement passes, and whichever cuts fewer edges is kept.
+        "contiguous" splits self.vertices into equal consecutive slices.
         
         Args:
             n: Number of fragments to create
+            strategy: "greedy" or "contiguous"
+            slack: Fraction by which a greedy fragment may exceed |V| / n
             
         Returns:
             List of tuples (Graph, Set[Vertex]), where each tuple contains:
@@ -140,110 +267,232 @@ class Graph:
         """
         if n <= 0 or n > len(self.vertices):
             raise ValueError("Number of partitions must be positive and not exceed number of vertices")
-            
+
+        if strategy == "greedy":
+            vertex_to_fragment = self._greedy_assignment(n, slack)
+        elif strategy == "contiguous":
+            vertex_to_fragment = self._contiguous_assignment(n)
+        else:
+            raise ValueError(f"Unknown partition strategy '{strategy}'")
+
         # Initialize fragments and border node sets
         fragments = [Graph() for _ in range(n)]
         border_sets = [set() for _ in range(n)]
-        
-        # Calculate partition size and remainder
-        partition_size = len(self.vertices) // n
-        remainder = len(self.vertices) % n
-        
-        # Distribute vertices to fragments
+
+        for vertex in self.vertices:
+            fragments[vertex_to_fragment[vertex.uri]].add_vertex(vertex)
+
+        # Process edges and identify border nodes
+        for edge in self.edges:
+            source_fragment_idx = vertex_to_fragment.get(edge.v1.uri)
+            if source_fragment_idx is None:
+                continue
+
+            # If v2 is in a different fragment, it becomes a border node
+            if vertex_to_fragment.get(edge.v2.uri) != source_fragment_idx:
+                border_sets[source_fragment_idx].add(edge.v2)
+
+            # Share the edge with the source fragment; add_edge would bump
+            # outward_degree on the shared vertices
+            fragments[source_fragment_idx].edges.append(edge)
+
+        # Return fragments with their border node sets
+        return list(zip(fragments, border_sets))
+
+    def _contiguous_assignment(self, n: int) -> Dict[str, int]:
+        partition_size, remainder = divmod(len(self.vertices), n)
+        vertex_to_fragment = {}
         start_idx = 0
-        vertex_to_fragment = {}  # Map to track which fragment owns each vertex
-        
         for i in range(n):
-            # Calculate size of this partition
             current_size = partition_size + (1 if i < remainder else 0)
-            
-            # Get vertices for this partition
-            partition_vertices = self.vertices[start_idx:start_idx + current_size]
+            for vertex in self.vertices[start_idx:start_idx + current_size]:
+                vertex_to_fragment.setdefault(vertex.uri, i)
             start_idx += current_size
-            
-            # Add vertices to fragment and track ownership
-            for vertex in partition_vertices:
-                fragments[i].add_vertex(vertex)
-                vertex_to_fragment[vertex] = i
-        
-        # Process edges and identify border nodes
+        return vertex_to_fragment
+
+    def _greedy_assignment(self, n: int, slack: float, refine_passes: int = 5) -> Dict[str, int]:
+        neighbours: Dict[str, List[str]] = {v.uri: [] for v in self.vertices}
+        has_parent = set()
         for edge in self.edges:
-            v1, v2 = edge.v1, edge.v2
-            
-            # Find which fragment contains v1
-            source_fragment_idx = vertex_to_fragment.get(v1)
-            
-            if source_fragment_idx is not None:
-                target_fragment_idx = vertex_to_fragment.get(v2)
-                
-                # If v2 is in a different fragment, it becomes a border node
-                if target_fragment_idx != source_fragment_idx and v2 not in fragments[source_fragment_idx].vertices:
-                    border_sets[source_fragment_idx].add(v2)
-                
-                # Add the edge to the source fragment
-                fragments[source_fragment_idx].add_edge(v1, v2, edge.label)
-        
-        # Return fragments with their border node sets
-        return list(zip(fragments, border_sets))
-    
-    def serialize_to_cytoscape(self) -> dict:
+            if edge.v1.uri in neighbours and edge.v2.uri in neighbours:
+                neighbours[edge.v1.uri].append(edge.v2.uri)
+                neighbours[edge.v2.uri].append(edge.v1.uri)
+                if edge.v1.uri != edge.v2.uri:
+                    has_parent.add(edge.v2.uri)
+
+        # Depth-first order from the roots, then from anything left (cycles),
+        # so each lineage is streamed contiguously
+        order = []
+        seen = set()
+        starts = [v.uri for v in self.vertices if v.uri not in has_parent]
+        starts += [v.uri for v in self.vertices]
+        for start in starts:
+            if start in seen:
+                continue
+            stack = [start]
+            while stack:
+                uri = stack.pop()
+                if uri in seen:
+                    continue
+                seen.add(uri)
+                order.append(uri)
+                stack.extend(other for other in reversed(neighbours[uri]) if other not in seen)
+
+        capacity = max(1.0, (1.0 + slack) * len(order) / n)
+        sizes = [0] * n
+        streamed: Dict[str, int] = {}
+        for uri in order:
+            placed = {}
+            for other in neighbours[uri]:
+                i = streamed.get(other)
+                if i is not None:
+                    placed[i] = placed.get(i, 0) + 1
+            best, best_score = None, None
+            for i in range(n):
+                if sizes[i] + 1 > capacity:
+                    continue
+                score = (placed.get(i, 0) * (1.0 - sizes[i] / capacity), -sizes[i])
+                if best_score is None or score > best_score:
+                    best, best_score = i, score
+            if best is None:
+                best = min(range(n), key=lambda i: sizes[i])
+            streamed[uri] = best
+            sizes[best] += 1
+
+        # Refine both the streamed and the contiguous assignment and keep
+        # whichever cuts fewer edges; on hub-heavy profiles either can win
+        candidates = []
+        for assignment in (streamed, self._contiguous_assignment(n)):
+            assignment = self._refine_assignment(assignment, order, neighbours, n, capacity, refine_passes)
+            cut = sum(1 for edge in self.edges
+                      if assignment.get(edge.v1.uri) is not None
+                      and assignment.get(edge.v1.uri) != assignment.get(edge.v2.uri))
+            candidates.append((cut, assignment))
+        return min(candidates, key=lambda candidate: candidate[0])[1]
+
+    @staticmethod
+    def _refine_assignment(assignment: Dict[str, int], order: List[str], neighbours: Dict[str, List[str]],
+                           n: int, capacity: float, passes: int) -> Dict[str, int]:
         """
-        Serialize the graph into Cytoscape.js compatible JSON format.
-        
-        Args:
-            graph: The graph object to serialize
-            
+        Label-propagation refinement: move a vertex to the fragment holding
+        most of its neighbours while that strictly reduces the cut and the
+        fragment has room.
+        """
+        assignment = dict(assignment)
+        sizes = [0] * n
+        for i in assignment.values():
+            sizes[i] += 1
+        for _ in range(passes):
+            moved = 0
+            for uri in order:
+                current = assignment[uri]
+                counts = {}
+                for other in neighbours[uri]:
+                    i = assignment[other]
+                    counts[i] = counts.get(i, 0) + 1
+                best, best_count = current, counts.get(current, 0)
+                for i, count in counts.items():
+                    if count > best_count and sizes[i] + 1 <= max(capacity, sizes[current]):
+                        best, best_count = i, count
+                if best != current:
+                    assignment[uri] = best
+                    sizes[current] -= 1
+                    sizes[best] += 1
+                    moved += 1
+            if not moved:
+                break
+        return assignment
+
+    @staticmethod
+    def partition_stats(partitions: List[Tuple['Graph', Set[Vertex]]]) -> Dict[str, float]:
+        """
+        Summarize an edge_cut_partition result.
+
         Returns:
-            dict: A dictionary in Cytoscape.js format
+            dict: "cut_edges" (edges whose target lies in another fragment),
+            "cut_ratio" (cut_edges / all edges), "border_nodes" (sum of |OiD|),
+            "balance" (largest fragment / average fragment size)
         """
-        # Initialize the data structure without elements wrapper
-        cytoscape_data = {
-            "nodes": [],
-            "edges": []
+        owner = {}
+        for i, (fragment, _) in enumerate(partitions):
+            for vertex in fragment.vertices:
+                owner[vertex.uri] = i
+        total_edges = 0
+        cut_edges = 0
+        for i, (fragment, _) in enumerate(partitions):
+            total_edges += len(fragment.edges)
+            cut_edges += sum(1 for edge in fragment.edges if owner.get(edge.v2.uri) != i)
+        sizes = [len(fragment.vertices) for fragment, _ in partitions]
+        average = sum(sizes) / len(sizes) if sizes else 0
+        return {
+            "cut_edges": cut_edges,
+            "cut_ratio": cut_edges / total_edges if total_edges else 0.0,
+            "border_nodes": sum(len(border) for _, border in partitions),
+            "balance": max(sizes) / average if average else 0.0,
         }
-        
-        # Add nodes
+
+    def iter_cytoscape_nodes(self):
+        """
+        Yield the Cytoscape.js node entries of the graph one at a time.
+        """
         for vertex in self.vertices:
-            node_data = {
+            yield {
                 "id": vertex.uri,
                 "labels": [vertex.label]
             }
-            cytoscape_data["nodes"].append(node_data)
-        
-        # Add edges with auto-incrementing IDs
+
+    def iter_cytoscape_edges(self):
+        """
+        Yield the Cytoscape.js edge entries of the graph one at a time,
+        with auto-incrementing IDs.
+        """
         edge_id = 1
         for edge in self.edges:
-            edge_data = {
+            yield {
                 "id": f"e{edge_id}",
                 "source": edge.v1.uri,
                 "target": edge.v2.uri,
                 "labels": [edge.label]
             }
-            cytoscape_data["edges"].append(edge_data)
             edge_id += 1
+
+    def serialize_to_cytoscape(self) -> dict:
+        """
+        Serialize the graph into Cytoscape.js compatible JSON format.
         
-        return cytoscape_data
+        Returns:
+            dict: A dictionary in Cytoscape.js format
+        """
+        # Initialize the data structure without elements wrapper
+        return {
+            "nodes": list(self.iter_cytoscape_nodes()),
+            "edges": list(self.iter_cytoscape_edges())
+        }
 
-    def save_cytoscape_json(self,output_file: str):
+    def save_cytoscape_json(self, output_file: str, compact: bool = False):
         """
         Save the graph as a Cytoscape.js compatible JSON file.
+
+        Nodes and edges are streamed to a temporary file that replaces
+        output_file only once it is complete.
         
         Args:
-            graph: The graph object to serialize
             output_file: Path to save the JSON file
+            compact: Write without indentation or spaces
         """
-        import json
-        import os
-        
-        # Delete existing file if it exists
-        if os.path.exists(output_file):
-            os.remove(output_file)
-        
-        cytoscape_data = self.serialize_to_cytoscape()
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(cytoscape_data, f, ensure_ascii=False, indent=2)
-        
+        write_cytoscape_json(output_file, self.iter_cytoscape_nodes(), self.iter_cytoscape_edges(), compact)
+
+    def save_snapshot(self, output_file: str):
+        """
+        Save the graph as a memory-mappable binary snapshot (see snapshot.py).
+
+        Args:
+            output_file: Path to save the snapshot file
+        """
+        from snapshot import save_snapshot
+
+        save_snapshot(self, output_file)
+
     # def export_graph_to_json(self):
 
     def get_newly_added_vertices_count(self, original_vertex_uris: set) -> int:
@@ -259,4 +508,78 @@ class Graph:
         return len(new_uris)
     
     
-    
\ No newline at end of file
+    
+
+
+def write_cytoscape_json(output_file: str, nodes: Iterable[dict], edges: Iterable[dict], compact: bool = False):
+    """
+    Stream Cytoscape.js node and edge entries into output_file.
+
+    Entries are encoded one at a time into a temporary file next to
+    output_file, which is then atomically renamed over it, so an interrupted
+    write never leaves a truncated graph behind. The indented output is
+    byte-identical to json.dump(..., indent=2).
+
+    Args:
+        output_file: Path to save the JSON file
+        nodes: Node entries, e.g. Graph.iter_cytoscape_nodes()
+        edges: Edge entries, e.g. Graph.iter_cytoscape_edges()
+        compact: Write without indentation or spaces
+    """
+    import json
+    import os
+
+    if compact:
+        encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+        open_section, separator, close_empty, close_section = '[', ',', ']', ']'
+        head, middle, tail = '{"nodes":', ',"edges":', '}'
+    else:
+        dumps = json.JSONEncoder(ensure_ascii=False).encode
+
+        def encode(entry):
+            # Hand-indent the flat entries produced here; the indenting json
+            # encoder is pure Python and dominates the write time otherwise.
+            fields = []
+            for key, value in entry.items():
+                if isinstance(value, list):
+                    if any(isinstance(item, (list, dict)) for item in value):
+                        return "\n    " + json.dumps(entry, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+                    if value:
+                        items = ",\n        ".join(dumps(item) for item in value)
+                        value = f"[\n        {items}\n      ]"
+                    else:
+                        value = "[]"
+                elif isinstance(value, dict):
+                    return "\n    " + json.dumps(entry, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+                else:
+                    value = dumps(value)
+                fields.append(f"\n      {dumps(key)}: {value}")
+            return "\n    {" + ",".join(fields) + "\n    }" if fields else "\n    {}"
+        open_section, separator, close_empty, close_section = '[', ',', ']', '\n  ]'
+        head, middle, tail = '{\n  "nodes": ', ',\n  "edges": ', '\n}'
+
+    def write_section(f, entries):
+        f.write(open_section)
+        first = True
+        for entry in entries:
+            if not first:
+                f.write(separator)
+            f.write(encode(entry))
+            first = False
+        f.write(close_empty if first else close_section)
+
+    tmp_file = f"{output_file}.tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8', buffering=1 << 16) as f:
+            f.write(head)
+            write_section(f, nodes)
+            f.write(middle)
+            write_section(f, edges)
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
@@ -0,0 +1,207 @@
+# counters, histograms, timers and per-message byte counts of an enrichment run
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from tracing import NULL_SPAN, Tracer
+
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    """All observed values, kept in a compact array; summarized on demand."""
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values = array("d")
+
+    def add(self, value: float):
+        self.values.append(value)
+
+    def extend(self, other: "Histogram"):
+        self.values.extend(other.values)
+
+    @property
+    def count(self) -> int:
+        return len(self.values)
+
+    @property
+    def total(self) -> float:
+        return sum(self.values)
+
+    def summary(self, scale: float = 1.0) -> Dict[str, float]:
+        """count, sum, min, mean, max and percentiles, with values multiplied by scale."""
+        values = sorted(self.values)
+        n = len(values)
+        if n == 0:
+            return {"count": 0, "sum": 0.0}
+        result = {
+            "count": n,
+            "sum": sum(values) * scale,
+            "min": values[0] * scale,
+            "mean": sum(values) / n * scale,
+            "max": values[-1] * scale,
+        }
+        for p in PERCENTILES:
+            # nearest-rank percentile
+            result[f"p{p}"] = values[min(n - 1, max(0, -(-p * n // 100) - 1))] * scale
+        return result
+
+
+class MessageStats:
+    """Messages of one type sent and received on a connection."""
+    __slots__ = ("sent", "bytes_sent", "received", "bytes_received")
+
+    def __init__(self):
+        self.sent = 0
+        self.bytes_sent = 0
+        self.received = 0
+        self.bytes_received = 0
+
+    @property
+    def round_trips(self) -> int:
+        # a request and its reply are recorded under the same message type
+        return min(self.sent, self.received)
+
+
+class Metrics:
+    """
+    Measurements of one enrichment run (or of one session on a multi-peer
+    server). Recording is a dict lookup and an append; everything is
+    aggregated only in summary().
+
+    - add_time / timer: durations from time.perf_counter_ns, one histogram
+      per phase name
+    - observe: histogram of any other value (path counts, sizes, ...)
+    - incr: counters (cache hits, calls, ...)
+    - sent / received: bytes and message counts per message type
+    - span: a traced region, e.g. one para_match pair (see tracing.Tracer)
+
+    tracer is None unless PKGEM_TRACE or PKGEM_PROFILE is set; with a
+    tracer, timers are spans too and every record above is also counted on
+    the innermost open span.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, Histogram] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.messages: Dict[str, MessageStats] = {}
+        self.tracer: Optional[Tracer] = Tracer.from_env()
+
+    def add_time(self, name: str, ns: int):
+        """Record a duration in nanoseconds (a time.perf_counter_ns() difference)."""
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.add(ns)
+        if self.tracer is not None:
+            self.tracer.count(name)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            with self.span(name):
+                yield
+        finally:
+            self.add_time(name, time.perf_counter_ns() - start)
+
+    def span(self, name: str, **args):
+        """
+        Context manager for a traced region named name with args (e.g. the
+        vertex URIs of a pair); yields a Span whose set() adds args. A no-op
+        without a tracer.
+        """
+        if self.tracer is None:
+            return NULL_SPAN
+        return self.tracer.span(name, args)
+
+    def observe(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def incr(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.tracer is not None:
+            self.tracer.count(name, n)
+
+    def _message(self, msg: str) -> MessageStats:
+        stats = self.messages.get(msg)
+        if stats is None:
+            stats = self.messages[msg] = MessageStats()
+        return stats
+
+    def sent(self, msg: str, nbytes: int) -> int:
+        stats = self._message(msg)
+        stats.sent += 1
+        stats.bytes_sent += nbytes
+        if self.tracer is not None:
+            self.tracer.count("bytes sent", nbytes)
+        return nbytes
+
+    def received(self, msg: str, nbytes: int) -> int:
+        stats = self._message(msg)
+        stats.received += 1
+        stats.bytes_received += nbytes
+        if self.tracer is not None:
+            self.tracer.count("bytes received", nbytes)
+        return nbytes
+
+    def time_s(self, name: Optional[str] = None) -> float:
+        """Total seconds recorded under name, or under all names."""
+        names = self.timings if name is None else [name] if name in self.timings else []
+        return sum(self.timings[n].total for n in names) / 1e9
+
+    def bytes_sent(self) -> int:
+        return sum(s.bytes_sent for s in self.messages.values())
+
+    def bytes_received(self) -> int:
+        return sum(s.bytes_received for s in self.messages.values())
+
+    def round_trips(self) -> int:
+        return sum(s.round_trips for s in self.messages.values())
+
+    def merge(self, other: "Metrics"):
+        """Add the measurements of other (e.g. from a fragment worker) to this one."""
+        for name, histogram in other.timings.items():
+            self.timings.setdefault(name, Histogram()).extend(histogram)
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, Histogram()).extend(histogram)
+        for name, n in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for msg, stats in other.messages.items():
+            mine = self._message(msg)
+            mine.sent += stats.sent
+            mine.bytes_sent += stats.bytes_sent
+            mine.received += stats.received
+            mine.bytes_received += stats.bytes_received
+        if self.tracer is not None and other.tracer is not None:
+            self.tracer.merge(other.tracer)
+
+    def save_trace(self, directory: str, name: str) -> List[str]:
+        """Write the trace and profiles, if any, to directory (see Tracer.save)."""
+        if self.tracer is None:
+            return []
+        paths = self.tracer.save(directory, name)
+        for path in paths:
+            print(f"log: wrote {path}")
+        return paths
+
+    def summary(self) -> dict:
+        """Structured, JSON-serializable summary; times are in seconds."""
+        return {
+            "total_time_s": self.time_s(),
+            "bytes_sent": self.bytes_sent(),
+            "bytes_received": self.bytes_received(),
+            "round_trips": self.round_trips(),
+            "timings_s": {name: h.summary(1e-9) for name, h in self.timings.items()},
+            "histograms": {name: h.summary() for name, h in self.histograms.items()},
+            "counters": dict(self.counters),
+            "messages": {msg: {"sent": s.sent, "bytes_sent": s.bytes_sent, "received": s.received,
+                               "bytes_received": s.bytes_received, "round_trips": s.round_trips}
+                         for msg, s in self.messages.items()},
+        }
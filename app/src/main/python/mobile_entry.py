@@ -1,5 +1,4 @@
 from typing import Dict, Any
-import numpy as np
 import traceback
 
 # Global state to track enrichment status
@@ -22,9 +21,10 @@ def save_enrichment_result(result: dict, context) -> str:
     """Save enrichment result to a file and return the file path"""
     import json
     import os
+    from util import get_files_dir
     
     # Create results directory if it doesn't exist
-    results_dir = os.path.join(context.getFilesDir().getAbsolutePath(), "results")
+    results_dir = os.path.join(get_files_dir(context), "results")
     os.makedirs(results_dir, exist_ok=True)
     
     # Save result to file
@@ -41,6 +41,12 @@ def stop_enrichment_server():
 
     enrichment_status["status"] = "Server stopped"
 
+def release_resources():
+    """Release the warm embedder, predictor and CKKS context (e.g. on low memory)"""
+    from resources import resources
+
+    resources.release()
+
 def _call_kotlin_progress_callback(callback_obj, progress_percentage: int, status_message: str):
     """Safely call Kotlin progress callback"""
     if callback_obj and hasattr(callback_obj, "onProgressUpdate"):
@@ -68,6 +74,7 @@ def run_enrichment_server_wrapper(host: str, port: int, dataset_path: str,
         "total_bytes_received": 0,
         "enriched_node_count": 0,
         "result_file": "",
+        "metrics": None,
         "error": None,
         "is_running": True,
         "security_mode": _get_security_mode_from_prefs(android_context_obj)
@@ -76,12 +83,12 @@ def run_enrichment_server_wrapper(host: str, port: int, dataset_path: str,
     _call_kotlin_progress_callback(progress_callback, 0, "Server: Initializing...")
     
     try:
-        from server import main as server_main
-        from server_unencrypted import main as server_main_unencrypted
-
         server_result_data = None
 
+        # import only the mode in use: the encrypted modules load tenseal
         if enrichment_status["security_mode"]:
+            from server import main as server_main
+
             server_result_data = server_main(
                 dataset_path=dataset_path,
                 java_context=android_context_obj,
@@ -90,6 +97,8 @@ def run_enrichment_server_wrapper(host: str, port: int, dataset_path: str,
                 progress_callback=progress_callback
             )
         else:
+            from server_unencrypted import main as server_main_unencrypted
+
             server_result_data = server_main_unencrypted(
                 dataset_path=dataset_path,
                 java_context=android_context_obj,
@@ -105,6 +114,7 @@ def run_enrichment_server_wrapper(host: str, port: int, dataset_path: str,
             # enrichment_status["result_file"] = save_enrichment_result(server_result_data.get("actual_data"), android_context_obj)
             # Load graph data from graph.json
             enrichment_status["result_file"] = server_result_data.get("graph_path", "")
+            enrichment_status["metrics"] = server_result_data.get("metrics")
 
             enrichment_status["status"] = "Server completed successfully"
             _call_kotlin_progress_callback(progress_callback, 100, "Server: Completed successfully")
@@ -121,6 +131,69 @@ def run_enrichment_server_wrapper(host: str, port: int, dataset_path: str,
     
     return enrichment_status
 
+def run_enrichment_hub_wrapper(host: str, port: int, dataset_path: str,
+                               progress_callback: object,
+                               android_context_obj, max_sessions: int = None) -> dict:
+    """
+    Like run_enrichment_server_wrapper, but keeps serving peers until
+    stop_enrichment_server() is called or max_sessions peers were served.
+    Totals are summed over all sessions and "metrics" holds the summary of
+    every session (see metrics.Metrics). Only the encrypted server supports
+    several peers; without security mode a single peer is served.
+    """
+    global enrichment_status
+    if not _get_security_mode_from_prefs(android_context_obj):
+        return run_enrichment_server_wrapper(host, port, dataset_path, progress_callback, android_context_obj)
+
+    enrichment_status = {
+        "status": "initializing",
+        "total_time": 0.0,
+        "total_bytes_received": 0,
+        "enriched_node_count": 0,
+        "result_file": "",
+        "metrics": [],
+        "error": None,
+        "is_running": True,
+        "security_mode": True,
+        "sessions": 0
+    }
+
+    _call_kotlin_progress_callback(progress_callback, 0, "Server: Initializing...")
+
+    try:
+        from server import serve
+
+        session_results = serve(
+            dataset_path=dataset_path,
+            java_context=android_context_obj,
+            port=port,
+            progress_callback=progress_callback,
+            max_sessions=max_sessions,
+            should_stop=lambda: not enrichment_status["is_running"]
+        )
+
+        for result in session_results:
+            enrichment_status["total_time"] += result.get("total_time", 0.0)
+            enrichment_status["total_bytes_received"] += result.get("total_bytes_received", 0)
+            enrichment_status["enriched_node_count"] += result.get("enriched_node_count", 0)
+            enrichment_status["result_file"] = result.get("graph_path", "")
+            enrichment_status["metrics"].append(result.get("metrics"))
+        enrichment_status["sessions"] = len(session_results)
+
+        enrichment_status["status"] = "Server completed successfully"
+        _call_kotlin_progress_callback(progress_callback, 100, "Server: Completed successfully")
+
+    except Exception as e:
+        error_msg = str(e)
+        print(f"PY_ERROR: Server enrichment failed: {error_msg}")
+        print(traceback.format_exc())
+        enrichment_status["error"] = error_msg
+        _call_kotlin_progress_callback(progress_callback, 100, f"Server: Failed - {error_msg[:50]}...")
+    finally:
+        enrichment_status["is_running"] = False
+
+    return enrichment_status
+
 def run_enrichment_client_wrapper(server_ip: str, server_port: int, dataset_path: str,
                                 progress_callback: object,
                                 android_context_obj) -> dict:
@@ -131,6 +204,7 @@ def run_enrichment_client_wrapper(server_ip: str, server_port: int, dataset_path
         "total_bytes_received": 0,
         "enriched_node_count": 0,
         "result_file": "",
+        "metrics": None,
         "error": None,
         "is_running": True,
         "security_mode": _get_security_mode_from_prefs(android_context_obj)
@@ -139,21 +213,23 @@ def run_enrichment_client_wrapper(server_ip: str, server_port: int, dataset_path
     _call_kotlin_progress_callback(progress_callback, 0, "Client: Initializing...")
     
     try:
-        from client import main as client_main
-        from client_unencrypted import main as client_main_unencrypted
-
         client_result_data = None
 
         _call_kotlin_progress_callback(progress_callback, 32, "Client: Computing...")
 
+        # import only the mode in use: the encrypted modules load tenseal
         if enrichment_status["security_mode"]:
+            from client import main as client_main
+
             client_result_data = client_main(
                 dataset_path=dataset_path,
                 context=android_context_obj,
                 server_ip=server_ip,
                 port=server_port
             )
-        else:   
+        else:
+            from client_unencrypted import main as client_main_unencrypted
+
             client_result_data = client_main_unencrypted(
                 dataset_path=dataset_path,
                 context=android_context_obj,
@@ -168,6 +244,7 @@ def run_enrichment_client_wrapper(server_ip: str, server_port: int, dataset_path
             enrichment_status["total_bytes_received"] = client_result_data.get("total_bytes_received", 0)
             enrichment_status["enriched_node_count"] = client_result_data.get("enriched_node_count", 0)
             enrichment_status["result_file"] = client_result_data.get("graph_path", "")
+            enrichment_status["metrics"] = client_result_data.get("metrics")
             if client_result_data.get("error"):
                 enrichment_status["error"] = client_result_data["error"]
                 enrichment_status["status"] = f"Client failed: {client_result_data['error']}"
@@ -0,0 +1,98 @@
+# keep expensive runtime objects warm across enrichment runs
+import gc
+import threading
+from typing import Callable, Dict, List, TypeVar
+
+T = TypeVar("T")
+
+
+class ResourceManager:
+    """
+    Process-wide owner of the objects that are expensive to create: the
+    sentence transformer (EmbeddingHelper), the path predictor and, if
+    asked to keep it, the CKKS Encryption context. Each one is created on
+    first use and then kept between enrichment runs until it is released.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ResourceManager, cls).__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self._lock = threading.RLock()
+        self._resources: Dict[str, object] = {}
+
+    def get(self, name: str, factory: Callable[[], T]) -> T:
+        """Return the resource called name, creating it with factory if needed."""
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = factory()
+            return self._resources[name]
+
+    def embedding_helper(self, java_context, dtype: str = "float32"):
+        """
+        Warm EmbeddingHelper. Its embedding maps belong to the last run and
+        are replaced by the next encode_embedding call, which stores them
+        as dtype (see EmbeddingStore).
+        """
+        import embedding_bridge
+        from embedding_helper import EmbeddingHelper
+
+        def create():
+            if embedding_bridge.TextEmbedder is None:
+                # off-device: ONNX Runtime / sentence-transformers on the host
+                from embedding_backends import create_host_backend
+
+                return EmbeddingHelper(java_context, dtype, backend=create_host_backend())
+            return EmbeddingHelper(java_context, dtype)
+
+        helper = self.get("embedding_helper", create)
+        helper.dtype = dtype
+        return helper
+
+    def predictor(self, java_context):
+        from mock_predictor import MockLLMPredictor
+        # from predictor import LLMPredictor
+
+        return self.get("predictor", lambda: MockLLMPredictor(java_context))
+
+    def encryption(self, reuse_keys: bool = False):
+        """
+        CKKS context for an enrichment session. By default every call
+        generates a fresh key pair. With reuse_keys, one warm context is
+        kept and shared by every session and peer that asks for reuse: this
+        saves the key generation (the Galois keys dominate it) but ties
+        every session to the same secret key. A peer could then link
+        sessions by the public key, replay ciphertexts from an earlier
+        session, and a leaked key would expose all of them.
+        """
+        from encryption import Encryption
+
+        if not reuse_keys:
+            return Encryption()
+        return self.get("encryption", Encryption)
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._resources)
+
+    def release(self, *names: str):
+        """
+        Drop the given resources (all of them if no name is given) so their
+        memory can be reclaimed, e.g. when the app is under memory pressure.
+        They are created again on next use.
+        """
+        with self._lock:
+            for name in names or list(self._resources):
+                resource = self._resources.pop(name, None)
+                backend = getattr(resource, "embedding_bridge", None)
+                if hasattr(backend, "close"):
+                    backend.close()
+        gc.collect()
+
+
+# Create a global resource manager instance
+resources = ResourceManager()
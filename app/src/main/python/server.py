@@ -8,16 +8,55 @@ from tenseal import Context
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from graph import Graph, Vertex, Entity, Edge
 import pickle
-from typing import Dict, List, Tuple, Optional
-from embedding_helper import EmbeddingHelper
+import numpy as np
+from typing import Dict, List, Tuple, Optional, Union
 from tenseal import CKKSVector
-from mock_predictor import MockLLMPredictor
-# from predictor import LLMPredictor
-from util import get_random_mask, sum_values, merge_subgraph, remove_duplicate_vertices_by_label_and_edge_label, get_graph
-
+from encryption import PackedVertex, length_weighted_path
+from metrics import Metrics
+from resources import resources
+from util import get_random_mask, merge_matched_subgraphs, remove_duplicate_vertices_by_label_and_edge_label, get_graph, receive_exactly, receive_upload, send_message, MSG_END, get_files_dir
+
+import os
+import selectors
+import threading
 import time
 import json
 
+class Session(threading.local):
+    """
+    Per-peer state of an enrichment session: the peer's CKKS context and
+    vertices (CKKSVector or PackedVertex), the server embeddings encrypted
+    under it (and their plaintext, by ciphertext), a copy of the
+    profile to match against, the match caches, its Metrics, and the
+    h_v threshold sigma and random mask that blind what the peer decrypts
+    (drawn per session, so peers cannot relate their results).
+
+    The object is thread-local, so sessions that serve() runs on separate
+    threads never see each other's state; main() runs a single session on
+    the calling thread.
+    """
+    def start(self, profile: Graph):
+        self.metrics = Metrics()
+        self.cache = {}
+        self.hv_cache = {}
+        self.ecache = {}
+        self.context = None
+        self.client_encrypt_map = {}
+        self.encrypt_map_server = {}
+        self.plain_map_server = {}
+        self.user_profile = profile
+        self.vertices = profile.vertices
+        self.mask = get_random_mask(1, 2, False)
+        self.sigma = 0.95
+
+session = Session()
+# guards the shared user_profile and model.embed_map across sessions
+profile_lock = threading.RLock()
+# the shared predictor may call into Java (not thread-safe, GIL released),
+# so concurrent sessions predict one at a time; the embedder is guarded by
+# EmbeddingHelper itself
+predictor_lock = threading.Lock()
+
 # def log_with_time(msg):
 #     now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 #     print(f"[{now}] {msg}")
@@ -32,91 +71,65 @@ def get_client_sub_graph(client_uri: str, decryption_socket: socket) -> Graph:
     client_uri_bytes = client_uri.encode()
     response_bytes = struct.pack("!I", len(client_uri_bytes)) + struct.pack("!I", 4) + client_uri_bytes
 
-    if "Get Client Sub Graph" in bytes_sent_dict:
-        bytes_sent_dict["Get Client Sub Graph"].append(len(response_bytes))
-    else:
-        bytes_sent_dict["Get Client Sub Graph"] = [len(response_bytes)]
-
+    session.metrics.sent("Sub Graph", len(response_bytes))
     decryption_socket.sendall(response_bytes)
-    response = receive_full_message(decryption_socket)
-    return pickle.loads(response)
-
-
-def h_v(vec1: CKKSVector, vec2: CKKSVector, decryption_socket: socket):
-    start = time.time()
+    response = receive_full_message(decryption_socket, "Sub Graph")
+    # the client sends a LineageView
+    return pickle.loads(response).to_graph()
 
-    if (vec1, vec2) in hv_cache:
-        end = time.time()
-        total_time = end - start
 
-        if "Vertex Similarity" in times_dict:
-            times_dict["Vertex Similarity"].append(total_time)
-        else:
-            times_dict["Vertex Similarity"] = [total_time]
+def h_v(vec1: CKKSVector, vec2: Union[CKKSVector, PackedVertex], decryption_socket: socket):
+    start = time.perf_counter_ns()
 
-        return hv_cache[(vec1, vec2)]
+    if (vec1, vec2) in session.hv_cache:
+        session.metrics.incr("h_v cache hits")
+        session.metrics.add_time("Vertex Similarity", time.perf_counter_ns() - start)
+        return session.hv_cache[(vec1, vec2)]
 
-    m_v = (vec1.dot(vec2) - sigma) * mask
+    if isinstance(vec2, PackedVertex):
+        # the server side of the product is this session's plaintext embedding of vec1
+        dot = vec2.dot(session.plain_map_server[vec1])
+    else:
+        dot = vec1.dot(vec2)
+    m_v = (dot - session.sigma) * session.mask
     m_v_bytes = pickle.dumps(m_v.serialize())
 
     response_bytes = struct.pack("!I", len(m_v_bytes) ) + struct.pack("!I", 1) + m_v_bytes
 
-    if "Vertex Similarity" in bytes_sent_dict:
-        bytes_sent_dict["Vertex Similarity"].append(len(response_bytes))
-    else:
-        bytes_sent_dict["Vertex Similarity"] = [len(response_bytes)]
-
+    session.metrics.sent("Vertex Similarity", len(response_bytes))
     decryption_socket.sendall(response_bytes)
 
-    response = decryption_socket.recv(4)
-    bytes_rec_list.append(4)
-
-    if not response:
+    response = receive_exactly(decryption_socket, 4)
+    if response is None:
         return None
+    session.metrics.received("Vertex Similarity", 4)
 
     response_bool = bool(struct.unpack("!I", response)[0])
-    end = time.time()
-    total_time = end - start
-
-    if "Vertex Similarity" in times_dict:
-        times_dict["Vertex Similarity"].append(total_time)
-    else:
-        times_dict["Vertex Similarity"] = [total_time]
+    session.metrics.add_time("Vertex Similarity", time.perf_counter_ns() - start)
 
-    hv_cache[(vec1, vec2)] = response_bool
+    session.hv_cache[(vec1, vec2)] = response_bool
 
     return response_bool
 
-def h_p(path1: CKKSVector, path1_len: CKKSVector, path2: CKKSVector, path2_len: CKKSVector, decryption_socket: socket) -> float:
-    # m_p = ((path1.dot(path2) * (1.0/(path1_len + path2_len))) - delta) * mask
-    start = time.time()
-    m_p = (path1.dot(path2)) * (0.25 * (path1_len + path2_len))
-    # randomize the result
-    m_p = m_p * mask
-    # print(f"MP: {m_p.decrypt()[0]}")
-    # print(f'Dot: {path1.dot(path2).decrypt()[0]}')
+def h_p(path1: np.ndarray, path2: CKKSVector, decryption_socket: socket) -> float:
+    # m_p = path1.dot(path2) * 0.25 * (1/len1 + 1/len2) * mask, with path1 the server's plaintext
+    # length_weighted_path and path2 the client's path_with_length: one plaintext dot product
+    start = time.perf_counter_ns()
+    m_p = path2.dot(((0.25 * session.mask) * path1).tolist())
     m_p_bytes = pickle.dumps(m_p.serialize())
 
     response_bytes = struct.pack("!I", len(m_p_bytes)) + struct.pack("!I", 3) + m_p_bytes
 
-    if "Path Similarity" in bytes_sent_dict:
-        bytes_sent_dict["Path Similarity"].append(len(response_bytes))
-    else:
-        bytes_sent_dict["Path Similarity"] = [len(response_bytes)]
-
+    session.metrics.sent("Path Similarity", len(response_bytes))
     decryption_socket.sendall(response_bytes)
 
-    response = decryption_socket.recv(8)
-    bytes_rec_list.append(8)
+    response = receive_exactly(decryption_socket, 8)
+    if response is None:
+        raise ConnectionError("client closed the connection during Path Similarity")
+    session.metrics.received("Path Similarity", 8)
     response = struct.unpack('d', response)[0]
     # print(f'Response: {response}')
-    end = time.time()
-    total_time = end - start
-
-    if "Path Similarity" in times_dict:
-        times_dict["Path Similarity"].append(total_time)
-    else:
-        times_dict["Path Similarity"] = [total_time]
+    session.metrics.add_time("Path Similarity", time.perf_counter_ns() - start)
 
     return response
 
@@ -128,39 +141,32 @@ def r_p(path: List[Vertex]) -> float:
 
     return product
 
-def receive_full_message(conn):
-    """Receives a message with a fixed-length header."""
-    msg_len_data = conn.recv(4)  # Get the first 4 bytes (message length)
+def receive_full_message(conn, msg: str):
+    """Receives a message with a fixed-length header, counted as a reply to msg."""
+    msg_len_data = receive_exactly(conn, 4)  # Get the first 4 bytes (message length)
 
-    if not msg_len_data:
+    if msg_len_data is None:
         return None
     msg_len = struct.unpack("!I", msg_len_data)[0]  # Unpack message length
 
-    total_bytes_rec = 4 + msg_len
-    bytes_rec_list.append(total_bytes_rec)
+    session.metrics.received(msg, 4 + msg_len)
 
     # Receive the full message
-    msg = b""
-    while len(msg) < msg_len:
-        msg_packet = conn.recv(msg_len - len(msg))
-        if not msg_packet:
-            return None
-        msg += msg_packet
-    return msg
+    return receive_exactly(conn, msg_len)
 
 def get_vertex_object(v_uri: str) -> Optional[Vertex]:
-        for v in vertices:
+        for v in session.vertices:
             if v.uri == v_uri:
                 return v
         return None
 
 def h_r(vec1: CKKSVector, k) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
-    start = time.time()
+    start = time.perf_counter_ns()
     P = []
     scores = []
     edges = []
-    vec1_uri = list(encrypt_map_server.keys())[list(encrypt_map_server.values()).index(vec1)]
-    list_edges = user_profile.get_edges(get_vertex_object(vec1_uri))
+    vec1_uri = list(session.encrypt_map_server.keys())[list(session.encrypt_map_server.values()).index(vec1)]
+    list_edges = session.user_profile.get_edges(get_vertex_object(vec1_uri))
     
     for edge in list_edges:
         p = [edge.v1, edge.v2]
@@ -173,8 +179,9 @@ def h_r(vec1: CKKSVector, k) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
             if chosen_edge.v2.outward_degree == 0:
                 break
 
-            candidate_edges = user_profile.get_edges(chosen_edge.v2)
-            prediction = predictor.predict(chosen_edge.label, [word.label for word in candidate_edges])
+            candidate_edges = session.user_profile.get_edges(chosen_edge.v2)
+            with predictor_lock:
+                prediction = predictor.predict(chosen_edge.label, [word.label for word in candidate_edges])
             predicted_labels = prediction.split()  # ["apple", "banana", "cherry"]
 
             # if prediction == predictor.eos_token:
@@ -197,57 +204,59 @@ def h_r(vec1: CKKSVector, k) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
 
     sorted_paths = [k for _, k in sorted(zip(scores, P), reverse=True, key=lambda pair: pair[0])]
     sorted_edges = [k for _, k in sorted(zip(scores, edges), reverse=True, key=lambda pair: pair[0])]
-    end = time.time()
-    total_time = end - start
-    if "Top-K Paths" in times_dict:
-        times_dict["Top-K Paths"].append(total_time)
-    else:
-        times_dict["Top-K Paths"] = [total_time]
+    session.metrics.add_time("Top-K Paths", time.perf_counter_ns() - start)
 
     return sorted_paths[:k], sorted_edges[:k]
 
 def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str, delta, k, decryption_socket: socket) -> bool:
-    start = time.time()
+    # one span per pair when tracing; recursive matches are nested spans
+    with session.metrics.span("ParaMatch", server=vec1_uri, client=vec2_uri) as span:
+        match = _para_match(vec1, vec1_uri, vec2, vec2_uri, delta, k, decryption_socket)
+        span.set("match", bool(match))
+        return match
+
+def _para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str, delta, k, decryption_socket: socket) -> bool:
+    start = time.perf_counter_ns()
     if not h_v(vec1, vec2, decryption_socket):
-        cache[(vec1_uri, vec2_uri)] = [False, []]
+        session.cache[(vec1_uri, vec2_uri)] = [False, []]
         return False
-    vertex = user_profile.lookup(vec1_uri)
+    vertex = session.user_profile.lookup(vec1_uri)
     if type(vertex) != Vertex:
         return False
 
     if vertex.outward_degree == 0:
-        cache[(vec1_uri, vec2_uri)] = [True, []]
+        session.cache[(vec1_uri, vec2_uri)] = [True, []]
         return True
 
-    cache[(vec1_uri, vec2_uri)] = [True, []]
+    session.cache[(vec1_uri, vec2_uri)] = [True, []]
     W = []
     sum = 0
 
-    V_server = []
-    V_client = []
-
-    if vec1 not in ecache:
+    # paths of both vertices, keyed by URI, so each vertex's top-k paths are
+    # computed (or requested from the client) once per session
+    if vec1_uri not in session.ecache:
+        V_server = []
         paths, edges = h_r(vec1, k)
-        server_paths: List[List[CKKSVector]] = [[encrypt_map_server[x.uri] for x in path] for path in paths]
+        server_paths: List[List[CKKSVector]] = [[session.encrypt_map_server[x.uri] for x in path] for path in paths]
         server_uris = [[x.uri for x in path] for path in paths]
-        server_lengths = [ts.ckks_vector(context, [1/len(path)]) for path in paths]
-        server_edges: List[CKKSVector] = [model.encrypt_path(context, model.encode_path(x)) for x in edges]
+        # plaintext: h_p multiplies them into the client's path ciphertexts
+        server_edges: List[np.ndarray] = [length_weighted_path(x, len(path)) for x, path in
+                                          zip(model.normalized_matrix(list(model.encode_paths(edges))), paths)]
 
         for path in paths:
             uri = path[1].uri
-            V_server.append((uri, encrypt_map_server[uri]))
-        ecache[vec1_uri] = V_server
+            V_server.append((uri, session.encrypt_map_server[uri]))
+        session.ecache[vec1_uri] = (V_server, server_paths, server_edges)
+    V_server, server_paths, server_edges = session.ecache[vec1_uri]
 
-    if vec2 not in ecache:
+    if vec2_uri not in session.ecache:
+        V_client = []
         k_serialized = struct.pack("!I", k)
         h_r_client_map = {"Vector": vec2_uri, "K": k_serialized}
         h_r_client_bytes = pickle.dumps(h_r_client_map)
         response_bytes = struct.pack("!I", len(h_r_client_bytes)) + struct.pack("!I", 2) + h_r_client_bytes
 
-        if "Top-K Paths" in bytes_sent_dict:
-            bytes_sent_dict["Top-K Paths"].append(len(response_bytes))
-        else:
-            bytes_sent_dict["Top-K Paths"] = [len(response_bytes)]
+        session.metrics.sent("Top-K Paths", len(response_bytes))
 
         try:
             decryption_socket.sendall(response_bytes)
@@ -255,7 +264,7 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
             print(f"[para_match] Error sending request for {vec2_uri}: {e}")
             return False
 
-        msg = receive_full_message(decryption_socket)
+        msg = receive_full_message(decryption_socket, "Top-K Paths")
         if msg is None:
             print(f"[para_match] No response received from client for {vec2_uri}")
             return False
@@ -269,21 +278,18 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
 
         client_paths = []
         client_edges = []
-        client_lengths = []
         client_uris = paths_edges_uris_map["URIs"]
         for path in paths_edges_uris_map["Vectors"]:
-            client_paths.append(ts.ckks_vector_from(context, path))
+            client_paths.append(ts.ckks_vector_from(session.context, path))
 
         for edge in paths_edges_uris_map["Edges"]:
-            client_edges.append(ts.ckks_vector_from(context, edge))
-
-        for length in paths_edges_uris_map["Length"]:
-            client_lengths.append(ts.ckks_vector_from(context, length))
+            client_edges.append(ts.ckks_vector_from(session.context, edge))
 
         for i in range(0, len(client_paths)):
             V_client.append((client_uris[i], client_paths[i]))
 
-        ecache[vec2_uri] = V_client
+        session.ecache[vec2_uri] = (V_client, client_paths, client_edges)
+    V_client, client_paths, client_edges = session.ecache[vec2_uri]
 
     L = {}
     max_score = 0
@@ -295,7 +301,7 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
             client_prime_uri, client_prime_vec = V_client[c_index]
             if h_v(server_prime_vec, client_prime_vec, decryption_socket):
                 l_u_prime.append((client_prime_uri, client_prime_vec))
-                score = h_p(server_edges[s_index], server_lengths[s_index], client_edges[c_index], client_lengths[c_index], decryption_socket)
+                score = h_p(server_edges[s_index], client_edges[c_index], decryption_socket)
                 scores.append(score)
         sorted_l_u_prime = [k for _, k in sorted(zip(scores, l_u_prime), reverse=True, key=lambda pair: pair[0])]
         scores = sorted(scores)
@@ -305,13 +311,13 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
             L[(server_prime_uri, server_prime_vec)] = sorted_l_u_prime
 
     if max_score < delta:
-        cache[(vec1_uri, vec2_uri)] = [False, []]
+        session.cache[(vec1_uri, vec2_uri)] = [False, []]
         return False
 
     for server_prime_uri, server_prime_vec in V_server:
         for client_prime_uri, client_prime_vec in L[(server_prime_uri, server_prime_vec)]:
-            if (server_prime_uri, client_prime_uri) in cache:
-                match = cache[(server_prime_uri, client_prime_uri)][0]
+            if (server_prime_uri, client_prime_uri) in session.cache:
+                match = session.cache[(server_prime_uri, client_prime_uri)][0]
             else:
                 match = para_match(server_prime_vec, server_prime_uri, client_prime_vec, client_prime_uri, delta, k, decryption_socket)
             if match:
@@ -321,19 +327,17 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
                         break
                     index += 1
                 server_path = server_edges[index]
-                p1_length = server_lengths[index]
 
                 index = 0
                 for path in client_paths:
                     if path == client_prime_vec:
                         break
                     index += 1
-                p2_length = client_lengths[index]
                 client_path = client_edges[index]
-                sum += h_p(server_path, p1_length, client_path, p2_length, decryption_socket)
+                sum += h_p(server_path, client_path, decryption_socket)
                 W.append((server_prime_uri, client_prime_uri))
                 if sum > delta:
-                    cache[(vec1_uri, vec2_uri)] = [True, W]
+                    session.cache[(vec1_uri, vec2_uri)] = [True, W]
                     return True
                 break
 
@@ -343,7 +347,6 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
                     break
                 index += 1
             server_path = server_edges[index]
-            p1_length = server_lengths[index]
 
             index = 0
             for path in client_paths:
@@ -351,8 +354,7 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
                     break
                 index += 1
             client_path = client_edges[index]
-            p2_length = client_lengths[index]
-            max_score -= h_p(server_path, p1_length, client_path, p2_length, decryption_socket)
+            max_score -= h_p(server_path, client_path, decryption_socket)
 
             for client_prime_n_uri, client_prime_n_vec in L[(server_prime_uri, server_prime_vec)]:
                 if client_prime_n_uri != client_prime_uri:
@@ -362,193 +364,273 @@ def para_match(vec1: CKKSVector, vec1_uri: str, vec2: CKKSVector, vec2_uri: str,
                             break
                         index += 1
                     client_path = client_edges[index]
-                    p2_length = client_lengths[index]
 
-                    max_score += h_p(server_path, p1_length, client_path, p2_length, decryption_socket)
+                    max_score += h_p(server_path, client_path, decryption_socket)
 
             if max_score < delta:
                 break
 
-    cache[(vec1_uri, vec2_uri)] = [False, []]
+    session.cache[(vec1_uri, vec2_uri)] = [False, []]
 
-    for server_p_uri, client_p_uri in cache:
-        if (vec1_uri, vec2_uri) in cache[(server_p_uri, client_p_uri)][1]:
-            del cache[(server_p_uri, client_p_uri)]
-            para_match(encrypt_map_server[server_p_uri], server_p_uri, client_encrypt_map[client_p_uri], client_p_uri, delta, k, decryption_socket)
+    for server_p_uri, client_p_uri in session.cache:
+        if (vec1_uri, vec2_uri) in session.cache[(server_p_uri, client_p_uri)][1]:
+            del session.cache[(server_p_uri, client_p_uri)]
+            para_match(session.encrypt_map_server[server_p_uri], server_p_uri, session.client_encrypt_map[client_p_uri], client_p_uri, delta, k, decryption_socket)
 
-    end = time.time()
-    total_time = end - start
-    if "ParaMatch" in times_dict:
-        times_dict["ParaMatch"].append(total_time)
-    else:
-        times_dict["ParaMatch"] = [total_time]
+    session.metrics.add_time("ParaMatch", time.perf_counter_ns() - start)
     return False
 
-def main(dataset_path, java_context, decryption_host, port=65432, progress_callback=None):
-    global cache, context, model,user_profile, times_dict, bytes_sent_dict, bytes_rec_list, encrypt_map_server, hv_cache, mask, ecache, client_encrypt_map, predictor, sigma, delta, vertices
-    times_dict = {}
-    bytes_sent_dict = {}
-    bytes_rec_list = []
-    hv_cache = {}
-    cache = {}
-    host = "0.0.0.0"
-    user_profile = get_graph(dataset_path, "g1")
-    original_vertex_uris = set(v.uri for v in user_profile.vertices)
+def load_server_state(dataset_path, java_context, progress_callback=None) -> Metrics:
+    """
+    Load the state shared by every session: the profile, the sentence
+    transformer, the predictor and the profile embeddings.
+
+    Returns:
+        Metrics: Time spent per initialization step
+    """
+    global model, user_profile, predictor, delta
+    init_metrics = Metrics()
+    user_profile = get_graph(dataset_path, "g1", use_snapshot=True)
 
     # ====== Initialization ======
     if progress_callback:
         progress_callback.onProgressUpdate(0, "Server: Initializing...")
 
-    start = time.time()
-    model = EmbeddingHelper(java_context)
-    end = time.time()
-    times_dict["Initialize Sentence Transformer"] = end-start
+    with init_metrics.timer("Initialize Sentence Transformer"):
+        model = resources.embedding_helper(java_context)
 
-    start = time.time()
-    # predictor = LLMPredictor(context)
-    predictor = MockLLMPredictor(java_context)
-    end = time.time()
-    times_dict["Initialize LLM"] = end - start
+    with init_metrics.timer("Initialize LLM"):
+        predictor = resources.predictor(java_context)
 
-    vertices = user_profile.vertices
+    with init_metrics.timer("Compute Embeddings"):
+        model.encode_embedding(user_profile.vertices)
 
-    start = time.time()
-    model.encode_embedding(vertices)
-    end = time.time()
-    times_dict["Compute Embeddings"] = end - start
-
-    mask = get_random_mask(1, 2, False)
-    sigma = 0.95
     delta = 0.2
+    return init_metrics
+
+def run_session(conn, progress_callback=None) -> Optional[Tuple[Dict[str, List[str]], Dict[str, Graph]]]:
+    """
+    Receive a peer's encrypted vertices on conn and run VParaMatch against a
+    copy of the profile, sending the decryption requests back over conn.
+
+    Returns:
+        (PI ordered by outward degree, client URI -> client lineage subgraph),
+        or None if the peer closed the connection before its upload
+    """
+    with profile_lock:
+        session.start(user_profile.copy())
+        embed_map = dict(model.embed_map)
+
+    start_time = time.perf_counter_ns()
+    data = receive_upload(conn)
+    if data is None:
+        print("log: client closed the connection before uploading its vertices")
+        return None
+    session.metrics.received("Context and Vertices", 8 + len(data))
+    serialized_encrypt_map_client = pickle.loads(data)
+    if isinstance(serialized_encrypt_map_client, Dict):
+        print('Received encryption')
+    else:
+        print('Data corrupted')
+    session.context = ts.context_from(data=serialized_encrypt_map_client['Context'])
+    # encrypted under this peer's context, so not shared with other sessions
+    with session.metrics.timer("Encryption"):
+        session.encrypt_map_server = model.encrypt_embeddings(session.context, normalize = True, embed_map = embed_map)
+    uris = list(session.encrypt_map_server)
+    matrix = model.normalized_matrix([embed_map[uri] for uri in uris])
+    session.plain_map_server = {session.encrypt_map_server[uri]: row for uri, row in zip(uris, matrix)}
+    if 'Packed' in serialized_encrypt_map_client:
+        # several client vertices per ciphertext, see PackedVertex
+        packed = serialized_encrypt_map_client['Packed']
+        vectors = [ts.ckks_vector_from(session.context, vec) for vec in packed['Vectors']]
+        for uri, (index, offset) in packed['Offsets'].items():
+            session.client_encrypt_map[uri] = PackedVertex(vectors[index], offset, matrix.shape[1])
+    else:
+        for uri, vec in serialized_encrypt_map_client['Vertices'].items():
+            session.client_encrypt_map[uri] = ts.ckks_vector_from(session.context, vec)
+    # requests go out on the peer's own connection
+    decryption_socket = conn
+    PI = {}
+    expected_count = len(session.encrypt_map_server)
+    print(f'log: expected_count {len(session.encrypt_map_server)}')
+    progress_count = 0
+    # a span (and a PKGEM_PROFILE phase) for the matching itself
+    with session.metrics.span("VParaMatch"):
+        for uri_server, vec_server in session.encrypt_map_server.items():
+            # print(f'log: for uri_server {uri_server}')
+            PI[uri_server] = []
+            session.cache = {}
+
+            def check_client(uri_client, vec_client):
+            # first h_v check
+                if not h_v(vec_server, vec_client, decryption_socket):
+                    return None
+
+                # cache hit?
+                if session.cache.get((uri_server, uri_client), (False,))[0]:
+                    return uri_client
+
+                # do the expensive match
+                match = para_match(
+                    vec_server,
+                    uri_server,
+                    vec_client,
+                    uri_client,
+                    delta,
+                    3,
+                    decryption_socket
+                )
+                # para_match stores [match, W] itself; W is what invalidates the entry later
+                session.cache.setdefault((uri_server, uri_client), [bool(match), []])
+
+                return uri_client if match else None
+
+
+            for uri_client, vec_client in session.client_encrypt_map.items():
+                result = check_client(uri_client, vec_client)
+                if result is not None:
+                    PI[uri_server].append(result)
+            progress_count += 1
+            current_progress = progress_count / expected_count
+            if progress_callback:
+                progress_callback.onProgressUpdate(int(current_progress * 100), f"Server: Computing...")
+    PI_ordered = dict(sorted(PI.items(), key = lambda item: session.user_profile.lookup(item[0]).outward_degree, reverse=True))
+    session.metrics.add_time("VParaMatch", time.perf_counter_ns() - start_time)
+    print(f"PI Ordered: {PI_ordered}")
+    # fetch each matched client lineage once
+    with session.metrics.timer("Fetch Sub Graphs"):
+        client_sub_graphs = {}
+        for client_uris in PI_ordered.values():
+            for client_uri in client_uris:
+                if client_uri not in client_sub_graphs:
+                    client_sub_graphs[client_uri] = get_client_sub_graph(client_uri, decryption_socket)
+    return PI_ordered, client_sub_graphs
+
+def enrich_profile(PI_ordered: Dict[str, List[str]], client_sub_graphs: Dict[str, Graph], output_file: str) -> int:
+    """
+    Merge the lineages matched in one session into the shared profile, save
+    it, and embed the new vertices for the sessions that start afterwards.
+    Sessions are merged one at a time.
+
+    Returns:
+        int: Number of vertices this session added to the profile
+    """
+    with profile_lock:
+        original_vertex_uris = set(v.uri for v in user_profile.vertices)
+        merge_times = merge_matched_subgraphs(user_profile, PI_ordered, client_sub_graphs)
+        session.metrics.add_time("Merge Index", round(merge_times["Index"] * 1e9))
+        session.metrics.add_time("Merge Sub Graphs", round(merge_times["Merge"] * 1e9))
+
+        # Remove duplicate vertices before saving
+        with session.metrics.timer("Remove Duplicates"):
+            remove_duplicate_vertices_by_label_and_edge_label(user_profile)
 
-    hv_cache = {}
+        user_profile.print_graph()
 
-    ecache = {}
+        # save the result to a file
+        user_profile.save_cytoscape_json(output_file)
+        user_profile.save_snapshot(os.path.splitext(output_file)[0] + ".pkgs")
 
-    progress_count = 0
+        with session.metrics.timer("Update Embeddings"):
+            model.update_embeddings(user_profile.vertices)
+        return user_profile.get_newly_added_vertices_count(original_vertex_uris)
+
+def _handle_peer(conn, output_file, progress_callback=None, init_metrics: Optional[Metrics] = None,
+                 trace_name: str = "server") -> Optional[dict]:
+    with conn:
+        start_time = time.perf_counter_ns()
+        matched = run_session(conn, progress_callback)
+        if matched is None:
+            return None
+        PI_ordered, client_sub_graphs = matched
+        enrichment_start_time = time.perf_counter_ns()
+        enriched_node_count = enrich_profile(PI_ordered, client_sub_graphs, output_file)
+        end_time = time.perf_counter_ns()
+        session.metrics.add_time("Enrichment", end_time - enrichment_start_time)
+        total_time = (end_time - start_time) / 1e9
+        session.metrics.sent("End", send_message(conn, MSG_END))
+        if init_metrics is not None:
+            session.metrics.merge(init_metrics)
+        session.metrics.save_trace(os.path.dirname(output_file), trace_name)
+
+        return {
+            "total_time": total_time,
+            "total_bytes_received": session.metrics.bytes_received(),
+            "enriched_node_count": enriched_node_count,
+            "graph_path": output_file,
+            "metrics": session.metrics.summary()
+        }
+
+def main(dataset_path, java_context, decryption_host=None, port=65432, progress_callback=None):
+    # decryption_host is no longer used: requests go back over the client's connection
+    host = "0.0.0.0"
+    init_metrics = load_server_state(dataset_path, java_context, progress_callback)
+    output_file = os.path.join(get_files_dir(java_context), "graph.json")
 
-    client_encrypt_map = {}
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind((host, port))
         s.listen()
         conn, addr = s.accept()
-        with conn:
-            start_time = time.time()
-            data = []
-            total_bytes = 0
-            while True:
-                packet = conn.recv(4096)
-                if not packet:
-                    break
-                data.append(packet)
-                total_bytes += len(packet)
-            bytes_rec_list.append(len(b"".join(data)))
-            serialized_encrypt_map_client = pickle.loads(b"".join(data))
-            if isinstance(serialized_encrypt_map_client, Dict):
-                print('Received encryption')
-            else:
-                print('Data corrupted')
-            context = ts.context_from(data=serialized_encrypt_map_client['Context'])
-            vertex_embedding_client = None
-            uri_client = None
-            for uri, vec in serialized_encrypt_map_client['Vertices'].items():
-                uri_client = uri
-                vertex_embedding_client = ts.ckks_vector_from(context, vec)
-                client_encrypt_map[uri_client] = vertex_embedding_client
-            encryption_start_time = time.time()
-            encrypt_map_server = model.encrypt_embeddings(context, normalize = True)
-            encryption_end_time = time.time()
-            times_dict["Encryption"] = encryption_end_time - encryption_start_time
-            decryption_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            decryption_socket.connect((decryption_host, port + 10))
-            PI = {}
-            C = {}
-            expected_count = len(encrypt_map_server)
-            print(f'log: expected_count {len(encrypt_map_server)}')
-            progress_count = 0
-            for uri_server, vec_server in encrypt_map_server.items():
-                # print(f'log: for uri_server {uri_server}')
-                PI[uri_server] = []
-                C[uri_server] = []
-                cache = {}
-                
-
-                def check_client(uri_client, vec_client):
-                # first h_v check
-                    if not h_v(vec_server, vec_client, decryption_socket):
-                        return None
-
-                    # cache hit?
-                    if cache.get((uri_server, uri_client), (False,))[0]:
-                        return uri_client
-
-                    # do the expensive match
-                    match = para_match(
-                        vec_server,
-                        uri_server,
-                        vec_client,
-                        uri_client,
-                        delta,
-                        3,
-                        decryption_socket
-                    )
-                    cache[(uri_server, uri_client)] = (bool(match),)
-
-                    return uri_client if match else None
-
-
-                for uri_client, vec_client in client_encrypt_map.items():
-                    result = check_client(uri_client, vec_client)
-                    if result is not None:
-                        PI[uri_server].append(result)
-                progress_count += 1
-                current_progress = progress_count / expected_count
-                if progress_callback:
-                    progress_callback.onProgressUpdate(int(current_progress * 100), f"Server: Computing...")
-            PI_ordered = dict(sorted(PI.items(), key = lambda item: user_profile.lookup(item[0]).outward_degree, reverse=True))
-            v_para_match_end = time.time()
-            times_dict["VParaMatch"] = v_para_match_end - start_time
-            print(f"PI Ordered: {PI_ordered}")
-            enrichment_start_time = time.time()
-            for uri_server in PI_ordered:
-                # print(f'log: before merge_subgraph for {uri_server}')
-                graph_map = {}
-                for client_uri in PI_ordered[uri_server]:
-                    client_sub_graph = get_client_sub_graph(client_uri, decryption_socket)
-                    client_vertex = client_sub_graph.lookup(client_uri)
-                    server_vertex = user_profile.lookup(uri_server)
-                    merge_subgraph(client_sub_graph, client_vertex, user_profile, server_vertex)
-                # print(f'log: after merge_subgraph for {uri_server}')
-            try:
-                decryption_socket.close()
-            except Exception as e:
-                print(f"Error during decryption_socket close: {e}")
+        # Return the required values
+        return _handle_peer(conn, output_file, progress_callback, init_metrics)
+
+def serve(dataset_path, java_context, port=65432, progress_callback=None, max_sessions=None, should_stop=None) -> List[dict]:
+    """
+    Long-running enrichment server for a hub that enriches against several
+    peers. The profile, embedder and predictor are loaded once and shared;
+    every accepted peer runs its own session on a separate thread (see
+    Session), and its results are merged into the shared profile as soon as
+    its matching is done. Every session's metrics include the shared
+    initialization timings, as main's do.
+
+    Only the encrypted server supports this: server_unencrypted keeps its
+    session state in module globals and serves one peer per main() call.
+
+    Args:
+        max_sessions: Stop accepting after this many peers (None: no limit)
+        should_stop: Polled about once a second; the server stops accepting
+            peers once it returns True
+
+    Returns:
+        List[dict]: main's result dict for every finished session
+    """
+    host = "0.0.0.0"
+    init_metrics = load_server_state(dataset_path, java_context, progress_callback)
+    output_file = os.path.join(get_files_dir(java_context), "graph.json")
 
-            # Remove duplicate vertices before saving
-            remove_duplicate_vertices_by_label_and_edge_label(user_profile)
+    results = []
+    threads = []
 
-            user_profile.print_graph()
-            
-            # save the result to a file
-            import os
-            output_file = os.path.join(java_context.getFilesDir().getAbsolutePath(), "graph.json")
-            user_profile.save_cytoscape_json(output_file)
-            
-            enrichment_end_time = time.time()
-            end_time = time.time()
-            total_time = end_time - start_time
-            times_dict["Enrichment"] = enrichment_end_time - enrichment_start_time
-            data = struct.pack("!I", 0)
-            bytes_sent_dict["End"] = 4
-            conn.sendall(data)
-            total_bytes_sent = sum_values(bytes_sent_dict)
-            total_bytes_received = sum(bytes_rec_list)
-            enriched_node_count = user_profile.get_newly_added_vertices_count(original_vertex_uris)
-
-            # Return the required values
-            return {
-                "total_time": total_time,
-                "total_bytes_received": total_bytes_received,
-                "enriched_node_count": enriched_node_count,
-                "graph_path": output_file
-            }
\ No newline at end of file
+    def handle(conn, addr, index):
+        try:
+            result = _handle_peer(conn, output_file, progress_callback, init_metrics,
+                                  trace_name=f"server-{index}")
+            if result is not None:
+                results.append(result)
+        except Exception as e:
+            print(f"Error in session with {addr[0]}: {e}")
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s, selectors.DefaultSelector() as selector:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((host, port))
+        s.listen()
+        s.setblocking(False)
+        selector.register(s, selectors.EVENT_READ)
+        while max_sessions is None or len(threads) < max_sessions:
+            if should_stop is not None and should_stop():
+                break
+            if not selector.select(timeout=1.0):
+                continue
+            try:
+                conn, addr = s.accept()
+            except BlockingIOError:
+                continue
+            conn.setblocking(True)
+            print(f"log: session {len(threads) + 1} with {addr[0]}")
+            thread = threading.Thread(target=handle, args=(conn, addr, len(threads) + 1), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    return results
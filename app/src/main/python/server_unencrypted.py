@@ -6,11 +6,10 @@ import datetime
 from graph import Graph, Vertex, Entity, Edge
 import pickle
 from typing import Dict, List, Tuple, Optional
-from embedding_helper import EmbeddingHelper
-from mock_predictor import MockLLMPredictor
+from resources import resources
 import numpy as np
-# from predictor import LLMPredictor
-from util import get_random_mask, sum_values, merge_subgraph, remove_duplicate_vertices_by_label_and_edge_label, get_graph
+from metrics import Metrics
+from util import get_random_mask, merge_matched_subgraphs, remove_duplicate_vertices_by_label_and_edge_label, get_graph, receive_exactly, receive_upload, send_message, MSG_END, get_files_dir
 
 import time
 import json
@@ -19,6 +18,20 @@ import json
 #     now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 #     print(f"[{now}] {msg}")
 
+metrics = Metrics()
+
+# h_v of every (server, client) vertex pair, see compute_vertex_similarities
+hv_matrix = None
+server_rows = {}
+client_cols = {}
+
+# Fragment-parallel matching state (see fragment_parallel_match). Workers
+# set fragment_vertices to the URIs they own; None matches the whole profile.
+client_top_k_paths = {}
+fragment_vertices = None
+border_results = {}
+border_requests = set()
+
 # Find the matching key
 def find_key_by_value(dictionary, target_array):
     for key, value in dictionary.items():
@@ -36,47 +49,57 @@ def get_client_sub_graph(client_uri: str, decryption_socket: socket) -> Graph:
     client_uri_bytes = client_uri.encode()
     response_bytes = struct.pack("!I", len(client_uri_bytes)) + struct.pack("!I", 4) + client_uri_bytes
 
-    if "Get Client Sub Graph" in bytes_sent_dict:
-        bytes_sent_dict["Get Client Sub Graph"].append(len(response_bytes))
-    else:
-        bytes_sent_dict["Get Client Sub Graph"] = [len(response_bytes)]
-
+    metrics.sent("Sub Graph", len(response_bytes))
     decryption_socket.sendall(response_bytes)
-    response = receive_full_message(decryption_socket)
-    return pickle.loads(response)
+    response = receive_full_message(decryption_socket, "Sub Graph")
+    # the client sends a LineageView
+    return pickle.loads(response).to_graph()
 
 
 def h_v(vec1: np.ndarray, vec2: np.ndarray):
-    start = time.time()
+    start = time.perf_counter_ns()
 
     if (vec1.tobytes(), vec2.tobytes()) in hv_cache:
-        end = time.time()
-        total_time = end - start
-
-        if "Vertex Similarity" in times_dict:
-            times_dict["Vertex Similarity"].append(total_time)
-        else:
-            times_dict["Vertex Similarity"] = [total_time]
-
+        metrics.incr("h_v cache hits")
+        metrics.add_time("Vertex Similarity", time.perf_counter_ns() - start)
         return hv_cache[(vec1.tobytes(), vec2.tobytes())]
 
     m_v = vec1.dot(vec2) - sigma
     response_bool = m_v >= 0
-    end = time.time()
-    total_time = end - start
-
-    if "Vertex Similarity" in times_dict:
-        times_dict["Vertex Similarity"].append(total_time)
-    else:
-        times_dict["Vertex Similarity"] = [total_time]
+    metrics.add_time("Vertex Similarity", time.perf_counter_ns() - start)
 
     hv_cache[(vec1.tobytes(), vec2.tobytes())] = response_bool
 
     return response_bool
 
+def compute_vertex_similarities():
+    """
+    Evaluate h_v for every (server vertex, client vertex) pair at once with
+    one float32 matrix product; h_v_uri then answers from the result.
+    """
+    global hv_matrix, server_rows, client_cols
+    start = time.perf_counter_ns()
+    server_uris, server_matrix = model.embedding_matrix(list(embedding_map_server))
+    client_uris = list(client_embed_map)
+    client_matrix = model.normalized_matrix([client_embed_map[uri] for uri in client_uris])
+    if len(server_uris) and len(client_uris):
+        hv_matrix = model.cosine_similarity_matrix(server_matrix, client_matrix) >= sigma
+    else:
+        hv_matrix = np.zeros((len(server_uris), len(client_uris)), dtype=bool)
+    server_rows = {uri: i for i, uri in enumerate(server_uris)}
+    client_cols = {uri: j for j, uri in enumerate(client_uris)}
+    metrics.add_time("Vertex Similarity Matrix", time.perf_counter_ns() - start)
+
+def h_v_uri(server_uri: str, vec1: np.ndarray, client_uri: str, vec2: np.ndarray) -> bool:
+    """h_v of a server and a client vertex, looked up by URI when possible."""
+    i = server_rows.get(server_uri)
+    j = client_cols.get(client_uri)
+    if i is None or j is None:
+        return h_v(vec1, vec2)
+    return bool(hv_matrix[i, j])
+
 def h_p(path1: np.ndarray, path1_len: float, path2: np.ndarray, path2_len: int) -> float:
     # m_p = ((path1.dot(path2) * (1.0/(path1_len + path2_len))) - delta) * mask
-    start = time.time()
     m_p = (path1.dot(path2)) / (path1_len + path2_len)
 
     return m_p
@@ -89,32 +112,63 @@ def r_p(path: List[Vertex]) -> float:
 
     return product
 
-def receive_full_message(conn):
-    """Receives a message with a fixed-length header."""
-    msg_len_data = conn.recv(4)  # Get the first 4 bytes (message length)
+def receive_full_message(conn, msg: str):
+    """Receives a message with a fixed-length header, counted as a reply to msg."""
+    msg_len_data = receive_exactly(conn, 4)  # Get the first 4 bytes (message length)
 
-    if not msg_len_data:
+    if msg_len_data is None:
         return None
     msg_len = struct.unpack("!I", msg_len_data)[0]  # Unpack message length
 
-    total_bytes_rec = 4 + msg_len
-    bytes_rec_list.append(total_bytes_rec)
+    metrics.received(msg, 4 + msg_len)
 
     # Receive the full message
-    msg = b""
-    while len(msg) < msg_len:
-        msg_packet = conn.recv(msg_len - len(msg))
-        if not msg_packet:
-            return None
-        msg += msg_packet
-    return msg
+    return receive_exactly(conn, msg_len)
+
+
+def get_client_top_k_paths(client_uri: str, k: int, decryption_socket: socket) -> dict:
+    """
+    Request the client's top-k paths from client_uri (msg_type 2), at most
+    once per URI; prefetched responses are served without the socket.
+    """
+    if client_uri in client_top_k_paths:
+        metrics.incr("Top-K Paths cache hits")
+        return client_top_k_paths[client_uri]
+
+    k_serialized = struct.pack("!I", k)
+
+    h_r_client_map = {"Vector": client_uri, "K": k_serialized}
+    h_r_client_bytes = pickle.dumps(h_r_client_map)
 
+    response_bytes = struct.pack("!I", len(h_r_client_bytes)) + struct.pack("!I", 2) + h_r_client_bytes
+
+    metrics.sent("Top-K Paths", len(response_bytes))
+    decryption_socket.sendall(response_bytes)
+    msg = receive_full_message(decryption_socket, "Top-K Paths")
+
+    client_top_k_paths[client_uri] = pickle.loads(msg)
+    return client_top_k_paths[client_uri]
+
+def border_match(server_uri: str, client_uri: str) -> bool:
+    """
+    Match result for a pair whose server vertex belongs to another fragment,
+    as reported by that fragment in an earlier round (False until known).
+    """
+    border_requests.add((server_uri, client_uri))
+    return border_results.get((server_uri, client_uri), False)
 
 def para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str, delta, k, decryption_socket: socket) -> bool:
-    start = time.time()
-    print(f"Vec1: {vec1_uri}, Vec2: {vec2_uri}, match: {h_v(vec1, vec2)}")
+    # one span per pair when tracing; recursive matches are nested spans
+    with metrics.span("ParaMatch", server=vec1_uri, client=vec2_uri) as span:
+        match = _para_match(vec1, vec1_uri, vec2, vec2_uri, delta, k, decryption_socket)
+        span.set("match", bool(match))
+        return match
+
+def _para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str, delta, k, decryption_socket: socket) -> bool:
+    start = time.perf_counter_ns()
+    print(f"Vec1: {vec1_uri}, Vec2: {vec2_uri}, match: {h_v_uri(vec1_uri, vec1, vec2_uri, vec2)}")
     
-    if not h_v(vec1, vec2):
+    if not h_v_uri(vec1_uri, vec1, vec2_uri, vec2):
         cache[(vec1_uri, vec2_uri)] = [False, []]
         return False
 
@@ -140,30 +194,16 @@ def para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str,
         server_paths: List[List[np.ndarray]] = [[embedding_map_server[x.uri] for x in path] for path in paths]
         server_uris = [[x.uri for x in path] for path in paths]
         server_lengths = [len(path) for path in paths]
-        server_edges: List[np.ndarray] = [model.encode_path(x) for x in edges]
+        server_edges: List[np.ndarray] = list(model.encode_paths(edges))
 
         for path in paths:
             uri = path[1].uri
             V_server.append((uri, embedding_map_server[uri]))
-        ecache[vec1_uri] = V_server
+        ecache[vec1_uri] = (V_server, server_paths, server_lengths, server_edges)
+    V_server, server_paths, server_lengths, server_edges = ecache[vec1_uri]
 
     if vec2_uri not in ecache:
-        k_serialized = struct.pack("!I", k)
-
-        h_r_client_map = {"Vector": vec2_uri, "K": k_serialized}
-        h_r_client_bytes = pickle.dumps(h_r_client_map)
-
-        response_bytes = struct.pack("!I", len(h_r_client_bytes)) + struct.pack("!I", 2) + h_r_client_bytes
-
-        if "Top-K Paths" in bytes_sent_dict:
-            bytes_sent_dict["Top-K Paths"].append(len(response_bytes))
-        else:
-            bytes_sent_dict["Top-K Paths"] = [len(response_bytes)]
-
-        decryption_socket.sendall(response_bytes)
-        msg = receive_full_message(decryption_socket)
-
-        paths_edges_uris_map = pickle.loads(msg)
+        paths_edges_uris_map = get_client_top_k_paths(vec2_uri, k, decryption_socket)
 
         client_paths = []
         client_edges = []
@@ -182,7 +222,8 @@ def para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str,
         for i in range(0, len(client_paths)):
             V_client.append((client_uris[i], client_paths[i]))
 
-        ecache[vec2_uri] = V_client
+        ecache[vec2_uri] = (V_client, client_paths, client_edges, client_lengths)
+    V_client, client_paths, client_edges, client_lengths = ecache[vec2_uri]
 
     L = {}
     max_score = 0
@@ -193,7 +234,7 @@ def para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str,
         for c_index in range(len(V_client)):
             client_prime_uri, client_prime_vec = V_client[c_index]
             # print(f"Client URI: {client_prime_uri}, Server URI: {server_prime_uri}")
-            if h_v(server_prime_vec, client_prime_vec):
+            if h_v_uri(server_prime_uri, server_prime_vec, client_prime_uri, client_prime_vec):
                 # print("HERE")
                 l_u_prime.append((client_prime_uri, client_prime_vec))
                 score = h_p(server_edges[s_index], server_lengths[s_index], client_edges[c_index], client_lengths[c_index])
@@ -217,6 +258,8 @@ def para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str,
         for client_prime_uri, client_prime_vec in L[(server_prime_uri, server_prime_vec.tobytes())]:
             if (server_prime_uri, client_prime_uri) in cache:
                 match = cache[(server_prime_uri, client_prime_uri)][0]
+            elif fragment_vertices is not None and server_prime_uri not in fragment_vertices:
+                match = border_match(server_prime_uri, client_prime_uri)
             else:
                 match = para_match(server_prime_vec, server_prime_uri, client_prime_vec, client_prime_uri, delta, k, decryption_socket)
             if match:
@@ -286,12 +329,7 @@ def para_match(vec1: np.ndarray, vec1_uri: str, vec2: np.ndarray, vec2_uri: str,
             del cache[(server_p_uri, client_p_uri)]
             para_match(embedding_map_server[server_p_uri], server_p_uri, client_embed_map[client_p_uri], client_p_uri, delta, k, decryption_socket)
 
-    end = time.time()
-    total_time = end - start
-    if "ParaMatch" in times_dict:
-        times_dict["ParaMatch"].append(total_time)
-    else:
-        times_dict["ParaMatch"] = [total_time]
+    metrics.add_time("ParaMatch", time.perf_counter_ns() - start)
     return False
 
 def get_vertex_object(v_uri: str) -> Optional[Vertex]:
@@ -301,7 +339,7 @@ def get_vertex_object(v_uri: str) -> Optional[Vertex]:
         return None
 
 def h_r(vec1: np.ndarray, k) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
-    start = time.time()
+    start = time.perf_counter_ns()
     P = []
     scores = []
     edges = []
@@ -337,47 +375,212 @@ def h_r(vec1: np.ndarray, k) -> Tuple[List[List[Vertex]], List[List[Edge]]]:
 
     sorted_paths = [k for _, k in sorted(zip(scores, P), reverse=True, key=lambda pair: pair[0])]
     sorted_edges = [k for _, k in sorted(zip(scores, edges), reverse=True, key=lambda pair: pair[0])]
-    end = time.time()
-    total_time = end - start
-    if "Top-K Paths" in times_dict:
-        times_dict["Top-K Paths"].append(total_time)
-    else:
-        times_dict["Top-K Paths"] = [total_time]
+    metrics.add_time("Top-K Paths", time.perf_counter_ns() - start)
 
     return sorted_paths[:k], sorted_edges[:k]
 
-def main(dataset_path, java_context, decryption_host, port=65432, progress_callback=None):
-    global cache,user_profile, times_dict, bytes_sent_dict, bytes_rec_list, model, embedding_map_server, hv_cache, mask, ecache, client_embed_map, predictor, sigma, delta, vertices
-    times_dict = {}
-    bytes_sent_dict = {}
-    bytes_rec_list = []
+def match_server_vertex(uri_server: str, vec_server: np.ndarray, decryption_socket: socket) -> List[str]:
+    """
+    Run ParaMatch of one server vertex against every client vertex and
+    return the matching client URIs (PI[uri_server]).
+    """
+    global cache
+    cache = {}
+    matches = []
+    client_uris = list(client_embed_map)
+    # first h_v check, for all client vertices at once
+    for j in np.flatnonzero(hv_matrix[server_rows[uri_server]]):
+        uri_client = client_uris[j]
+        vec_client = client_embed_map[uri_client]
+
+        # cache hit?
+        if cache.get((uri_server, uri_client), (False,))[0]:
+            matches.append(uri_client)
+            continue
+
+        # do the expensive match
+        match = para_match(
+            vec_server,
+            uri_server,
+            vec_client,
+            uri_client,
+            delta,
+            3,
+            decryption_socket
+        )
+        # para_match stores [match, W] itself; W is what invalidates the entry later
+        cache.setdefault((uri_server, uri_client), [bool(match), []])
+        if match:
+            matches.append(uri_client)
+    return matches
+
+def match_all_sequential(decryption_socket: socket, progress_callback=None) -> Dict[str, List[str]]:
+    """VParaMatch one server vertex after another (PI for every server vertex)."""
+    PI = {}
+    for progress_count, (uri_server, vec_server) in enumerate(embedding_map_server.items(), 1):
+        PI[uri_server] = match_server_vertex(uri_server, vec_server, decryption_socket)
+        if progress_callback:
+            progress_callback.onProgressUpdate(int(progress_count / len(embedding_map_server) * 100), f"Server: Computing...")
+    return PI
+
+def _match_fragment(match_uris: List[str], border_pairs: List[Tuple[str, str]], owned_uris: List[str],
+                    border_values: Dict[Tuple[str, str], bool]):
+    """
+    Worker side of fragment_parallel_match. Runs in a forked process that
+    inherited the server state, so only URIs and match results cross the
+    process boundary.
+
+    Returns (PI for match_uris, results for evaluated pairs owned by this
+    fragment, border pairs requested from other fragments, metrics).
+    """
+    global fragment_vertices, border_results, border_requests, cache, metrics
+    fragment_vertices = set(owned_uris)
+    border_results = border_values
+    border_requests = set()
+    metrics = Metrics()
+    PI = {}
+    pair_results = {}
+
+    def collect():
+        for (server_uri, client_uri), value in cache.items():
+            if server_uri in fragment_vertices:
+                pair_results[(server_uri, client_uri)] = bool(value[0])
+
+    for uri_server in match_uris:
+        PI[uri_server] = match_server_vertex(uri_server, embedding_map_server[uri_server], None)
+        collect()
+
+    for server_uri, client_uri in border_pairs:
+        if (server_uri, client_uri) in pair_results:
+            continue
+        cache = {}
+        match = para_match(embedding_map_server[server_uri], server_uri, client_embed_map[client_uri], client_uri, delta, 3, None)
+        collect()
+        pair_results[(server_uri, client_uri)] = bool(match)
+
+    return PI, pair_results, border_requests, metrics
+
+def fragment_parallel_match(n_fragments: int, decryption_socket: socket, max_rounds: int = 20,
+                            max_workers: Optional[int] = None, progress_callback=None) -> Dict[str, List[str]]:
+    """
+    VParaMatch over a partitioned server profile.
+
+    The profile is split with Graph.edge_cut_partition and every fragment
+    matches its own vertices. When ParaMatch recurses into a vertex owned by
+    another fragment (a border node in OiD), the worker uses that fragment's
+    result from the previous round instead of recursing. Rounds repeat,
+    re-running only fragments whose border inputs changed, until the
+    exchanged border results are stable. max_rounds only guards against
+    border results that never settle: if it is reached, this is logged,
+    counted as "VParaMatch Rounds Exhausted" and the sequential VParaMatch
+    is run instead, so the result is always exact.
+
+    Client top-k paths are prefetched once over decryption_socket, so the
+    workers never talk to the client. Fragments run in forked processes,
+    only on host runs (no Chaquopy JVM to fork) with the fork start method
+    available. Without them, running the fragments one after another would
+    only add rounds to the sequential VParaMatch, so that is run instead.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import embedding_bridge
+
+    if embedding_bridge.TextEmbedder is not None or "fork" not in multiprocessing.get_all_start_methods():
+        print(f"log: no fork pool for {n_fragments} fragments, matching sequentially")
+        return match_all_sequential(decryption_socket, progress_callback)
+
+    partitions = user_profile.edge_cut_partition(n_fragments)
+    owned = [[v.uri for v in fragment.vertices if v.uri in embedding_map_server] for fragment, _ in partitions]
+    owner = {uri: i for i, uris in enumerate(owned) for uri in uris}
+    stats = user_profile.partition_stats(partitions)
+    print(f"log: {n_fragments} fragments, {stats['cut_edges']} cut edges, balance {stats['balance']:.2f}")
+
+    with metrics.timer("Prefetch Top-K Paths"):
+        for uri_client in client_embed_map:
+            get_client_top_k_paths(uri_client, 3, decryption_socket)
+
+    pool = ProcessPoolExecutor(max_workers=max_workers or n_fragments, mp_context=multiprocessing.get_context("fork"))
+
+    PI = {}
+    pair_results: Dict[Tuple[str, str], bool] = {}
+    border_values: Dict[Tuple[str, str], bool] = {}
+    requested = [set() for _ in owned]
+    to_match = [list(uris) for uris in owned]
+    to_answer = [set() for _ in owned]
+    try:
+        for round_index in range(max_rounds):
+            jobs = [i for i in range(len(owned)) if to_match[i] or to_answer[i]]
+            if not jobs:
+                break
+            args = [(to_match[i], sorted(to_answer[i]), owned[i], border_values) for i in jobs]
+            outputs = list(pool.map(_match_fragment, *zip(*args)))
+
+            for i, (fragment_pi, results, requests, worker_metrics) in zip(jobs, outputs):
+                PI.update(fragment_pi)
+                pair_results.update(results)
+                if to_match[i]:
+                    requested[i] = set(requests)
+                else:
+                    requested[i] |= requests
+                metrics.merge(worker_metrics)
+
+            # exchange border results and schedule the next round
+            to_match = [[] for _ in owned]
+            to_answer = [set() for _ in owned]
+            for i, requests in enumerate(requested):
+                stale = False
+                for pair in requests:
+                    if pair not in pair_results:
+                        to_answer[owner[pair[0]]].add(pair)
+                        stale = True
+                    elif border_values.get(pair, False) != pair_results[pair]:
+                        stale = True
+                if stale:
+                    to_match[i] = list(owned[i])
+            border_values = {pair: pair_results[pair] for requests in requested for pair in requests if pair in pair_results}
+
+            if progress_callback:
+                # the number of rounds is not known up front, so each round covers half the remaining bar
+                progress_callback.onProgressUpdate(int(100 * (1 - 0.5 ** (round_index + 1))), f"Server: Computing...")
+            print(f"log: VParaMatch round {round_index + 1}, {sum(1 for uris in to_match if uris)} fragments to re-run")
+        else:
+            if any(to_match) or any(to_answer):
+                print(f"log: VParaMatch border results still changing after {max_rounds} rounds, "
+                      f"matching sequentially")
+                metrics.incr("VParaMatch Rounds Exhausted")
+                # the client's paths are prefetched, so decryption_socket is not read again
+                PI = match_all_sequential(decryption_socket, progress_callback)
+    finally:
+        pool.shutdown()
+
+    # keep the sequential PI order (server vertex order)
+    return {uri: PI.get(uri, []) for uri in embedding_map_server}
+
+def main(dataset_path, java_context, decryption_host=None, port=65432, progress_callback=None, fragments=1,
+         embedding_dtype="float32"):
+    # decryption_host is no longer used: requests go back over the client's connection
+    global cache,user_profile, metrics, model, embedding_map_server, hv_cache, mask, ecache, client_embed_map, predictor, sigma, delta, vertices, client_top_k_paths, fragment_vertices
+    metrics = Metrics()
     hv_cache = {}
     cache = {}
     host = "0.0.0.0"
-    user_profile = get_graph(dataset_path, "g1")
+    user_profile = get_graph(dataset_path, "g1", use_snapshot=True)
     original_vertex_uris = set(v.uri for v in user_profile.vertices)
 
     # ====== Initialization ======
     if progress_callback:
         progress_callback.onProgressUpdate(0, "Server: Initializing...")
 
-    start = time.time()
-    model = EmbeddingHelper(java_context)
-    end = time.time()
-    times_dict["Initialize Sentence Transformer"] = end-start
+    with metrics.timer("Initialize Sentence Transformer"):
+        model = resources.embedding_helper(java_context, embedding_dtype)
 
-    start = time.time()
-    # predictor = LLMPredictor(context)
-    predictor = MockLLMPredictor(java_context)
-    end = time.time()
-    times_dict["Initialize LLM"] = end - start
+    with metrics.timer("Initialize LLM"):
+        predictor = resources.predictor(java_context)
 
     vertices = user_profile.vertices
 
-    start = time.time()
-    embedding_map_server = model.encode_embedding(vertices)
-    end = time.time()
-    times_dict["Compute Embeddings"] = end - start
+    with metrics.timer("Compute Embeddings"):
+        embedding_map_server = model.encode_embedding(vertices)
 
     mask = get_random_mask(1, 2, False)
     sigma = 0.95
@@ -386,6 +589,9 @@ def main(dataset_path, java_context, decryption_host, port=65432, progress_callb
     hv_cache = {}
 
     ecache = {}
+    client_top_k_paths = {}
+    # set in fragment workers only (see fragment_parallel_match)
+    fragment_vertices = None
 
     progress_count = 0
 
@@ -395,17 +601,13 @@ def main(dataset_path, java_context, decryption_host, port=65432, progress_callb
         s.listen()
         conn, addr = s.accept()
         with conn:
-            start_time = time.time()
-            data = []
-            total_bytes = 0
-            while True:
-                packet = conn.recv(4096)
-                if not packet:
-                    break
-                data.append(packet)
-                total_bytes += len(packet)
-            bytes_rec_list.append(len(b"".join(data)))
-            serialized_embedding_map_client = pickle.loads(b"".join(data))
+            start_time = time.perf_counter_ns()
+            data = receive_upload(conn)
+            if data is None:
+                print("log: client closed the connection before uploading its vertices")
+                return None
+            metrics.received("Context and Vertices", 8 + len(data))
+            serialized_embedding_map_client = pickle.loads(data)
             if isinstance(serialized_embedding_map_client, Dict):
                 print('Received encryption')
             else:
@@ -416,101 +618,69 @@ def main(dataset_path, java_context, decryption_host, port=65432, progress_callb
                 uri_client = uri
                 vertex_embedding_client = vec
                 client_embed_map[uri_client] = vertex_embedding_client
+            compute_vertex_similarities()
             # encryption_start_time = time.time()
             # encrypt_map_server = model.encrypt_embeddings(context, normalize = True)
             # encryption_end_time = time.time()
             # times_dict["Encryption"] = encryption_end_time - encryption_start_time
             serialized_map_server = {}
-            decryption_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            decryption_socket.connect((decryption_host, port + 10))
+            # requests go out on the client's own connection
+            decryption_socket = conn
             PI = {}
             C = {}
             expected_count = len(embedding_map_server)
             print(f'log: expected_count {len(embedding_map_server)}')
             progress_count = 0
-            for uri_server, vec_server in embedding_map_server.items():
-                PI[uri_server] = []
-                C[uri_server] = []
-                cache = {}
-                def check_client(uri_client, vec_client):
-                # first h_v check
-                    if not h_v(vec_server, vec_client):
-                        return None
-
-                    # cache hit?
-                    if cache.get((uri_server, uri_client), (False,))[0]:
-                        return uri_client
-
-                    # do the expensive match
-                    match = para_match(
-                        vec_server,
-                        uri_server,
-                        vec_client,
-                        uri_client,
-                        delta,
-                        3,
-                        decryption_socket
-                    )
-                    cache[(uri_server, uri_client)] = (bool(match),)
-
-                    return uri_client if match else None
-                for uri_client, vec_client in client_embed_map.items():
-                    result = check_client(uri_client, vec_client)
-                    if result is not None:
-                        PI[uri_server].append(result)
-                progress_count += 1
-                current_progress = progress_count / expected_count
-                if progress_callback:
-                    progress_callback.onProgressUpdate(int(current_progress * 100), f"Server: Computing...")
+            # a span (and a PKGEM_PROFILE phase) for the matching itself
+            with metrics.span("VParaMatch"):
+                if fragments > 1:
+                    PI = fragment_parallel_match(fragments, decryption_socket, progress_callback=progress_callback)
+                else:
+                    PI = match_all_sequential(decryption_socket, progress_callback)
             # for uri_server, vec_server in embedding_map_server.items():
             #     # print(f'log: for uri_server {uri_server}')
             #     PI[uri_server] = []
             #     C[uri_server] = []
             #     cache = {}
             PI_ordered = dict(sorted(PI.items(), key = lambda item: user_profile.lookup(item[0]).outward_degree, reverse=True))
-            v_para_match_end = time.time()
-            times_dict["VParaMatch"] = v_para_match_end - start_time
+            metrics.add_time("VParaMatch", time.perf_counter_ns() - start_time)
             print(f"PI Ordered: {PI_ordered}")
-            enrichment_start_time = time.time()
-            for uri_server in PI_ordered:
-                # print(f'log: before merge_subgraph for {uri_server}')
-                graph_map = {}
-                for client_uri in PI_ordered[uri_server]:
-                    client_sub_graph = get_client_sub_graph(client_uri, decryption_socket)
-                    client_vertex = client_sub_graph.lookup(client_uri)
-                    server_vertex = user_profile.lookup(uri_server)
-                    merge_subgraph(client_sub_graph, client_vertex, user_profile, server_vertex)
-                # print(f'log: after merge_subgraph for {uri_server}')
-            try:
-                decryption_socket.close()
-            except Exception as e:
-                print(f"Error during decryption_socket close: {e}")
+            enrichment_start_time = time.perf_counter_ns()
+            # fetch each matched client lineage once, then merge them all in one pass
+            with metrics.timer("Fetch Sub Graphs"):
+                client_sub_graphs = {}
+                for client_uris in PI_ordered.values():
+                    for client_uri in client_uris:
+                        if client_uri not in client_sub_graphs:
+                            client_sub_graphs[client_uri] = get_client_sub_graph(client_uri, decryption_socket)
+            merge_times = merge_matched_subgraphs(user_profile, PI_ordered, client_sub_graphs)
+            metrics.add_time("Merge Index", round(merge_times["Index"] * 1e9))
+            metrics.add_time("Merge Sub Graphs", round(merge_times["Merge"] * 1e9))
 
             # Remove duplicate vertices before saving
-            remove_duplicate_vertices_by_label_and_edge_label(user_profile)
+            with metrics.timer("Remove Duplicates"):
+                remove_duplicate_vertices_by_label_and_edge_label(user_profile)
 
             user_profile.print_graph()
             
             # save the result to a file
             import os
-            output_file = os.path.join(java_context.getFilesDir().getAbsolutePath(), "graph.json")
+            output_file = os.path.join(get_files_dir(java_context), "graph.json")
             user_profile.save_cytoscape_json(output_file)
+            user_profile.save_snapshot(os.path.splitext(output_file)[0] + ".pkgs")
             
-            enrichment_end_time = time.time()
-            end_time = time.time()
-            total_time = end_time - start_time
-            times_dict["Enrichment"] = enrichment_end_time - enrichment_start_time
-            data = struct.pack("!I", 0)
-            bytes_sent_dict["End"] = 4
-            conn.sendall(data)
-            total_bytes_sent = sum_values(bytes_sent_dict)
-            total_bytes_received = sum(bytes_rec_list)
+            end_time = time.perf_counter_ns()
+            total_time = (end_time - start_time) / 1e9
+            metrics.add_time("Enrichment", end_time - enrichment_start_time)
+            metrics.sent("End", send_message(conn, MSG_END))
             enriched_node_count = user_profile.get_newly_added_vertices_count(original_vertex_uris)
+            metrics.save_trace(get_files_dir(java_context), "server")
 
             # Return the required values
             return {
                 "total_time": total_time,
-                "total_bytes_received": total_bytes_received,
+                "total_bytes_received": metrics.bytes_received(),
                 "enriched_node_count": enriched_node_count,
-                "graph_path": output_file
+                "graph_path": output_file,
+                "metrics": metrics.summary()
             }
\ No newline at end of file
@@ -0,0 +1,303 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Optional, Tuple
+
+from graph import Graph, Vertex, write_cytoscape_json
+
+# Binary snapshot layout (all integers little-endian uint32 unless noted):
+#
+#   header        magic "PKGS", version (u16), flags (u16),
+#                 string count, vertex count, edge count, string blob length
+#   listed count  only with FLAG_UNLISTED: how many of the vertices are
+#                 in the graph's vertex list (see below)
+#   offsets       (string count + 1) offsets into the string blob
+#   string blob   utf-8 bytes of every uri/label, zero padded to 4 bytes
+#   vertices      vertex count * (uri string index, label string index)
+#   edges         edge count * (source vertex index, target vertex index, label string index)
+#
+# Labels are interned in the string table, so repeated hub labels ("Month",
+# "Category", ...) are stored once. An edge without a label uses NO_LABEL.
+#
+# Edges can point at vertices that are no longer in the vertex list (e.g.
+# after remove_duplicate_vertices_by_label_and_edge_label). Those endpoints
+# are stored after the listed vertices and FLAG_UNLISTED is set; loading
+# recreates them for their edges without listing them, as Graph.copy does.
+
+MAGIC = b"PKGS"
+VERSION = 1
+NO_LABEL = 0xFFFFFFFF
+FLAG_UNLISTED = 0x1
+SNAPSHOT_SUFFIX = ".pkgs"
+
+_HEADER = struct.Struct("<4sHHIIII")
+_U32 = "I"
+
+
+def _u32_array(values=()) -> array:
+    arr = array(_U32, values)
+    if arr.itemsize != 4:
+        raise RuntimeError("uint32 array type is not 4 bytes on this platform")
+    return arr
+
+
+def _to_le_bytes(arr: array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array(_U32, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _pad4(n: int) -> int:
+    return (4 - n % 4) % 4
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.blob = bytearray()
+        self.offsets = _u32_array([0])
+
+    def intern(self, s: Optional[str]) -> int:
+        if s is None:
+            return NO_LABEL
+        idx = self.index.get(s)
+        if idx is None:
+            idx = len(self.offsets) - 1
+            self.index[s] = idx
+            self.blob += str(s).encode("utf-8")
+            self.offsets.append(len(self.blob))
+        return idx
+
+
+def _write_snapshot(path: str, vertices, edges, listed: Optional[int] = None):
+    """
+    Write (uri, label) vertex pairs and (source index, target index, label)
+    edge triples as a snapshot, atomically replacing any existing file.
+    If listed is given, only the first listed vertices are in the vertex
+    list; the rest are unlisted edge endpoints.
+    """
+    strings = _StringTable()
+    vertex_arr = _u32_array()
+    for uri, label in vertices:
+        vertex_arr.append(strings.intern(uri))
+        vertex_arr.append(strings.intern(label))
+
+    edge_arr = _u32_array()
+    for src, dst, label in edges:
+        edge_arr.append(src)
+        edge_arr.append(dst)
+        edge_arr.append(strings.intern(label))
+
+    blob_len = len(strings.blob)
+    vertex_count = len(vertex_arr) // 2
+    flags = FLAG_UNLISTED if listed is not None and listed < vertex_count else 0
+    header = _HEADER.pack(MAGIC, VERSION, flags, len(strings.offsets) - 1,
+                          vertex_count, len(edge_arr) // 3, blob_len)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        if flags & FLAG_UNLISTED:
+            f.write(_to_le_bytes(_u32_array([listed])))
+        f.write(_to_le_bytes(strings.offsets))
+        f.write(bytes(strings.blob))
+        f.write(b"\0" * _pad4(blob_len))
+        f.write(_to_le_bytes(vertex_arr))
+        f.write(_to_le_bytes(edge_arr))
+    os.replace(tmp_path, path)
+
+
+def save_snapshot(graph: Graph, path: str):
+    """
+    Save the graph as a binary snapshot.
+
+    Args:
+        graph: The graph to save
+        path: Destination file, replaced atomically
+    """
+    vertices = [(v.uri, v.label) for v in graph.vertices]
+    vertex_index = {}
+    for i, v in enumerate(graph.vertices):
+        vertex_index.setdefault(v.uri, i)
+    listed = len(vertices)
+
+    def index(v: Vertex) -> int:
+        i = vertex_index.get(v.uri)
+        if i is None:
+            # dangling edge endpoint, stored unlisted
+            i = vertex_index[v.uri] = len(vertices)
+            vertices.append((v.uri, v.label))
+        return i
+
+    edges = [(index(e.v1), index(e.v2), e.label) for e in graph.edges]
+    _write_snapshot(path, vertices, edges, listed)
+
+
+class GraphSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file.
+
+    Opening a snapshot only maps the file and validates the header; strings
+    are decoded on access, so counts and individual records are available
+    without materializing a Graph.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Snapshot '{path}' is empty")
+
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise ValueError(f"Snapshot '{path}' is truncated")
+        magic, version, flags, n_strings, n_vertices, n_edges, blob_len = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"'{path}' is not a version {VERSION} graph snapshot")
+
+        offsets_start = _HEADER.size
+        listed = n_vertices
+        if flags & FLAG_UNLISTED:
+            if len(self._mmap) < offsets_start + 4:
+                self.close()
+                raise ValueError(f"Snapshot '{path}' is truncated")
+            listed = struct.unpack_from("<I", self._mmap, offsets_start)[0]
+            offsets_start += 4
+            if listed > n_vertices:
+                self.close()
+                raise ValueError(f"Snapshot '{path}' lists {listed} of {n_vertices} vertices")
+
+        self.string_count = n_strings
+        # listed vertices; unlisted edge endpoints follow them
+        self.vertex_count = listed
+        self.unlisted_count = n_vertices - listed
+        self.edge_count = n_edges
+
+        blob_start = offsets_start + 4 * (n_strings + 1)
+        vertices_start = blob_start + blob_len + _pad4(blob_len)
+        edges_start = vertices_start + 8 * n_vertices
+        end = edges_start + 12 * n_edges
+        if len(self._mmap) < end:
+            self.close()
+            raise ValueError(f"Snapshot '{path}' is truncated")
+
+        view = memoryview(self._mmap)
+        self._blob = view[blob_start:blob_start + blob_len]
+        self._offsets = self._u32_view(view[offsets_start:blob_start])
+        self._vertices = self._u32_view(view[vertices_start:edges_start])
+        self._edges = self._u32_view(view[edges_start:end])
+
+    @staticmethod
+    def _u32_view(view: memoryview):
+        if sys.byteorder == "little":
+            return view.cast(_U32)
+        # big-endian hosts pay for one copy
+        arr = _u32_array()
+        arr.frombytes(view)
+        arr.byteswap()
+        return arr
+
+    def string(self, i: int) -> Optional[str]:
+        if i == NO_LABEL:
+            return None
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def vertex(self, i: int) -> Tuple[str, str]:
+        return self.string(self._vertices[2 * i]), self.string(self._vertices[2 * i + 1])
+
+    def edge(self, i: int) -> Tuple[int, int, Optional[str]]:
+        """Return (source vertex index, target vertex index, label) of edge i."""
+        j = 3 * i
+        return self._edges[j], self._edges[j + 1], self.string(self._edges[j + 2])
+
+    def to_graph(self) -> Graph:
+        # decode each distinct string once
+        strings = [self.string(i) for i in range(self.string_count)]
+        graph = Graph()
+        vertices = []
+        for i in range(self.vertex_count + self.unlisted_count):
+            v = Vertex(strings[self._vertices[2 * i]], strings[self._vertices[2 * i + 1]])
+            vertices.append(v)
+            if i < self.vertex_count:
+                graph.add_vertex(v)
+        for i in range(self.edge_count):
+            j = 3 * i
+            label_idx = self._edges[j + 2]
+            label = None if label_idx == NO_LABEL else strings[label_idx]
+            graph.add_edge(vertices[self._edges[j]], vertices[self._edges[j + 1]], label)
+        return graph
+
+    def close(self):
+        # memoryviews must be released before the mmap can be closed
+        for name in ("_blob", "_offsets", "_vertices", "_edges"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_snapshot(path: str) -> Graph:
+    with GraphSnapshot(path) as snap:
+        return snap.to_graph()
+
+
+def cytoscape_json_to_snapshot(json_path: str, snapshot_path: str, graph_prefix: Optional[str] = None):
+    """
+    Convert a Cytoscape.js JSON file into a snapshot without building a Graph.
+    If graph_prefix is given, URIs are prefixed the same way as util.get_graph.
+    """
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    def uri(node_id):
+        return f"{graph_prefix}/{node_id}" if graph_prefix else node_id
+
+    vertex_index = {}
+    for i, node in enumerate(data["nodes"]):
+        vertex_index.setdefault(node["id"], i)
+
+    vertices = ((uri(node["id"]), node["labels"][0]) for node in data["nodes"])
+    edges = ((vertex_index[e["source"]], vertex_index[e["target"]], e["labels"][0]) for e in data["edges"])
+    _write_snapshot(snapshot_path, vertices, edges)
+
+
+def snapshot_to_cytoscape_json(snapshot_path: str, json_path: str, compact: bool = False):
+    """
+    Convert a snapshot back into the Cytoscape.js JSON written by
+    Graph.save_cytoscape_json, streaming entries straight from the mapping.
+    """
+    with GraphSnapshot(snapshot_path) as snap:
+        uris = [snap.vertex(i)[0] for i in range(snap.vertex_count + snap.unlisted_count)]
+
+        def nodes():
+            for i, uri in enumerate(uris[:snap.vertex_count]):
+                yield {"id": uri, "labels": [snap.vertex(i)[1]]}
+
+        def edges():
+            for i in range(snap.edge_count):
+                src, dst, label = snap.edge(i)
+                yield {
+                    "id": f"e{i + 1}",
+                    "source": uris[src],
+                    "target": uris[dst],
+                    "labels": [label]
+                }
+
+        write_cytoscape_json(json_path, nodes(), edges(), compact)
@@ -0,0 +1,232 @@
+# optional span tracing and per-phase cProfile of an enrichment run
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+TRACE_FORMATS = ("chrome", "speedscope")
+
+
+class Span:
+    """
+    One traced region. args are set by the code that opened it; counts are
+    what Metrics recorded while it was the innermost span (calls per timing
+    name, counters, bytes), so nested spans do not double count.
+    """
+    __slots__ = ("name", "args", "counts", "depth", "pid", "tid", "start_ns", "end_ns")
+
+    def __init__(self, name: str, args: dict, depth: int):
+        self.name = name
+        self.args = args
+        self.counts: Dict[str, int] = {}
+        self.depth = depth
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def set(self, key: str, value):
+        self.args[key] = value
+
+    def count(self, key: str, n: int = 1):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def label(self) -> str:
+        # e.g. "ParaMatch server-uri client-uri", a frame name for speedscope
+        return " ".join([self.name] + [v for v in self.args.values() if isinstance(v, str)])
+
+
+class _NullSpan:
+    """What span() returns when tracing is off: a no-op context manager."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key: str, value):
+        pass
+
+    def count(self, key: str, n: int = 1):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Span tracing and cProfile hooks, both off unless asked for:
+
+    - PKGEM_TRACE=chrome|speedscope records a span per phase (Metrics.timer)
+      and per span() call, e.g. one per para_match pair, and save() writes
+      them as a Chrome trace (chrome://tracing, Perfetto) or a speedscope
+      file
+    - PKGEM_PROFILE=<phase>,<phase>|* runs those phases (timer or span
+      names) under cProfile; save() writes one .prof file per phase
+
+    A Tracer travels with its Metrics, so spans of fragment worker processes
+    are merged into the run's trace. Profiles are not, they cover the
+    process that saves them.
+    """
+
+    def __init__(self, trace_format: Optional[str] = None, profile_phases=()):
+        if trace_format is not None and trace_format not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format '{trace_format}', expected one of {', '.join(TRACE_FORMATS)}")
+        self.trace_format = trace_format
+        self.profile_phases = frozenset(profile_phases)
+        self.spans: List[Span] = []
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> Optional["Tracer"]:
+        """A Tracer configured by PKGEM_TRACE and PKGEM_PROFILE, or None if both are unset."""
+        trace_format = os.environ.get("PKGEM_TRACE", "").strip().lower() or None
+        phases = [p.strip() for p in os.environ.get("PKGEM_PROFILE", "").split(",") if p.strip()]
+        if trace_format is None and not phases:
+            return None
+        return cls(trace_format, phases)
+
+    def __getstate__(self):
+        # profilers and the per-thread span stacks stay in their process
+        return {"trace_format": self.trace_format, "profile_phases": self.profile_phases, "spans": self.spans}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.profiles = {}
+        self._local = threading.local()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _profiler(self, name: str) -> Optional[cProfile.Profile]:
+        # only one profiler can be active, so phases inside a profiled phase are not profiled separately
+        if getattr(self._local, "profiling", False):
+            return None
+        if name not in self.profile_phases and "*" not in self.profile_phases:
+            return None
+        profiler = self.profiles.get(name)
+        if profiler is None:
+            profiler = self.profiles[name] = cProfile.Profile()
+        return profiler
+
+    @contextmanager
+    def span(self, name: str, args: Optional[dict] = None) -> Iterator[Span]:
+        profiler = self._profiler(name)
+        if profiler is not None:
+            self._local.profiling = True
+            profiler.enable()
+        try:
+            if self.trace_format is None:
+                yield NULL_SPAN
+                return
+            stack = self._stack()
+            span = Span(name, args or {}, len(stack))
+            stack.append(span)
+            span.start_ns = time.perf_counter_ns()
+            try:
+                yield span
+            finally:
+                span.end_ns = time.perf_counter_ns()
+                stack.pop()
+                self.spans.append(span)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._local.profiling = False
+
+    def count(self, key: str, n: int = 1):
+        """Add n to key on the innermost open span of this thread, if any."""
+        stack = getattr(self._local, "stack", None)
+        if stack:
+            stack[-1].count(key, n)
+
+    def merge(self, other: "Tracer"):
+        self.spans.extend(other.spans)
+
+    def chrome_trace(self) -> dict:
+        """The spans in the Chrome trace event format (complete "X" events, microseconds)."""
+        events = []
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": "enrichment",
+                "ph": "X",
+                "ts": span.start_ns / 1e3,
+                "dur": (span.end_ns - span.start_ns) / 1e3,
+                "pid": span.pid,
+                "tid": span.tid,
+                "args": {**span.args, **span.counts, "depth": span.depth},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def speedscope(self, name: str) -> dict:
+        """The spans in speedscope's file format, one evented profile per process and thread."""
+        frames: Dict[str, int] = {}
+        threads: Dict[tuple, List[Span]] = {}
+        for span in self.spans:
+            threads.setdefault((span.pid, span.tid), []).append(span)
+
+        profiles = []
+        for (pid, tid), spans in sorted(threads.items()):
+            # outer spans first when they start together, so every span opens inside its parent
+            spans.sort(key=lambda s: (s.start_ns, -s.end_ns))
+            events = []
+            open_spans: List[Span] = []
+            for span in spans:
+                while open_spans and open_spans[-1].end_ns <= span.start_ns:
+                    done = open_spans.pop()
+                    events.append({"type": "C", "frame": frames[done.label()], "at": done.end_ns})
+                frame = frames.setdefault(span.label(), len(frames))
+                events.append({"type": "O", "frame": frame, "at": span.start_ns})
+                open_spans.append(span)
+            while open_spans:
+                done = open_spans.pop()
+                events.append({"type": "C", "frame": frames[done.label()], "at": done.end_ns})
+            profiles.append({
+                "type": "evented",
+                "name": f"{name} pid {pid} thread {tid}",
+                "unit": "nanoseconds",
+                "startValue": spans[0].start_ns,
+                "endValue": max(s.end_ns for s in spans),
+                "events": events,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "shared": {"frames": [{"name": label} for label in frames]},
+            "profiles": profiles,
+        }
+
+    def save(self, directory: str, name: str) -> List[str]:
+        """
+        Write the trace as <name>.trace.json (chrome) or
+        <name>.speedscope.json, and every profiled phase as
+        <name>-<phase>.prof (pstats format).
+
+        Returns:
+            List[str]: Paths of the files written
+        """
+        paths = []
+        if self.trace_format is not None and self.spans:
+            if self.trace_format == "chrome":
+                path, data = os.path.join(directory, f"{name}.trace.json"), self.chrome_trace()
+            else:
+                path, data = os.path.join(directory, f"{name}.speedscope.json"), self.speedscope(name)
+            with open(path, "w") as f:
+                json.dump(data, f)
+            paths.append(path)
+        for phase, profiler in self.profiles.items():
+            path = os.path.join(directory, f"{name}-{phase.replace(' ', '_')}.prof")
+            profiler.dump_stats(path)
+            paths.append(path)
+        return paths
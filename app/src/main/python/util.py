@@ -1,22 +1,43 @@
 import random
 import json
-from typing import Dict
-from graph import Vertex, Graph
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from graph import Edge, Vertex, Graph
 import textwrap
 from collections import defaultdict
 
+def get_files_dir(context) -> str:
+    """
+    Directory for output files: the app's files dir on-device, otherwise
+    $PKGEM_FILES_DIR or the working directory.
+    """
+    if context is not None:
+        return context.getFilesDir().getAbsolutePath()
+    return os.environ.get("PKGEM_FILES_DIR", os.getcwd())
+
 def remove_duplicate_vertices_by_label_and_edge_label(graph: Graph):
+    """
+    Merge vertices that share a label and are reached through the same edge label.
+
+    For every (vertex label, incoming edge label) group, the first vertex is
+    kept as canonical; edges with that label pointing to a duplicate are
+    redirected to it and the duplicates are dropped together with their
+    remaining edges. Groups are resolved in edge order, exactly as if each
+    duplicate were redirected and removed one at a time, but the edges and
+    vertices are rewritten in a single pass.
+    """
     # Group vertices by (label, incoming_edge_label)
     incoming_map = defaultdict(list)
-
-    # First, build a reverse lookup of incoming edges to each vertex
     for edge in graph.edges:
-        key = (edge.v2.label, edge.label)
-        incoming_map[key].append(edge.v2)
+        incoming_map[(edge.v2.label, edge.label)].append(edge.v2)
 
-    visited = set()
+    # Decide every removal up front: removed_at orders the removals, and
+    # redirect holds the edge label and canonical vertex for each duplicate.
+    removed_at: Dict[str, int] = {}
+    redirect: Dict[str, Tuple[str, Vertex]] = {}
     for (label, edge_label), duplicates in incoming_map.items():
-        # Filter duplicates (must be >1 to remove)
         unique = []
         seen_uris = set()
         for v in duplicates:
@@ -28,16 +49,62 @@ def remove_duplicate_vertices_by_label_and_edge_label(graph: Graph):
 
         canonical = unique[0]
         for dup in unique[1:]:
-            if dup in visited or dup == canonical:
+            if dup.uri in removed_at:
                 continue
-            # Redirect all edges pointing to the duplicate to the canonical vertex
-            for edge in graph.edges:
-                if edge.v2 == dup and edge.label == edge_label:
-                    edge.v2 = canonical
-                    edge.uri = f"{edge.v1.uri}->{canonical.uri}"
-            # Remove the duplicate vertex
-            graph.remove_vertex(dup)
-            visited.add(dup)
+            removed_at[dup.uri] = len(removed_at)
+            redirect[dup.uri] = (edge_label, canonical)
+
+    if not removed_at:
+        return
+
+    present = {v.uri for v in graph.vertices}
+    for uri in removed_at:
+        if uri not in present:
+            raise ValueError(f"Vertex with URI '{uri}' not found in graph")
+
+    # Replay the removals against each edge: a redirect fires when the
+    # current target is removed with a matching edge label; anything else
+    # touching a removed vertex drops the edge.
+    kept_edges = []
+    for edge in graph.edges:
+        source_removed = removed_at.get(edge.v1.uri)
+        target = edge.v2
+        now = -1
+        alive = True
+        while True:
+            target_removed = removed_at.get(target.uri)
+            if target_removed is not None and target_removed <= now:
+                target_removed = None
+            if source_removed is not None and (target_removed is None or source_removed <= target_removed):
+                alive = False
+                break
+            if target_removed is None:
+                break
+            edge_label, canonical = redirect[target.uri]
+            if edge.label != edge_label:
+                alive = False
+                break
+            target = canonical
+            now = target_removed
+
+        if not alive:
+            continue
+        if target is not edge.v2:
+            edge.v2 = target
+            edge.uri = f"{edge.v1.uri}->{target.uri}"
+        kept_edges.append(edge)
+
+    # list.remove drops the first vertex with a matching URI only
+    kept_vertices = []
+    dropped = set()
+    for v in graph.vertices:
+        if v.uri in removed_at and v.uri not in dropped:
+            dropped.add(v.uri)
+            continue
+        kept_vertices.append(v)
+
+    graph.vertices = kept_vertices
+    graph.edges = kept_edges
 
 def sum_values(data: dict) -> int:
     total = 0
@@ -57,14 +124,158 @@ def get_random_mask(lb, ub, inclusive=False):
             if lb < mask < ub:
                 return mask
 
-def merge_subgraph(x: Graph, x1: Vertex, y: Graph, y1: Vertex) -> Dict[Vertex, Vertex]:
+# A peer session runs over one connection. Every server message is framed
+# as length (!I) + message type (!I) + payload, and so is the client's
+# upload, which is followed by the server's requests (types 1-4) and their
+# replies. An empty MSG_END frame ends the session.
+#
+# The connection is lock-step, not multiplexed: the server has at most one
+# request outstanding, and the client answers it before reading the next
+# frame. Replies therefore carry no type or stream id. Vertex Similarity
+# (1) and Path Similarity (3) replies are a bare !I and a bare native
+# double; Top-K Paths (2) and Sub Graph (4) replies are length (!I) +
+# payload. ParaMatch needs each answer before it can decide on its next
+# request, so stream ids would let nothing overlap and would only add
+# bytes to the smallest, most frequent replies.
+MSG_END = 0
+MSG_UPLOAD = 6
+
+# message type -> name under which its bytes and round trips are counted (see metrics)
+MSG_NAMES = {
+    MSG_END: "End",
+    1: "Vertex Similarity",
+    2: "Top-K Paths",
+    3: "Path Similarity",
+    4: "Sub Graph",
+    5: "Enrichment",
+    MSG_UPLOAD: "Context and Vertices",
+}
+
+def send_message(conn, msg_type: int, payload: bytes = b"") -> int:
+    """Send one framed message and return the number of bytes sent."""
+    data = struct.pack("!I", len(payload)) + struct.pack("!I", msg_type) + payload
+    conn.sendall(data)
+    return len(data)
+
+def receive_exactly(conn, n: int) -> Optional[bytes]:
+    """Receive exactly n bytes, or None if the connection closes first."""
+    chunks = []
+    while n > 0:
+        chunk = conn.recv(min(n, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+def receive_upload(conn) -> Optional[bytes]:
+    """Receive the client's MSG_UPLOAD frame and return its payload."""
+    header = receive_exactly(conn, 8)
+    if header is None:
+        return None
+    msg_len, msg_type = struct.unpack("!II", header)
+    if msg_type != MSG_UPLOAD:
+        raise ValueError(f"Expected an upload message, got type {msg_type}")
+    return receive_exactly(conn, msg_len)
+
+class MergeIndex:
+    """
+    Lookup tables over a target graph for the merge routines.
+
+    Keeps, in graph order, the first vertex per URI, the last vertex per
+    label, the first child per (parent URI, child label, edge label), the
+    out-edges per source URI and the sets of existing edges by URI and by
+    label. Vertices and edges appended
+    to the graph are picked up incrementally, so one index can serve every
+    merge of an enrichment run; if the edge or vertex list is replaced (e.g.
+    by Graph.remove_vertex) the index is rebuilt on next use.
+    """
+
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self._rebuild()
+
+    def _rebuild(self):
+        self.uri_to_vertex: Dict[str, Vertex] = {}
+        self.label_to_vertex: Dict[str, Vertex] = {}
+        self.children: Dict[Tuple[str, str, str], Vertex] = {}
+        self._out_edges: Dict[str, List[Edge]] = {}
+        self.edge_uris: Set[Tuple[str, str, str]] = set()
+        self.edge_labels: Set[Tuple[str, str, str]] = set()
+        self._vertices = self.graph.vertices
+        self._edges = self.graph.edges
+        self._vertex_count = 0
+        self._edge_count = 0
+        self.sync()
+
+    def sync(self):
+        graph = self.graph
+        if (graph.vertices is not self._vertices or graph.edges is not self._edges
+                or len(graph.vertices) < self._vertex_count or len(graph.edges) < self._edge_count):
+            self._rebuild()
+            return
+        for v in graph.vertices[self._vertex_count:]:
+            self._index_vertex(v)
+        for e in graph.edges[self._edge_count:]:
+            self._index_edge(e)
+        self._vertex_count = len(graph.vertices)
+        self._edge_count = len(graph.edges)
+
+    def _index_vertex(self, v: Vertex):
+        self.uri_to_vertex.setdefault(v.uri, v)
+        self.label_to_vertex[v.label] = v
+
+    def _index_edge(self, e: Edge):
+        self.children.setdefault((e.v1.uri, e.v2.label, e.label), e.v2)
+        self._out_edges.setdefault(e.v1.uri, []).append(e)
+        self.edge_uris.add((e.v1.uri, e.v2.uri, e.label))
+        self.edge_labels.add((e.v1.label, e.v2.label, e.label))
+
+    def lookup(self, uri: str) -> Optional[Vertex]:
+        self.sync()
+        return self.uri_to_vertex.get(uri)
+
+    def out_edges(self) -> Dict[str, List[Edge]]:
+        """The graph's out_edge_map(), kept up to date with the index."""
+        self.sync()
+        return self._out_edges
+
+    def add_vertex(self, v: Vertex):
+        self.sync()
+        self.graph.add_vertex(v)
+        self._index_vertex(v)
+        self._vertex_count += 1
+
+    def add_edge(self, v1: Vertex, v2: Vertex, label=None) -> Edge:
+        self.sync()
+        e = self.graph.add_edge(v1, v2, label)
+        self._index_edge(e)
+        self._edge_count += 1
+        return e
+
+
+def _out_edges(graph: Graph) -> Dict[str, List[Edge]]:
+    """Group edges by source URI, preserving edge order (Graph.get_edges for every vertex)."""
+    out_edges = defaultdict(list)
+    for edge in graph.edges:
+        out_edges[edge.v1.uri].append(edge)
+    return out_edges
+
+
+def merge_subgraph(x: Graph, x1: Vertex, y: Graph, y1: Vertex, index: Optional[MergeIndex] = None) -> Dict[Vertex, Vertex]:
     """
     Merge into graph y (at node y1) the entire subgraph of x rooted at x1.
     Preserves the original cycle/topology without infinite recursion.
 
+    Pass the same MergeIndex over y to consecutive calls to avoid
+    re-indexing y for every merged subgraph.
+
     Returns a mapping from each visited x-node to its corresponding y-node.
     """
-    print(f"log: x1 edges {x.get_edges(x1)}")
+    if index is None:
+        index = MergeIndex(y)
+    x_edges = _out_edges(x)
+    print(f"log: x1 edges {x_edges.get(x1.uri, [])}")
     
     mapping: Dict[Vertex, Vertex] = {x1: y1}
     visited = set()
@@ -74,7 +285,7 @@ def merge_subgraph(x: Graph, x1: Vertex, y: Graph, y1: Vertex) -> Dict[Vertex, V
         parent_y = mapping[u]
 
         # Process outgoing edges
-        for edge in x.get_edges(u):
+        for edge in x_edges.get(u.uri, []):
             child_x = edge.v2
             lbl = edge.label
 
@@ -83,20 +294,18 @@ def merge_subgraph(x: Graph, x1: Vertex, y: Graph, y1: Vertex) -> Dict[Vertex, V
                 target_y = mapping[child_x]
             else:
                 # 2) Otherwise, look for an existing y-node under parent_y
-                target_y = None
-                for y_edge in y.get_edges(parent_y):
-                    if y_edge.v2.label == child_x.label and y_edge.label == lbl:
-                        target_y = y_edge.v2
-                        break
+                index.sync()
+                target_y = index.children.get((parent_y.uri, child_x.label, lbl))
                 # 3) If none found, clone child_x into y
                 if target_y is None:
                     target_y = Vertex(child_x.uri, child_x.label)
-                    y.add_vertex(target_y)
+                    index.add_vertex(target_y)
                 mapping[child_x] = target_y
 
             # 4) Ensure the edge (parent_y -> target_y, lbl) exists in y
-            if not any(e.v2 == target_y and e.label == lbl for e in y.get_edges(parent_y)):
-                y.add_edge(parent_y, target_y, lbl)
+            index.sync()
+            if (parent_y.uri, target_y.uri, lbl) not in index.edge_uris:
+                index.add_edge(parent_y, target_y, lbl)
 
             # 5) Recurse if we haven't yet visited child_x
             if child_x not in visited:
@@ -105,6 +314,88 @@ def merge_subgraph(x: Graph, x1: Vertex, y: Graph, y1: Vertex) -> Dict[Vertex, V
     dfs(x1)
     return mapping
 
+def merge_matched_subgraphs(y: Graph, matches: Dict[str, List[str]], subgraphs: Dict[str, Graph],
+                            index: Optional[MergeIndex] = None) -> Dict[str, float]:
+    """
+    Merge every matched subgraph into y in a single pass.
+
+    matches maps a y-vertex URI to the URIs it matched in the other graph
+    (VParaMatch's PI), and subgraphs maps each of those URIs to its lineage
+    subgraph, fetched once even if several y-vertices matched it.
+
+    Each matched root is merged below its y-vertex as merge_subgraph does,
+    but descendants shared between lineages are cloned into y once and
+    reused, and a descendant already merged is not traversed again.
+
+    Returns:
+        Dict[str, float]: Seconds spent per phase ("Index", "Merge")
+    """
+    times = {}
+    start = time.perf_counter()
+    if index is None:
+        index = MergeIndex(y)
+    else:
+        index.sync()
+    out_edges = {}
+    for sub_graph in subgraphs.values():
+        for uri, edges in _out_edges(sub_graph).items():
+            out_edges.setdefault(uri, edges)
+    times["Index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # x-URI -> y-vertex cloned for it, shared by every matched pair
+    clones: Dict[str, Vertex] = {}
+    # x-URIs whose lineage has been merged below their clone
+    merged: Set[str] = set()
+
+    for y_uri, x_uris in matches.items():
+        y_root = index.lookup(y_uri)
+        if y_root is None:
+            continue
+        for x_uri in x_uris:
+            if x_uri not in subgraphs:
+                continue
+            mapping: Dict[str, Vertex] = {x_uri: y_root}
+            visited = {x_uri}
+            expanded = []
+            stack = [(y_root, iter(out_edges.get(x_uri, [])))]
+            while stack:
+                parent_y, edges = stack[-1]
+                edge = next(edges, None)
+                if edge is None:
+                    stack.pop()
+                    continue
+                child_x = edge.v2
+                lbl = edge.label
+
+                if child_x.uri in mapping:
+                    target_y = mapping[child_x.uri]
+                else:
+                    target_y = index.children.get((parent_y.uri, child_x.label, lbl))
+                    if target_y is None:
+                        target_y = clones.get(child_x.uri)
+                    if target_y is None:
+                        target_y = Vertex(child_x.uri, child_x.label)
+                        index.add_vertex(target_y)
+                        clones[child_x.uri] = target_y
+                    mapping[child_x.uri] = target_y
+
+                if (parent_y.uri, target_y.uri, lbl) not in index.edge_uris:
+                    index.add_edge(parent_y, target_y, lbl)
+
+                if child_x.uri in visited:
+                    continue
+                visited.add(child_x.uri)
+                if child_x.uri in merged and clones.get(child_x.uri) is target_y:
+                    continue
+                if clones.get(child_x.uri) is target_y:
+                    expanded.append(child_x.uri)
+                stack.append((target_y, iter(out_edges.get(child_x.uri, []))))
+            merged.update(expanded)
+
+    times["Merge"] = time.perf_counter() - start
+    return times
+
 def merge_graphs(g1: Graph, g2: Graph) -> Graph:
     merged_graph = Graph()
     label_to_vertex = {}
@@ -152,16 +443,23 @@ def merge_graphs(g1: Graph, g2: Graph) -> Graph:
 
     return merged_graph
 
-def append_subgraph_at_uri(g: Graph, g1: Graph, uri: str):
+def append_subgraph_at_uri(g: Graph, g1: Graph, uri: str, index: Optional[MergeIndex] = None):
+    """
+    Attach g1 below the vertex of g with the given URI, reusing vertices of g
+    by label and skipping edges whose (source, target, edge) labels exist.
+
+    Pass the same MergeIndex over g to consecutive calls to avoid
+    re-indexing g every time.
+    """
+    if index is None:
+        index = MergeIndex(g)
+
     # Lookup the vertex in g where we will attach g1
-    target = g.lookup(uri)
+    target = index.lookup(uri)
     if not isinstance(target, Vertex):
         raise ValueError(f"Vertex with URI '{uri}' not found in g")
 
-    uri_to_vertex = {v.uri: v for v in g.vertices}
-    label_to_vertex = {v.label: v for v in g.vertices}
-    existing_edges = {(e.v1.label, e.v2.label, e.label) for e in g.edges}
-
+    g1_edges = _out_edges(g1)
     visited = set()
     g1_root = g1.vertices[0]  # Assume root is first
 
@@ -173,47 +471,70 @@ def append_subgraph_at_uri(g: Graph, g1: Graph, uri: str):
             return
         visited.add(v1.uri)
 
-        for edge in g1.get_edges(v1):
+        for edge in g1_edges.get(v1.uri, []):
             child = edge.v2
 
             # Try to find an existing vertex in g with the same label
-            if child.label in label_to_vertex:
-                g_child = label_to_vertex[child.label]
+            index.sync()
+            if child.label in index.label_to_vertex:
+                g_child = index.label_to_vertex[child.label]
             else:
                 g_child = Vertex(child.uri, child.label)
-                g.add_vertex(g_child)
-                uri_to_vertex[g_child.uri] = g_child
-                label_to_vertex[g_child.label] = g_child
+                index.add_vertex(g_child)
 
             edge_key = (g_v1.label, g_child.label, edge.label)
-            if edge_key not in existing_edges:
-                g.add_edge(g_v1, g_child, edge.label)
-                existing_edges.add(edge_key)
+            if edge_key not in index.edge_labels:
+                index.add_edge(g_v1, g_child, edge.label)
 
             dfs(child, g_child)
 
     dfs(g1_root, target)
 
 
-def get_graph(dataset_path, graph_prefix="g1"):
+def get_graph(dataset_path, graph_prefix="g1", use_snapshot=False):
+    """
+    Load a Cytoscape.js JSON dataset as a Graph, prefixing every URI with graph_prefix.
+
+    With use_snapshot, a binary snapshot is kept next to the dataset and reused
+    as long as it is newer than the JSON, so later sessions skip JSON parsing.
+    """
+    if use_snapshot:
+        from snapshot import SNAPSHOT_SUFFIX, load_snapshot, save_snapshot
+        import os
+        snapshot_path = f"{dataset_path}.{graph_prefix}{SNAPSHOT_SUFFIX}"
+        try:
+            if os.path.getmtime(snapshot_path) >= os.path.getmtime(dataset_path):
+                return load_snapshot(snapshot_path)
+        except (OSError, ValueError):
+            pass
+
     with open(dataset_path) as json_file:
         data = json.load(json_file)
 
     graph = Graph()
+    uri_to_vertex = {}
 
     for node in data["nodes"]:
         uri = node["id"]
         label = node["labels"][0]
-        graph.add_vertex(Vertex(f"{graph_prefix}/{uri}", label))
+        vertex = Vertex(f"{graph_prefix}/{uri}", label)
+        graph.add_vertex(vertex)
+        uri_to_vertex.setdefault(vertex.uri, vertex)
 
     for edge in data["edges"]:
         src_uri = f"{graph_prefix}/" + edge['source']
         tgt_uri = f"{graph_prefix}/" + edge["target"]
         label = edge["labels"][0]
-        src_vertex = graph.lookup(src_uri)
-        tgt_vertex = graph.lookup(tgt_uri)
+        src_vertex = uri_to_vertex.get(src_uri)
+        tgt_vertex = uri_to_vertex.get(tgt_uri)
         graph.add_edge(src_vertex, tgt_vertex, label)
 
+    if use_snapshot:
+        try:
+            save_snapshot(graph, snapshot_path)
+        except OSError as e:
+            print(f"log: could not write snapshot {snapshot_path}: {e}")
+
     return graph
 
 
@@ -0,0 +1,127 @@
+"""
+CKKS cost and ciphertext size per parameter set (encryption.select_parameters).
+
+    python benchmarks/bench_ckks_params.py --depth 2 --scale-bits 22 25 30 40 --integer-bits 8 30 --repeat 20
+
+For every depth, scale and first-prime headroom (integer bits) in the
+grid, the smallest secure parameter set is selected for --dim and
+measured with TenSEAL on random unit vectors:
+
+- keygen: context creation with Galois keys
+- ctx KiB: the public context the client uploads (public, Galois and
+  relinearization keys)
+- ct KiB: one serialized embedding ciphertext
+- encrypt, serialize, load (ckks_vector_from), dot, decrypt: ms per call
+- h_v, h_p: the server's comparisons as in server.py (dot - sigma then
+  * mask; the client's path_with_length ciphertext dotted with the
+  server's plaintext length_weighted_path), ms per call
+- h_v err, h_p err: absolute error of the decrypted results
+
+Without tenseal only the selected parameters are printed.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import bench_common  # noqa: F401  (puts app/src/main/python on sys.path)
+from encryption import EMBEDDING_DIM, Encryption, length_weighted_path, path_with_length, select_parameters
+
+
+def per_call_ms(repeat, fn, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.perf_counter() - start) / repeat * 1e3, result
+
+
+def measure(parameters, dim: int, repeat: int, rng: np.random.Generator) -> dict:
+    import tenseal as ts
+
+    start = time.perf_counter()
+    encryption = Encryption(parameters)
+    keygen_s = time.perf_counter() - start
+    context = encryption.get_context()
+
+    vectors = rng.standard_normal((2, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    lengths = [3, 2]
+    sigma, mask = 0.85, 1.5
+
+    encrypt_ms, vec1 = per_call_ms(repeat, ts.ckks_vector, context, vectors[0])
+    vec2 = ts.ckks_vector(context, vectors[1])
+    serialize_ms, data = per_call_ms(repeat, vec1.serialize)
+    load_ms, _ = per_call_ms(repeat, ts.ckks_vector_from, context, data)
+    dot_ms, dot = per_call_ms(repeat, vec1.dot, vec2)
+    decrypt_ms, _ = per_call_ms(repeat, dot.decrypt)
+
+    path2 = ts.ckks_vector(context, path_with_length(vectors[1], lengths[1]))
+    path1 = length_weighted_path(vectors[0], lengths[0])
+    h_v_ms, m_v = per_call_ms(repeat, lambda: (vec1.dot(vec2) - sigma) * mask)
+    h_p_ms, m_p = per_call_ms(repeat, lambda: path2.dot(((0.25 * mask) * path1).tolist()))
+    expected = float(vectors[0] @ vectors[1])
+
+    return {
+        "keygen_s": keygen_s,
+        "context_kib": len(encryption.serialize_context()) / 1024,
+        "ciphertext_kib": len(data) / 1024,
+        "encrypt_ms": encrypt_ms,
+        "serialize_ms": serialize_ms,
+        "load_ms": load_ms,
+        "dot_ms": dot_ms,
+        "decrypt_ms": decrypt_ms,
+        "h_v_ms": h_v_ms,
+        "h_p_ms": h_p_ms,
+        "h_v_error": abs(m_v.decrypt()[0] - (expected - sigma) * mask),
+        "h_p_error": abs(m_p.decrypt()[0] - expected * 0.25 * sum(1 / length for length in lengths) * mask),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--depth", type=int, nargs="+", default=[2])
+    parser.add_argument("--scale-bits", type=int, nargs="+", default=[22, 25, 30, 40])
+    parser.add_argument("--integer-bits", type=int, nargs="+", default=[8, 30],
+                        help="bits of the first prime above the scale")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        import tenseal  # noqa: F401
+        have_tenseal = True
+    except ImportError:
+        have_tenseal = False
+        print("tenseal is not installed: selected parameters only")
+    rng = np.random.default_rng(args.seed)
+
+    columns = [("keygen_s", "keygen s", ".2f"), ("context_kib", "ctx KiB", ".0f"), ("ciphertext_kib", "ct KiB", ".1f"),
+               ("encrypt_ms", "encrypt", ".2f"), ("serialize_ms", "serial.", ".2f"), ("load_ms", "load", ".2f"),
+               ("dot_ms", "dot", ".2f"), ("decrypt_ms", "decrypt", ".2f"), ("h_v_ms", "h_v", ".2f"),
+               ("h_p_ms", "h_p", ".2f"), ("h_v_error", "h_v err", ".1e"), ("h_p_error", "h_p err", ".1e")]
+    header = f"{'depth':>5}{'scale':>6}{'int':>5}  {'parameters':<34}"
+    if have_tenseal:
+        header += "".join(f"{title:>10}" for _, title, _ in columns)
+    print(header)
+    for depth in args.depth:
+        for scale_bits in args.scale_bits:
+            for integer_bits in args.integer_bits:
+                prefix = f"{depth:>5}{scale_bits:>6}{integer_bits:>5}  "
+                try:
+                    parameters = select_parameters(args.dim, depth, scale_bits, integer_bits)
+                except ValueError as e:
+                    print(f"{prefix}{e}")
+                    continue
+                row = f"{prefix}{str(parameters):<34}"
+                if have_tenseal:
+                    try:
+                        result = measure(parameters, args.dim, args.repeat, rng)
+                        row += "".join(f"{result[key]:>10{fmt}}" for key, _, fmt in columns)
+                    except ValueError as e:
+                        row += f"  failed: {e}"
+                print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Shared helpers for the off-device benchmarks.
+
+The benchmarks run on a Linux host against the modules in
+app/src/main/python, which Chaquopy bundles into the app on-device.
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYTHON_SRC = os.path.join(REPO_ROOT, "app", "src", "main", "python")
+DATASETS_DIR = os.path.join(REPO_ROOT, "app", "src", "main", "assets", "datasets")
+
+DATASETS = {
+    "amy": os.path.join(DATASETS_DIR, "synthetic", "amy.json"),
+    "bob": os.path.join(DATASETS_DIR, "synthetic", "bob.json"),
+    "amazon": os.path.join(DATASETS_DIR, "personalds", "amazon_purchases_graph.json"),
+}
+
+if PYTHON_SRC not in sys.path:
+    sys.path.insert(0, PYTHON_SRC)
+
+
+def load_scaled_graph(dataset: str, copies: int = 1):
+    """
+    Load a dataset and, for copies > 1, append disjoint copies of it so that
+    size-dependent costs can be measured on the bundled data.
+    """
+    from util import get_graph
+
+    path = DATASETS.get(dataset, dataset)
+    graph = get_graph(path, "g0")
+    for i in range(1, copies):
+        copy = get_graph(path, f"g{i}")
+        graph.vertices.extend(copy.vertices)
+        graph.edges.extend(copy.edges)
+    return graph
+
+
+def hashing_embeddings(labels, dim: int = 384):
+    """
+    Float64 matrix of StandInTextEmbedder embeddings (one row per label), the
+    off-device stand-in for TextEmbedder. Labels that share words get
+    similar vectors, which is enough to exercise similarity thresholds.
+    """
+    import numpy as np
+    from embedding_bridge import StandInTextEmbedder
+
+    embedder = StandInTextEmbedder(dim)
+    return np.array([embedder.embed(label) for label in labels]).reshape(len(labels), dim)
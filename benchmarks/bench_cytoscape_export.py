@@ -0,0 +1,62 @@
+"""
+Peak memory and wall time of writing a graph as Cytoscape.js JSON.
+
+Compares the former in-memory export (serialize_to_cytoscape + json.dump)
+with the streaming Graph.save_cytoscape_json, indented and compact.
+
+    python benchmarks/bench_cytoscape_export.py --dataset amazon --copies 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench_common import load_scaled_graph
+
+
+def in_memory_export(graph, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(graph.serialize_to_cytoscape(), f, ensure_ascii=False, indent=2)
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", default="amazon")
+    parser.add_argument("--copies", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    graph = load_scaled_graph(args.dataset, args.copies)
+    print(f"{len(graph.vertices)} vertices, {len(graph.edges)} edges")
+
+    variants = {
+        "in-memory indent=2": lambda out: in_memory_export(graph, out),
+        "streaming indent=2": lambda out: graph.save_cytoscape_json(out),
+        "streaming compact": lambda out: graph.save_cytoscape_json(out, compact=True),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'variant':<22}{'time (s)':>10}{'peak (KiB)':>12}{'size (KiB)':>12}")
+        for name, fn in variants.items():
+            output_file = os.path.join(tmp, "graph.json")
+            runs = [measure(fn, output_file) for _ in range(args.repeat)]
+            elapsed = min(t for t, _ in runs)
+            peak = max(p for _, p in runs)
+            size = os.path.getsize(output_file)
+            print(f"{name:<22}{elapsed:>10.3f}{peak / 1024:>12.1f}{size / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Duplicate-vertex removal: single-pass util implementation versus the
+former redirect-and-remove loop, plus a randomized equivalence check and
+a dedup -> snapshot -> load round-trip check.
+
+    python benchmarks/bench_dedup.py --copies 20 --trials 500
+"""
+import argparse
+import copy
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from bench_common import load_scaled_graph
+from graph import Graph, Vertex
+from snapshot import load_snapshot, save_snapshot
+from util import remove_duplicate_vertices_by_label_and_edge_label
+
+
+def reference_remove_duplicates(graph: Graph):
+    """The previous O(D*E) implementation, kept as the behavioural reference."""
+    incoming_map = defaultdict(list)
+    for edge in graph.edges:
+        incoming_map[(edge.v2.label, edge.label)].append(edge.v2)
+
+    visited = set()
+    for (label, edge_label), duplicates in incoming_map.items():
+        unique = []
+        seen_uris = set()
+        for v in duplicates:
+            if v.uri not in seen_uris:
+                unique.append(v)
+                seen_uris.add(v.uri)
+        if len(unique) <= 1:
+            continue
+
+        canonical = unique[0]
+        for dup in unique[1:]:
+            if dup in visited or dup == canonical:
+                continue
+            for edge in graph.edges:
+                if edge.v2 == dup and edge.label == edge_label:
+                    edge.v2 = canonical
+                    edge.uri = f"{edge.v1.uri}->{canonical.uri}"
+            graph.remove_vertex(dup)
+            visited.add(dup)
+
+
+def snapshot(graph: Graph):
+    return (
+        [(v.uri, v.label) for v in graph.vertices],
+        [(e.uri, e.v1.uri, e.v2.uri, e.label) for e in graph.edges],
+    )
+
+
+def random_graph(rng: random.Random) -> Graph:
+    graph = Graph()
+    n = rng.randint(1, 30)
+    labels = [f"L{i}" for i in range(rng.randint(1, 5))]
+    edge_labels = [f"r{i}" for i in range(rng.randint(1, 3))]
+    vertices = [Vertex(f"g/n{i}", rng.choice(labels)) for i in range(n)]
+    for v in vertices:
+        graph.add_vertex(v)
+    for _ in range(rng.randint(0, 3 * n)):
+        graph.add_edge(rng.choice(vertices), rng.choice(vertices), rng.choice(edge_labels))
+    return graph
+
+
+def check_equivalence(trials: int, seed: int):
+    rng = random.Random(seed)
+    for trial in range(trials):
+        graph = random_graph(rng)
+        expected_graph = copy.deepcopy(graph)
+        reference_remove_duplicates(expected_graph)
+        remove_duplicate_vertices_by_label_and_edge_label(graph)
+        if snapshot(graph) != snapshot(expected_graph):
+            raise AssertionError(f"Mismatch on trial {trial} (seed {seed})")
+    print(f"equivalence: {trials} random graphs identical")
+
+
+def dangling_graph() -> Graph:
+    """Dedup drops x but keeps r->x 'a' (z is redirected to x), leaving a dangling edge."""
+    graph = Graph()
+    r, y, x, z = (Vertex(f"g/{name}", label) for name, label in (("r", "R"), ("y", "L"), ("x", "L"), ("z", "L")))
+    for v in (r, y, x, z):
+        graph.add_vertex(v)
+    for target, label in ((y, "b"), (x, "b"), (x, "a"), (z, "a")):
+        graph.add_edge(r, target, label)
+    return graph
+
+
+def check_snapshot_round_trip(trials: int, seed: int):
+    """Deduplicated graphs, dangling edges included, survive save_snapshot and load_snapshot."""
+    rng = random.Random(seed)
+    graphs = [dangling_graph()] + [random_graph(rng) for _ in range(trials)]
+    dangling = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "graph.pkgs")
+        for trial, graph in enumerate(graphs):
+            remove_duplicate_vertices_by_label_and_edge_label(graph)
+            listed = {v.uri for v in graph.vertices}
+            dangling += any(e.v1.uri not in listed or e.v2.uri not in listed for e in graph.edges)
+            save_snapshot(graph, path)
+            loaded = load_snapshot(path)
+            expected = ([(v.uri, v.label) for v in graph.vertices],
+                        [(e.v1.uri, e.v2.uri, e.label) for e in graph.edges])
+            actual = ([(v.uri, v.label) for v in loaded.vertices],
+                      [(e.v1.uri, e.v2.uri, e.label) for e in loaded.edges])
+            if actual != expected:
+                raise AssertionError(f"Snapshot round trip differs on graph {trial} (seed {seed})")
+    print(f"snapshot round trip: {len(graphs)} deduplicated graphs identical, {dangling} with dangling edges")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", default="amazon")
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("--trials", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_equivalence(args.trials, args.seed)
+    check_snapshot_round_trip(args.trials, args.seed)
+
+    graph = load_scaled_graph(args.dataset, args.copies)
+    print(f"{len(graph.vertices)} vertices, {len(graph.edges)} edges")
+    for name, fn in (("reference", reference_remove_duplicates),
+                     ("single-pass", remove_duplicate_vertices_by_label_and_edge_label)):
+        g = copy.deepcopy(graph)
+        start = time.perf_counter()
+        fn(g)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<12} {elapsed:8.3f}s -> {len(g.vertices)} vertices, {len(g.edges)} edges")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+EmbeddingBridge batch transfer: per-row conversion vs one flat float buffer.
+
+    python benchmarks/bench_embedding_bridge.py --dataset amazon --copies 10 --repeat 5
+
+Runs off-device with StandInTextEmbedder. Its embeddings are cached after
+the first batch, like TextEmbedder's, so the timed batches measure the
+transfer into NumPy and not the embedding itself. "rows" is the previous
+path (one np.array per result element, stacked into a matrix); "flat" is
+encode_batch_matrix.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bench_common import load_scaled_graph
+from embedding_bridge import EmbeddingBridge, StandInTextEmbedder
+
+
+def rows_path(bridge: EmbeddingBridge, labels):
+    result = bridge.embedder.encodeBatch(list(labels))
+    return np.array([np.array(result[i]) for i in range(len(result))], dtype=np.float32)
+
+
+def best_of(repeat, fn, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", default="amazon")
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    graph = load_scaled_graph(args.dataset, args.copies)
+    # distinct URIs, repeated labels: the same shape as an enrichment run
+    labels = [v.label for v in graph.vertices]
+    bridge = EmbeddingBridge(None, StandInTextEmbedder(args.dim))
+
+    start = time.perf_counter()
+    flat = bridge.encode_batch_matrix(labels)
+    first = time.perf_counter() - start
+    assert np.array_equal(flat, rows_path(bridge, labels))
+
+    rows = best_of(args.repeat, rows_path, bridge, labels)
+    flat_time = best_of(args.repeat, bridge.encode_batch_matrix, labels)
+    print(f"{len(labels)} labels x {args.dim} dims ({flat.nbytes / 1024:.0f} KiB float32)")
+    print(f"first batch (embedding included): {first:.3f} s")
+    print(f"{'path':<6}{'s':>10}{'labels/s':>12}")
+    for name, seconds in (("rows", rows), ("flat", flat_time)):
+        print(f"{name:<6}{seconds:>10.4f}{len(labels) / seconds:>12.0f}")
+    print(f"speedup {rows / flat_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Memory and accuracy of EmbeddingStore dtypes (float32, float16, int8).
+
+    python benchmarks/bench_embedding_quantization.py --pairs amy:bob amazon:amazon --sigma 0.85 0.95
+
+For each server:client dataset pair, vertex labels are embedded with the
+hashing stand-in for TextEmbedder, stored in every dtype, and all
+server-client cosine similarities are compared with a float64 reference:
+the largest and mean absolute error, how many h_v decisions (similarity
+>= sigma) change, and how often the most similar client vertex changes.
+"""
+import argparse
+
+import numpy as np
+
+from bench_common import DATASETS, hashing_embeddings
+from embedding_helper import EMBEDDING_DTYPES, EmbeddingHelper, EmbeddingStore
+from util import get_graph
+
+
+def load(dataset: str, prefix: str):
+    graph = get_graph(DATASETS.get(dataset, dataset), prefix)
+    uris = [v.uri for v in graph.vertices]
+    return uris, hashing_embeddings([v.label for v in graph.vertices])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", nargs="+", default=["amy:bob", "amazon:amazon"],
+                        help="server:client dataset pairs")
+    parser.add_argument("--sigma", type=float, nargs="+", default=[0.85, 0.95])
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    for pair in args.pairs:
+        server, client = pair.split(":")
+        server_uris, server_emb = load(server, "g1")
+        client_uris, client_emb = load(client, "g2")
+        reference = server_emb @ client_emb.T
+        print(f"{server} ({len(server_uris)}) vs {client} ({len(client_uris)})")
+        header = f"  {'dtype':<8}{'KiB':>9}{'max err':>10}{'mean err':>10}{'top-1 diff':>11}"
+        header += "".join(f"{'h_v diff @' + str(s):>15}" for s in args.sigma)
+        print(header)
+        dict_kib = sum(v.nbytes for v in server_emb) / 1024
+        print(f"  {'dict':<8}{dict_kib:>9.1f}{'(float64 arrays in a dict)':>31}")
+        for dtype in EMBEDDING_DTYPES:
+            server_store = EmbeddingStore(server_uris, server_emb, dtype)
+            client_store = EmbeddingStore(client_uris, client_emb, dtype)
+            similarity = EmbeddingHelper.cosine_similarity_matrix(
+                EmbeddingHelper.normalized_matrix(server_store.rows()),
+                EmbeddingHelper.normalized_matrix(client_store.rows()))
+            error = np.abs(similarity - reference)
+            top1 = np.mean(similarity.argmax(axis=1) != reference.argmax(axis=1))
+            line = f"  {dtype:<8}{server_store.nbytes / 1024:>9.1f}{error.max():>10.2e}{error.mean():>10.2e}{top1:>10.2%} "
+            for sigma in args.sigma:
+                flipped = int(np.sum((similarity >= sigma) != (reference >= sigma)))
+                line += f"{flipped:>7} / {int(np.sum(reference >= sigma)):<5}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+End-to-end enrichment runs: server and client over loopback, off-device.
+
+    python benchmarks/bench_end_to_end.py --scenario synthetic amazon --mode plaintext secure --repeat 3 --json e2e.json
+    python benchmarks/bench_end_to_end.py --scenario gen:100 gen:1000 gen:10000 --repeat 1
+
+Every run starts the server and the client as separate processes on a free
+loopback port. They use no Android context (output goes to a temporary
+files dir, see util.get_files_dir) and the "standin" embedding backend
+unless PKGEM_EMBEDDING_BACKEND says otherwise (see embedding_backends).
+
+Per role the table and the JSON report wall time, CPU time (including
+fragment worker processes), peak RSS and the run's metrics summary
+(per-phase timings with percentiles, counters, bytes and round trips per
+message type; see metrics.Metrics). Round trips are the requests the server
+sent back over the client's connection. The datasets are copied to a
+temporary directory once per scenario, so the first repetition also writes
+the graph snapshots and later ones load them. Modes whose dependencies are
+missing on the host (tenseal for "secure") are reported as unavailable.
+The JSON records the git commit, for comparing runs across commits.
+
+--link runs every scenario over emulated links (see netem.LINKS): the
+client then talks to the server through a netem.LinkProxy in this process.
+"loopback" (the default) connects them directly.
+
+--fragments N ... runs the plaintext server's VParaMatch over N edge-cut
+fragments (server_unencrypted.fragment_parallel_match; 1, the default, is
+the sequential match). The secure server has no fragment mode.
+
+--trace chrome|speedscope and --profile <phase>,... turn on tracing.Tracer
+in both roles (PKGEM_TRACE, PKGEM_PROFILE) and copy the trace and .prof
+files of every run to --trace-dir.
+
+Scenario gen:<vertices> runs on a pair of generate_profiles.py profiles
+of that size (default fan-out, depth and overlap).
+
+Linux only: the client waits for the server's listening socket in
+/proc/net/tcp.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from bench_common import DATASETS, REPO_ROOT
+from generate_profiles import write_pair
+from netem import LINKS, LinkProxy, link_name
+
+# scenario -> (server dataset, client dataset)
+SCENARIOS = {
+    "synthetic": ("amy", "bob"),
+    # identical profiles: the most matching work, but nothing new to merge
+    "amazon": ("amazon", "amazon"),
+}
+
+# mode -> (server module, client module)
+MODES = {
+    "plaintext": ("server_unencrypted", "client_unencrypted"),
+    "secure": ("server", "client"),
+}
+
+def scenario_name(name: str) -> str:
+    if name in SCENARIOS or (name.startswith("gen:") and name[len("gen:"):].isdigit()):
+        return name
+    raise argparse.ArgumentTypeError(f"expected one of {', '.join(SCENARIOS)} or gen:<vertices>")
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def is_listening(port: int) -> bool:
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    # local address is ip:port in hex, state 0A is LISTEN
+                    if int(fields[1].rsplit(":", 1)[1], 16) == port and fields[3] == "0A":
+                        return True
+        except OSError:
+            continue
+    return False
+
+
+def wait_for_listen(port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while not is_listening(port):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"server did not listen on port {port} within {timeout:.0f} s")
+        time.sleep(0.05)
+
+
+def role_metrics(wall: float, result: dict) -> dict:
+    """Measurements of a finished server or client run (see metrics.Metrics.summary)."""
+    summary = result["metrics"]
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall_s": wall,
+        "cpu_s": time.process_time() + children.ru_utime + children.ru_stime,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "phases_s": {name: timing["sum"] for name, timing in summary["timings_s"].items()},
+        "bytes_sent": summary["bytes_sent"],
+        "bytes_received": summary["bytes_received"],
+        "round_trips": summary["round_trips"],
+        "enriched_node_count": result["enriched_node_count"],
+        "metrics": summary,
+    }
+
+
+def run_worker(args):
+    """One role of a run, in its own process; writes role_metrics to args.out."""
+    os.environ.setdefault("PKGEM_EMBEDDING_BACKEND", "standin")
+    server_module, client_module = MODES[args.mode[0]]
+    module = __import__(server_module if args.worker == "server" else client_module)
+    start = time.perf_counter()
+    if args.worker == "server":
+        fragments = args.fragments[0]
+        kwargs = {"fragments": fragments} if fragments > 1 else {}
+        result = module.main(args.dataset, None, port=args.port, **kwargs)
+    else:
+        wait_for_listen(args.port, args.timeout)
+        start = time.perf_counter()
+        result = module.main(args.dataset, None, "127.0.0.1", port=args.port)
+    metrics = role_metrics(time.perf_counter() - start, result)
+    with open(args.out, "w") as f:
+        json.dump(metrics, f)
+
+
+def last_line(path: str) -> str:
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return lines[-1] if lines else "no output"
+
+
+TRACE_SUFFIXES = (".trace.json", ".speedscope.json", ".prof")
+
+
+def run_pair(mode: str, server_dataset: str, client_dataset: str, workdir: str, timeout: float,
+             trace_dir: Optional[str] = None, trace_prefix: str = "", link: str = "loopback",
+             fragments: int = 1) -> dict:
+    """
+    Run server and client once and return {"server": metrics, "client": metrics} or {"error": ...}.
+    Trace and profile files are copied to trace_dir as <trace_prefix><file name>.
+    """
+    port = free_port()
+    proxy = None
+    client_port = port
+    if link != "loopback":
+        up, down = LINKS[link]
+        proxy = LinkProxy(("127.0.0.1", port), up, down, connect_timeout=timeout).__enter__()
+        client_port = proxy.port
+    try:
+        run = _run_pair(mode, server_dataset, client_dataset, workdir, timeout, port, client_port, fragments)
+    finally:
+        if proxy is not None:
+            proxy.close()
+    if trace_dir is not None and "error" not in run:
+        for role in ("server", "client"):
+            files_dir = os.path.join(workdir, role)
+            for name in os.listdir(files_dir):
+                if name.endswith(TRACE_SUFFIXES):
+                    shutil.copy(os.path.join(files_dir, name), os.path.join(trace_dir, trace_prefix + name))
+    return run
+
+
+def _run_pair(mode: str, server_dataset: str, client_dataset: str, workdir: str, timeout: float,
+              port: int, client_port: int, fragments: int = 1) -> dict:
+    procs = {}
+    for role, dataset in (("server", server_dataset), ("client", client_dataset)):
+        files_dir = os.path.join(workdir, role)
+        os.makedirs(files_dir, exist_ok=True)
+        env = dict(os.environ, PKGEM_FILES_DIR=files_dir, PYTHONDONTWRITEBYTECODE="1")
+        log = open(os.path.join(files_dir, "log.txt"), "w")
+        procs[role] = (subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", role, "--mode", mode,
+             "--dataset", dataset, "--port", str(port if role == "server" else client_port),
+             "--timeout", str(timeout), "--fragments", str(fragments),
+             "--out", os.path.join(files_dir, "metrics.json")],
+            stdout=log, stderr=subprocess.STDOUT, env=env), log)
+
+    run = {}
+    deadline = time.monotonic() + timeout
+    for role in ("client", "server"):
+        proc, log = procs[role]
+        try:
+            proc.wait(timeout=max(deadline - time.monotonic(), 1))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        log.close()
+        files_dir = os.path.join(workdir, role)
+        if proc.returncode != 0:
+            for other, _ in procs.values():
+                if other.poll() is None:
+                    other.kill()
+            return {"error": f"{role}: {last_line(os.path.join(files_dir, 'log.txt'))}"}
+        with open(os.path.join(files_dir, "metrics.json")) as f:
+            run[role] = json.load(f)
+    return run
+
+
+def git_commit() -> str:
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() or "unknown"
+
+
+def summary(run: dict) -> dict:
+    server, client = run["server"], run["client"]
+    return {
+        "server_wall_s": server["wall_s"],
+        "server_cpu_s": server["cpu_s"],
+        "client_cpu_s": client["cpu_s"],
+        "bytes_up": client["bytes_sent"],
+        "bytes_down": server["bytes_sent"],
+        "round_trips": server["round_trips"],
+        "enriched_nodes": server["enriched_node_count"],
+    }
+
+
+def run_link(args, results: dict, scenario: str, mode: str, link: str, datasets, tmp: str, trace_dir: Optional[str],
+             fragments: int = 1):
+    """args.repeat runs of one scenario, mode, link and fragment count; prints a table row and stores them in results."""
+    key = f"{scenario}/{mode}" if link == "loopback" else f"{scenario}/{mode}/{link}"
+    tag = mode if link == "loopback" else f"{mode}-{link}"
+    if fragments > 1:
+        key += f"/fragments-{fragments}"
+        tag += f"-f{fragments}"
+    prefix = f"{scenario:<11}{mode:<11}{link:<17}{fragments:>5}"
+    if fragments > 1 and mode != "plaintext":
+        print(f"{prefix}{'-':>8}  unavailable: fragments need plaintext mode")
+        results["runs"][key] = {"error": "fragments need plaintext mode"}
+        return
+    runs = []
+    for i in range(args.repeat):
+        run = run_pair(mode, datasets[0], datasets[1], os.path.join(tmp, f"{tag}-{i}"), args.timeout,
+                       trace_dir, f"{scenario.replace(':', '-')}-{tag}-{i}-", link, fragments)
+        runs.append(run)
+        if "error" in run:
+            break
+    if "error" in runs[-1]:
+        print(f"{prefix}{'-':>8}  unavailable: {runs[-1]['error']}")
+        results["runs"][key] = {"error": runs[-1]["error"]}
+        return
+
+    best = min(runs, key=lambda r: r["server"]["wall_s"])
+    s = summary(best)
+    print(f"{prefix}{s['server_wall_s']:>8.2f}{s['server_cpu_s']:>9.2f}"
+          f"{s['client_cpu_s']:>9.2f}{s['bytes_up'] / 1024:>10.1f}{s['bytes_down'] / 1024:>10.1f}"
+          f"{s['round_trips']:>7}{s['enriched_nodes']:>10}")
+    if args.phases:
+        for role in ("server", "client"):
+            phases = sorted(best[role]["phases_s"].items(), key=lambda item: -item[1])
+            print(f"    {role}: " + ", ".join(f"{name} {seconds:.3f}" for name, seconds in phases))
+    results["runs"][key] = {"best": s, "runs": runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", default=["synthetic"], type=scenario_name,
+                        help=f"{', '.join(SCENARIOS)} or gen:<vertices>")
+    parser.add_argument("--mode", nargs="+", default=["plaintext"], choices=sorted(MODES))
+    parser.add_argument("--link", nargs="+", default=["loopback"], type=link_name,
+                        help=f"emulated links: {', '.join(LINKS)}")
+    parser.add_argument("--fragments", type=int, nargs="+", default=[1],
+                        help="edge-cut fragments for the plaintext server's VParaMatch")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per run")
+    parser.add_argument("--phases", action="store_true", help="also print the per-phase times of the best run")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--trace", choices=["chrome", "speedscope"], help="record span traces in this format")
+    parser.add_argument("--profile", help="comma-separated phases to run under cProfile, or *")
+    parser.add_argument("--trace-dir", default="traces", help="where --trace and --profile files go")
+    # internal: run one role of a pair
+    parser.add_argument("--worker", choices=["server", "client"], help=argparse.SUPPRESS)
+    parser.add_argument("--dataset", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    trace_dir = None
+    if args.trace or args.profile:
+        os.environ.update({"PKGEM_TRACE": args.trace or "", "PKGEM_PROFILE": args.profile or ""})
+        trace_dir = args.trace_dir
+        os.makedirs(trace_dir, exist_ok=True)
+
+    results = {"commit": git_commit(), "embedding_backend": os.environ.get("PKGEM_EMBEDDING_BACKEND", "standin"),
+               "links": {name: [repr(link) for link in LINKS[name]] for name in args.link}, "runs": {}}
+    print(f"{'scenario':<11}{'mode':<11}{'link':<17}{'frag':>5}{'wall s':>8}{'srv cpu':>9}{'cli cpu':>9}"
+          f"{'up KiB':>10}{'down KiB':>10}{'trips':>7}{'enriched':>10}")
+    for scenario in args.scenario:
+        with tempfile.TemporaryDirectory(prefix=f"e2e-{scenario}-") as tmp:
+            if scenario.startswith("gen:"):
+                datasets = write_pair(tmp, int(scenario[len("gen:"):]))
+            else:
+                datasets = []
+                for name in SCENARIOS[scenario]:
+                    path = os.path.join(tmp, os.path.basename(DATASETS[name]))
+                    if not os.path.exists(path):
+                        shutil.copy(DATASETS[name], path)
+                    datasets.append(path)
+
+            for mode in args.mode:
+                for link in args.link:
+                    for fragments in args.fragments:
+                        run_link(args, results, scenario, mode, link, datasets, tmp, trace_dir, fragments)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Cold-start import time per entry point, measured with python -X importtime.
+
+    python benchmarks/bench_importtime.py --repeat 5 --top 8 --json importtime.json
+
+Every entry point is imported in a fresh interpreter. The table reports the
+fastest of --repeat runs, the heaviest modules it pulled in and whether it
+loaded tenseal or scipy (the plaintext entry points must load neither).
+Entry points whose dependencies are missing on the host are reported as
+unavailable.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from bench_common import PYTHON_SRC
+
+# name -> modules imported by that entry point, in order
+ENTRY_POINTS = {
+    "mobile_entry": ["mobile_entry"],
+    "server (plaintext)": ["mobile_entry", "server_unencrypted"],
+    "client (plaintext)": ["mobile_entry", "client_unencrypted"],
+    "server (secure)": ["mobile_entry", "server"],
+    "client (secure)": ["mobile_entry", "client"],
+    "graph + snapshot": ["graph", "snapshot"],
+}
+
+WATCHED = ("tenseal", "scipy", "numpy")
+
+
+def measure(modules):
+    """
+    Import modules in a fresh interpreter and return
+    (total cumulative us, {module: cumulative us}, error or None).
+    """
+    code = "; ".join(f"import {m}" for m in modules) or "pass"
+    env = dict(os.environ, PYTHONPATH=PYTHON_SRC, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=PYTHON_SRC, env=env, capture_output=True, text=True)
+    cumulative = {}
+    other = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # header line
+        name = fields[2].strip()
+        cumulative[name] = int(fields[1])
+    if proc.returncode != 0:
+        error = other[-1] if other else f"exit status {proc.returncode}"
+        return None, cumulative, error
+    total = sum(us for name, us in cumulative.items() if name in modules)
+    return total, cumulative, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="heaviest modules to list per entry point")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # modules the interpreter imports at startup are not charged to entry points
+    _, startup, _ = measure([])
+
+    results = {}
+    print(f"{'entry point':<20}{'ms':>9}  {'loads':<20}heaviest modules")
+    for name, modules in ENTRY_POINTS.items():
+        best = None
+        for _ in range(args.repeat):
+            total, cumulative, error = measure(modules)
+            if error:
+                break
+            if best is None or total < best[0]:
+                best = (total, cumulative)
+        if error:
+            print(f"{name:<20}{'-':>9}  unavailable: {error}")
+            results[name] = {"error": error}
+            continue
+
+        total, cumulative = best
+        loaded = [m for m in WATCHED if m in cumulative]
+        # heaviest non-top-level modules, by cumulative time
+        heaviest = sorted(((us, m) for m, us in cumulative.items() if m not in modules and m not in startup and "." not in m),
+                          reverse=True)[:args.top]
+        print(f"{name:<20}{total / 1000:>9.1f}  {','.join(loaded) or '-':<20}"
+              + ", ".join(f"{m} {us / 1000:.1f}" for us, m in heaviest))
+        results[name] = {
+            "total_ms": total / 1000,
+            "loads": loaded,
+            "heaviest_ms": {m: us / 1000 for us, m in heaviest},
+        }
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Cut edges, border nodes and balance of Graph.edge_cut_partition strategies.
+
+    python benchmarks/bench_partition.py --dataset amazon --copies 3 --fragments 2 4 8
+"""
+import argparse
+import time
+
+from bench_common import load_scaled_graph
+from graph import Graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", default="amazon")
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--fragments", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    graph = load_scaled_graph(args.dataset, args.copies)
+    print(f"{len(graph.vertices)} vertices, {len(graph.edges)} edges")
+    print(f"{'n':>3} {'strategy':<11}{'cut':>7}{'cut %':>8}{'border':>8}{'balance':>9}{'time (s)':>10}")
+    for n in args.fragments:
+        for strategy in ("contiguous", "greedy"):
+            start = time.perf_counter()
+            partitions = graph.edge_cut_partition(n, strategy)
+            elapsed = time.perf_counter() - start
+            stats = Graph.partition_stats(partitions)
+            print(f"{n:>3} {strategy:<11}{stats['cut_edges']:>7}{100 * stats['cut_ratio']:>7.1f}%"
+                  f"{stats['border_nodes']:>8}{stats['balance']:>9.2f}{elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
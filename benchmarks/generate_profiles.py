@@ -0,0 +1,172 @@
+"""
+Synthetic pairs of purchase-history profiles for load testing.
+
+    python benchmarks/generate_profiles.py --vertices 100 1000 10000 100000 --fanout 3 --depth 2 --overlap 0.5 --out profiles/
+
+Each profile is built from synthetic purchase records with
+AmazonToGraphConverter.process_purchase_record (assets/datasets/personalds),
+so it has the schema of amazon_purchases_graph.json: User -> Purchase ->
+Product -> Category, with shared Price, Date -> Month -> Year, TimeOfDay,
+Source, Quantity and Environment hubs.
+
+- vertices: records are added until a profile has this many vertices.
+- fanout: up to this many products per purchase (records sharing a
+  purchase_id).
+- depth: category levels above a product. 1 is the converter's schema;
+  2 adds a Department and 3 a Marketplace root above it, further levels
+  are numbered.
+- overlap: share of the second profile's products (and purchase dates)
+  drawn from the first profile's catalog; the rest is disjoint.
+
+The two profiles of a pair are written as <out>/gen-<vertices>-a.json and
+-b.json, in the Cytoscape.js format get_graph reads.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from bench_common import DATASETS_DIR
+
+sys.path.insert(0, os.path.join(DATASETS_DIR, "personalds"))
+from amazon_to_graph_converter import AmazonToGraphConverter  # noqa: E402
+
+# a keyword per category that AmazonToGraphConverter.extract_product_category recognizes
+KEYWORDS = {
+    "Electronics": ["phone", "usb cable", "laptop", "docking station", "ipad case"],
+    "Kitchen": ["knife", "blender", "tea kettle", "wok", "cookware set"],
+    "Food": ["rice", "noodle", "juice", "yogurt", "tofu"],
+    "Home": ["candle", "comforter", "window cleaner", "bed sheet"],
+    "Health": ["vitamin", "supplement", "eye drops"],
+    "Outdoor": ["backpack", "neck gaiter", "outdoor lantern"],
+    "Office": ["printer ink", "study lamp", "office stapler"],
+    "Gift": ["gift card"],
+    "Clothing": ["socks", "shirt", "pants", "shoes"],
+}
+BRANDS = ["Acme", "Northwind", "Contoso", "Fabrikam", "Globex", "Initech", "Umbrella", "Hooli", "Vandelay", "Wayne"]
+ADJECTIVES = ["Compact", "Deluxe", "Organic", "Classic", "Portable", "Premium", "Eco", "Smart", "Mini", "Pro"]
+DEPARTMENTS = {
+    "Electronics": "Technology", "Office": "Technology",
+    "Kitchen": "Home & Living", "Home": "Home & Living",
+    "Food": "Grocery", "Health": "Health & Beauty", "Beauty": "Health & Beauty",
+    "Outdoor": "Sports & Outdoors", "Clothing": "Fashion", "Gift": "Gifts", "Other": "Other",
+}
+
+Product = Tuple[str, str, str]  # (name, product id, price)
+
+
+def make_catalog(size: int, rng: random.Random, tag: str) -> List[Product]:
+    """size distinct products; tag keeps the catalogs of different peers disjoint."""
+    catalog = []
+    categories = list(KEYWORDS)
+    for i in range(size):
+        keyword = rng.choice(KEYWORDS[categories[i % len(categories)]])
+        name = f"{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {keyword} {tag}{i}"
+        catalog.append((name, f"B{tag.upper()}{i:08d}", f"{rng.randint(1, 300)}.{rng.randint(0, 99):02d}"))
+    return catalog
+
+
+def add_taxonomy(converter: AmazonToGraphConverter, depth: int):
+    """Link every Category node to depth - 1 levels of parent categories."""
+    categories = [n for n in list(converter.nodes) if converter.node_map.get(f"{n['labels'][0]}_Category") == n["id"]]
+    linked = set()
+    for node in categories:
+        child_id = node["id"]
+        parent = DEPARTMENTS.get(node["labels"][0], "Other")
+        for level in range(2, depth + 1):
+            if level == 3:
+                parent = "Marketplace"
+            elif level > 3:
+                parent = f"Level {level} Category"
+            parent_id = converter.get_or_create_node(parent, [f"Category{level}"])
+            edge = (child_id, parent_id)
+            if edge in linked:
+                break  # the rest of the chain is shared
+            linked.add(edge)
+            converter.add_edge(child_id, parent_id, ["subcategory_of"])
+            child_id = parent_id
+
+
+def generate_profile(vertices: int, catalog: List[Product], dates: List[datetime], fanout: int, depth: int,
+                     rng: random.Random, tag: str) -> Dict[str, list]:
+    converter = AmazonToGraphConverter()
+    purchase = 0
+    while len(converter.nodes) < vertices:
+        purchase_id = f"{tag}-{purchase:03d}-{rng.randint(0, 9999999):07d}"
+        start = rng.choice(dates) + timedelta(minutes=rng.randrange(24 * 60))
+        for _ in range(rng.randint(1, fanout)):
+            name, product_id, price = rng.choice(catalog)
+            converter.process_purchase_record({
+                "type": "purchase",
+                "source": "Amazon",
+                "purchase_id": purchase_id,
+                "productName": name,
+                "productId": product_id,
+                "productPrice": price,
+                "productQuantity": str(rng.choice([1, 1, 1, 2, 3])),
+                "startTime": start.isoformat(),
+                "outdoor": rng.choice([0, 1]),
+            })
+        purchase += 1
+    add_taxonomy(converter, depth)
+    return {"nodes": converter.nodes, "edges": converter.edges}
+
+
+def generate_pair(vertices: int, fanout: int = 2, depth: int = 1, overlap: float = 0.5,
+                  seed: int = 0) -> Tuple[Dict[str, list], Dict[str, list]]:
+    """Two profiles of about vertices vertices each; see the module docstring."""
+    rng = random.Random(seed)
+    # about six vertices per product (product, code, purchase, purchase code, hubs)
+    catalog_size = max(10, vertices // 6)
+    catalog_a = make_catalog(catalog_size, rng, "a")
+    catalog_b = make_catalog(catalog_size, rng, "b")
+    shared = rng.sample(catalog_a, int(overlap * catalog_size))
+    catalog_b = shared + catalog_b[:catalog_size - len(shared)]
+
+    days = max(30, vertices // 50)
+    base = datetime(2024, 1, 1)
+    dates_a = [base + timedelta(days=i) for i in range(days)]
+    dates_b = rng.sample(dates_a, int(overlap * days)) + [base + timedelta(days=days + i)
+                                                          for i in range(days - int(overlap * days))]
+    return (generate_profile(vertices, catalog_a, dates_a, fanout, depth, rng, "a"),
+            generate_profile(vertices, catalog_b, dates_b, fanout, depth, rng, "b"))
+
+
+def write_pair(out_dir: str, vertices: int, **kwargs) -> Tuple[str, str]:
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for suffix, profile in zip("ab", generate_pair(vertices, **kwargs)):
+        path = os.path.join(out_dir, f"gen-{vertices}-{suffix}.json")
+        with open(path, "w") as f:
+            json.dump(profile, f)
+        paths.append(path)
+    return paths[0], paths[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vertices", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--fanout", type=int, default=2)
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="profiles")
+    args = parser.parse_args()
+
+    print(f"{'vertices':>9}{'a nodes':>9}{'a edges':>9}{'b nodes':>9}{'b edges':>9}  files")
+    for vertices in args.vertices:
+        paths = write_pair(args.out, vertices, fanout=args.fanout, depth=args.depth, overlap=args.overlap,
+                           seed=args.seed)
+        sizes = []
+        for path in paths:
+            with open(path) as f:
+                profile = json.load(f)
+            sizes += [len(profile["nodes"]), len(profile["edges"])]
+        print(f"{vertices:>9}" + "".join(f"{n:>9}" for n in sizes) + "  " + ", ".join(paths))
+
+
+if __name__ == "__main__":
+    main()
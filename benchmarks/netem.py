@@ -0,0 +1,232 @@
+"""
+Emulated mobile links for protocol experiments: a TCP proxy that adds
+latency, jitter, a bandwidth cap and a packet-size limit per direction.
+
+    python benchmarks/netem.py --listen 7000 --target 127.0.0.1:65432 --link wifi-direct
+    python benchmarks/bench_end_to_end.py --scenario amazon --link loopback wifi-direct bluetooth
+
+bench_end_to_end starts a LinkProxy between the client and the server, so
+every upload, request and reply of a run crosses the emulated link.
+
+Model, per direction: data is cut into packets of at most mtu bytes. Each
+packet occupies the link for (size + PACKET_OVERHEAD) / bandwidth and is
+delivered latency + jitter later (jitter uniform in [-jitter, +jitter],
+never reordering packets, like TCP). At most queue_packets packets are in
+flight; beyond that the sender is blocked, as by a full socket buffer.
+This runs in user space on top of loopback TCP: it shapes what the
+protocol sees (RTTs, transfer times), not TCP's own congestion control,
+which keeps it portable and free of root privileges (unlike tc netem).
+"""
+import argparse
+import queue
+import random
+import socket
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# TCP/IP header bytes per packet, counted against the bandwidth
+PACKET_OVERHEAD = 40
+
+
+class Link:
+    """One direction of an emulated link."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, bandwidth_kbps: Optional[float] = None,
+                 mtu: int = 65536, queue_packets: int = 256):
+        self.latency = latency_ms / 1e3
+        self.jitter = jitter_ms / 1e3
+        # bytes per second, None for unlimited
+        self.bandwidth = bandwidth_kbps * 1000 / 8 if bandwidth_kbps else None
+        self.mtu = mtu
+        self.queue_packets = queue_packets
+
+    def __repr__(self):
+        rate = f"{self.bandwidth * 8 / 1000:.0f} kbit/s" if self.bandwidth else "unlimited"
+        return (f"Link(latency {self.latency * 1e3:.1f} ms, jitter {self.jitter * 1e3:.1f} ms, {rate}, "
+                f"mtu {self.mtu})")
+
+
+# name -> (client to server, server to client); rough figures for the links enrichment runs over
+LINKS: Dict[str, Tuple[Link, Link]] = {
+    # no proxy at all
+    "loopback": (Link(), Link()),
+    "wifi-direct": (Link(2.5, 1.0, 40_000, 1460), Link(2.5, 1.0, 40_000, 1460)),
+    "wifi-direct-busy": (Link(15, 8, 8_000, 1460), Link(15, 8, 8_000, 1460)),
+    "bluetooth": (Link(15, 5, 1_500, 990), Link(15, 5, 1_500, 990)),
+    "lte": (Link(25, 10, 5_000, 1400), Link(20, 10, 20_000, 1400)),
+}
+
+
+def link_name(name: str) -> str:
+    if name in LINKS:
+        return name
+    raise argparse.ArgumentTypeError(f"expected one of {', '.join(LINKS)}")
+
+
+class _Pipe:
+    """Bytes from src to dst shaped by link: a reader thread schedules packets, a writer thread delivers them."""
+
+    def __init__(self, src: socket.socket, dst: socket.socket, link: Link, rng: random.Random, stats: dict):
+        self.src = src
+        self.dst = dst
+        self.link = link
+        self.rng = rng
+        self.stats = stats
+        self.packets: "queue.Queue[Optional[Tuple[float, bytes]]]" = queue.Queue(maxsize=link.queue_packets)
+        self.threads = [threading.Thread(target=self._read, daemon=True),
+                        threading.Thread(target=self._write, daemon=True)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _read(self):
+        link = self.link
+        link_free = 0.0
+        last_delivery = 0.0
+        try:
+            while True:
+                data = self.src.recv(1 << 16)
+                if not data:
+                    break
+                for i in range(0, len(data), link.mtu):
+                    packet = data[i:i + link.mtu]
+                    now = time.monotonic()
+                    departure = now
+                    if link.bandwidth:
+                        link_free = max(link_free, now) + (len(packet) + PACKET_OVERHEAD) / link.bandwidth
+                        departure = link_free
+                    delay = link.latency + (self.rng.uniform(-link.jitter, link.jitter) if link.jitter else 0.0)
+                    last_delivery = max(last_delivery, departure + max(delay, 0.0))
+                    self.packets.put((last_delivery, packet))
+                    self.stats["packets"] += 1
+                    self.stats["bytes"] += len(packet)
+        except OSError:
+            pass
+        self.packets.put(None)
+
+    def _write(self):
+        try:
+            while True:
+                item = self.packets.get()
+                if item is None:
+                    break
+                delivery, packet = item
+                wait = delivery - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.dst.sendall(packet)
+            # pass the end of stream on, so the peer sees it after the last packet
+            self.dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class LinkProxy:
+    """
+    Listens on 127.0.0.1:port and relays every accepted connection to
+    target through an emulated link: up shapes the connecting side's
+    traffic, down the target's replies. Connecting to target is retried
+    for connect_timeout seconds, so the proxy may start before the server.
+    """
+
+    def __init__(self, target: Tuple[str, int], up: Link, down: Link, port: int = 0, seed: int = 0,
+                 connect_timeout: float = 600.0, host: str = "127.0.0.1"):
+        self.target = target
+        self.up = up
+        self.down = down
+        self.connect_timeout = connect_timeout
+        self.rng = random.Random(seed)
+        self.stats = {"up": {"packets": 0, "bytes": 0}, "down": {"packets": 0, "bytes": 0}}
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        self._sockets = []
+        self._thread = threading.Thread(target=self._accept, name="link-proxy", daemon=True)
+
+    def __enter__(self) -> "LinkProxy":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _connect_target(self) -> socket.socket:
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection(self.target)
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            try:
+                server = self._connect_target()
+            except OSError:
+                client.close()
+                continue
+            for s in (client, server):
+                # the link model, not Nagle, decides when bytes move
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sockets += [client, server]
+            _Pipe(client, server, self.up, self.rng, self.stats["up"]).start()
+            _Pipe(server, client, self.down, self.rng, self.stats["down"]).start()
+
+    def close(self):
+        self.listener.close()
+        for s in self._sockets:
+            try:
+                s.close()
+            except OSError:
+                pass
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--listen", type=int, required=True, help="port to accept clients on")
+    parser.add_argument("--host", default="127.0.0.1", help="address to accept clients on")
+    parser.add_argument("--target", type=parse_address, required=True, help="server host:port")
+    parser.add_argument("--link", type=link_name, default="wifi-direct")
+    parser.add_argument("--latency", type=float, help="one-way latency in ms, overrides the link's")
+    parser.add_argument("--jitter", type=float, help="jitter in ms, overrides the link's")
+    parser.add_argument("--bandwidth", type=float, help="kbit/s per direction, overrides the link's")
+    parser.add_argument("--mtu", type=int, help="packet size limit in bytes, overrides the link's")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    links = []
+    for link in LINKS[args.link]:
+        links.append(Link(args.latency if args.latency is not None else link.latency * 1e3,
+                          args.jitter if args.jitter is not None else link.jitter * 1e3,
+                          args.bandwidth if args.bandwidth is not None else (
+                              link.bandwidth * 8 / 1000 if link.bandwidth else None),
+                          args.mtu or link.mtu, link.queue_packets))
+    with LinkProxy(args.target, links[0], links[1], port=args.listen, seed=args.seed, host=args.host) as proxy:
+        print(f"{args.host}:{proxy.port} -> {args.target[0]}:{args.target[1]}")
+        print(f"  up:   {links[0]}\n  down: {links[1]}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(f"up {proxy.stats['up']}, down {proxy.stats['down']}")
+
+
+if __name__ == "__main__":
+    main()